@@ -1,14 +1,32 @@
-from typing import Any, Callable, Union
+from typing import Any, Callable, Optional, Union
 
 import json
 import logging
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from pajbot import utils
 from pajbot.models.emote import Emote
+from pajbot.utils import iterate_in_chunks
 
 log = logging.getLogger(__name__)
 
+# Number of responses kept in memory, shared by all API caches
+L1_MAX_SIZE = 10000
+# Responses are served from memory for this many seconds (or less, if they expire sooner)
+L1_TTL = 10
+# After that, they are served from memory for up to this many more seconds while they are refreshed in the background
+L1_STALE_TTL = 20
+# Results of None (e.g. a user that doesn't exist) are cached for at most this many seconds, unless expiry is a lambda
+NEGATIVE_EXPIRY = 30
+# Number of threads refreshing stale responses
+REFRESH_WORKERS = 2
+# Bulk lookups read at most this many keys with a single MGET
+BULK_READ_CHUNK_SIZE = 1000
+
 
 class BaseJsonSerializer(ABC):
     def serialize(self, fetch_result):
@@ -84,82 +102,262 @@ class TwitchChannelEmotesSerializer(BaseJsonSerializer):
         return tuple([[Emote.from_json(e) for e in s] for s in cache_result])
 
 
+class _L1Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value: str, fresh_until: float, stale_until: float) -> None:
+        # serialized, so every caller gets its own copy of the result
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class L1Cache:
+    """Thread-safe in-process LRU of serialized responses, where each entry has its own time to live"""
+
+    def __init__(self, max_size: int = L1_MAX_SIZE, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, _L1Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: str) -> Optional[tuple[str, bool]]:
+        """Returns the value and whether it is still fresh, or None if there is no usable entry"""
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+
+            if entry.stale_until <= now:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry.value, entry.fresh_until > now
+
+    def set(self, key: str, value: str, expiry: int) -> None:
+        now = self.clock()
+        fresh_for = min(L1_TTL, expiry)
+        entry = _L1Entry(value, now + fresh_for, now + fresh_for + min(L1_STALE_TTL, expiry))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class CacheStats:
+    """Hit/miss counters per key prefix (the key up to its last colon)"""
+
+    COUNTERS = ("l1_hits", "stale_hits", "redis_hits", "misses")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.counters: dict[str, dict[str, int]] = {}
+
+    @staticmethod
+    def get_prefix(redis_key: str) -> str:
+        return redis_key.rpartition(":")[0] or redis_key
+
+    def record(self, redis_key: str, counter: str, amount: int = 1) -> None:
+        prefix = self.get_prefix(redis_key)
+        with self.lock:
+            counters = self.counters.get(prefix, None)
+            if counters is None:
+                counters = self.counters[prefix] = dict.fromkeys(self.COUNTERS, 0)
+            counters[counter] += amount
+
+    def get(self) -> dict[str, dict[str, int]]:
+        """Counters per prefix, prefixes with the most lookups first"""
+        with self.lock:
+            return {
+                prefix: dict(counters)
+                for prefix, counters in sorted(self.counters.items(), key=lambda item: -sum(item[1].values()))
+            }
+
+
 class APIResponseCache:
-    def __init__(self, redis):
+    """
+    Caches API responses in redis, and in an in-process LRU (shared by all instances) in front of it.
+
+    Responses are served from memory for L1_TTL seconds. For L1_STALE_TTL seconds after that, the stale response is
+    still returned right away, while it is refreshed (from redis, or from the API) on a background thread.
+    """
+
+    l1 = L1Cache()
+    stats = CacheStats()
+    refresh_executor = ThreadPoolExecutor(REFRESH_WORKERS, thread_name_prefix="APICacheRefresh")
+    # redis keys that are being refreshed in the background
+    refreshing: set[str] = set()
+    refreshing_lock = threading.Lock()
+
+    def __init__(self, redis, l1: Optional[L1Cache] = None, stats: Optional[CacheStats] = None):
         self.redis = redis
+        if l1 is not None:
+            self.l1 = l1
+        if stats is not None:
+            self.stats = stats
 
-    def cache_fetch_fn(
+    @staticmethod
+    def _get_expiry(fetch_result: Any, expiry: Union[int, Callable[[Any], int]]) -> int:
+        if callable(expiry):
+            # then expiry is a lambda that computes the expiry based upon the fetch result
+            return expiry(fetch_result)
+
+        if fetch_result is None:
+            # negative result, e.g. the thing that was looked up doesn't exist
+            return min(expiry, NEGATIVE_EXPIRY)
+
+        return expiry
+
+    def _store(
+        self,
+        redis_key: str,
+        fetch_result: Any,
+        serializer: Any,
+        expiry: Union[int, Callable[[Any], int]],
+        pipeline: Optional[Any] = None,
+    ) -> None:
+        """Cache the fetch result. If a pipeline is given, the redis write is queued on it"""
+        expiry_value = self._get_expiry(fetch_result, expiry)
+
+        # expiry = 0 can be used to indicate the result should not be cached
+        # (Redis will raise an error if we try to SETEX with time = 0 so this check is done before calling Redis)
+        if expiry_value > 0:
+            serialized = serializer.serialize(fetch_result)
+            (pipeline if pipeline is not None else self.redis).setex(redis_key, expiry_value, serialized)
+            self.l1.set(redis_key, serialized, expiry_value)
+
+    def _load(
         self,
         redis_key: str,
         fetch_fn: Callable[[], Any],
-        serializer: Any = JsonSerializer(),
-        expiry: Union[int, Callable[[Any], int]] = 120,
-        force_fetch: bool = False,
+        serializer: Any,
+        expiry: Union[int, Callable[[Any], int]],
     ) -> Any:
-        if not force_fetch:
-            cache_result = self.redis.get(redis_key)
-            if cache_result is not None:
-                return serializer.deserialize(cache_result)
-
+        """Look up the key in redis, and fetch it on a miss"""
+        cache_result = self.redis.get(redis_key)
+        if cache_result is not None:
+            self.stats.record(redis_key, "redis_hits")
+            result = serializer.deserialize(cache_result)
+            expiry_value = self._get_expiry(result, expiry)
+            if expiry_value > 0:
+                self.l1.set(redis_key, cache_result, expiry_value)
+            return result
+
+        self.stats.record(redis_key, "misses")
         log.debug("Cache Miss: %s", redis_key)
         fetch_result = fetch_fn()
+        self._store(redis_key, fetch_result, serializer, expiry)
+        return fetch_result
 
-        if callable(expiry):
-            # then expiry is a lambda that computes the expiry based upon the fetch result
-            expiry = expiry(fetch_result)
+    def _refresh_in_background(
+        self,
+        redis_key: str,
+        fetch_fn: Callable[[], Any],
+        serializer: Any,
+        expiry: Union[int, Callable[[Any], int]],
+    ) -> None:
+        with self.refreshing_lock:
+            if redis_key in self.refreshing:
+                return
+            self.refreshing.add(redis_key)
+
+        def refresh() -> None:
+            try:
+                self._load(redis_key, fetch_fn, serializer, expiry)
+            except:
+                log.exception(f"Failed to refresh {redis_key}")
+            finally:
+                with self.refreshing_lock:
+                    self.refreshing.discard(redis_key)
+
+        self.refresh_executor.submit(refresh)
 
-        # expiry = 0 can be used to indicate the result should not be cached
-        # (Redis will raise an error if we try to SETEX with time = 0 so this check is done before calling Redis)
-        if expiry > 0:
-            self.redis.setex(redis_key, expiry, serializer.serialize(fetch_result))
-        return fetch_result
+    def cache_fetch_fn(
+        self,
+        redis_key: str,
+        fetch_fn: Callable[[], Any],
+        serializer: Any = JsonSerializer(),
+        expiry: Union[int, Callable[[Any], int]] = 120,
+        force_fetch: bool = False,
+    ) -> Any:
+        if force_fetch:
+            self.stats.record(redis_key, "misses")
+            fetch_result = fetch_fn()
+            self._store(redis_key, fetch_result, serializer, expiry)
+            return fetch_result
+
+        l1_result = self.l1.get(redis_key)
+        if l1_result is not None:
+            value, fresh = l1_result
+            if fresh:
+                self.stats.record(redis_key, "l1_hits")
+            else:
+                self.stats.record(redis_key, "stale_hits")
+                self._refresh_in_background(redis_key, fetch_fn, serializer, expiry)
+            return serializer.deserialize(value)
+
+        return self._load(redis_key, fetch_fn, serializer, expiry)
 
     def cache_bulk_fetch_fn(
         self, input_data, redis_key_fn, fetch_fn, serializer=JsonSerializer(), expiry=120, force_fetch=False
     ):
-        # results contains the wanted results, already in the correct list index (e.g. if we had a cache
-        # hit for the third element (index 2),
-        # then the cache result for the third element will be in this list, at index 2)
-        results = []
+        redis_keys = [redis_key_fn(input_entry) for input_entry in input_data]
+        results: list[Any] = [None] * len(input_data)
 
-        # to_fetch contains is a list of tuples (idx, input_entry) of input entries (with their index)
-        # that did not have a cache hit, and that need to be fetched. After successful fetch, the result
-        # should be inserted into `results` at `idx`.
-        to_fetch = []
+        # indexes of the input entries that did not have a cache hit, and that need to be fetched.
+        # After a successful fetch, the result is put into `results` at the same index
+        to_fetch: list[int] = []
 
-        # redis MGET (Multi-GET) to check all at once quickly
         if not force_fetch:
-            cache_results = self.redis.mget([redis_key_fn(input_entry) for input_entry in input_data])
-            for idx, cache_result in enumerate(cache_results):
-                if cache_result is not None:
-                    results.insert(idx, serializer.deserialize(cache_result))
+            # entries that are not fresh in memory are looked up in redis all at once with MGET (Multi-GET)
+            to_look_up: list[int] = []
+            for idx, redis_key in enumerate(redis_keys):
+                l1_result = self.l1.get(redis_key)
+                if l1_result is not None and l1_result[1]:
+                    self.stats.record(redis_key, "l1_hits")
+                    results[idx] = serializer.deserialize(l1_result[0])
                 else:
-                    to_fetch.append((idx, input_data[idx]))
+                    to_look_up.append(idx)
+
+            if to_look_up:
+                # Huge lookups are split up, so they don't block redis for too long
+                with self.redis.pipeline(transaction=False) as pipeline:
+                    for chunk in iterate_in_chunks(to_look_up, BULK_READ_CHUNK_SIZE):
+                        pipeline.mget([redis_keys[idx] for idx in chunk])
+                    cache_results = [cache_result for chunk in pipeline.execute() for cache_result in chunk]
+
+                for idx, cache_result in zip(to_look_up, cache_results):
+                    if cache_result is None:
+                        to_fetch.append(idx)
+                        continue
+
+                    self.stats.record(redis_keys[idx], "redis_hits")
+                    results[idx] = serializer.deserialize(cache_result)
+                    expiry_value = self._get_expiry(results[idx], expiry)
+                    if expiry_value > 0:
+                        self.l1.set(redis_keys[idx], cache_result, expiry_value)
         else:
-            # yields a list zipping [(0, first_element), (1, second_element)] which is what we need in to_fetch
-            to_fetch = enumerate(input_data)
-
-        # https://stackoverflow.com/a/19343/4464702
-        # unzip [(0, 'first'), (1, 'second'), (4, 'fourtf')] to
-        #   to_fetch_indexes = (0, 1, 4) and
-        #   to_fetch_values = ('first', 'second', 'fourtf')
-        # except that zip() returns an iterator, not a list (so the extra call to tuple() is needed)
-
-        # the check for length is needed, because tuple(zip(*[])) returns () (an empty tuple),
-        # not a tuple with two empty lists.
-        if len(to_fetch) > 0:
-            to_fetch_indexes, to_fetch_values = tuple(zip(*to_fetch))
-            fetch_results = fetch_fn(to_fetch_values)
-            for idx, fetch_result in zip(to_fetch_indexes, fetch_results):
-                results.insert(idx, fetch_result)
-
-                if callable(expiry):
-                    # then expiry is a lambda that computes the expiry based upon the fetch result
-                    expiry_value = expiry(fetch_result)
-                else:
-                    expiry_value = expiry
-
-                if expiry_value > 0:
-                    self.redis.setex(redis_key_fn(input_data[idx]), expiry_value, serializer.serialize(fetch_result))
+            to_fetch = list(range(len(input_data)))
+
+        if to_fetch:
+            fetch_results = fetch_fn(tuple(input_data[idx] for idx in to_fetch))
+
+            # All results are written back in a single round trip
+            with self.redis.pipeline(transaction=False) as pipeline:
+                for idx, fetch_result in zip(to_fetch, fetch_results):
+                    self.stats.record(redis_keys[idx], "misses")
+                    results[idx] = fetch_result
+                    self._store(redis_keys[idx], fetch_result, serializer, expiry, pipeline)
+                pipeline.execute()
 
         return results
@@ -1,43 +1,114 @@
+from typing import Optional
+
+import logging
+import threading
+import time
+
 from pajbot import constants
 from pajbot.apiwrappers.base import BaseAPI
 
+log = logging.getLogger(__name__)
+
+# threatMatches:find accepts up to 500 threat entries per request
+MAX_THREAT_ENTRIES = 500
+
 
 class SafeBrowsingAPI(BaseAPI):
     def __init__(self, api_key):
         super().__init__(base_url="https://safebrowsing.googleapis.com/v4/")
         self.session.params["key"] = api_key
 
-    def is_url_bad(self, url):
-        resp = self.post(
-            "/threatMatches:find",
-            json={
-                "client": {"clientId": "pajbot1", "clientVersion": constants.VERSION},
-                "threatInfo": {
-                    "threatTypes": [
-                        "THREAT_TYPE_UNSPECIFIED",
-                        "MALWARE",
-                        "SOCIAL_ENGINEERING",
-                        "UNWANTED_SOFTWARE",
-                        "POTENTIALLY_HARMFUL_APPLICATION",
-                    ],
-                    "platformTypes": [
-                        "PLATFORM_TYPE_UNSPECIFIED",
-                        "WINDOWS",
-                        "LINUX",
-                        "ANDROID",
-                        "OSX",
-                        "IOS",
-                        "ANY_PLATFORM",
-                        "ALL_PLATFORMS",
-                        "CHROME",
-                    ],
-                    "threatEntryTypes": ["THREAT_ENTRY_TYPE_UNSPECIFIED", "URL", "EXECUTABLE"],
-                    "threatEntries": [{"url": url}],
+    def get_bad_urls(self, urls: list[str]) -> set[str]:
+        """Returns the subset of the given URLs that Safe Browsing lists as bad"""
+        bad_urls: set[str] = set()
+        for i in range(0, len(urls), MAX_THREAT_ENTRIES):
+            resp = self.post(
+                "/threatMatches:find",
+                json={
+                    "client": {"clientId": "pajbot1", "clientVersion": constants.VERSION},
+                    "threatInfo": {
+                        "threatTypes": [
+                            "THREAT_TYPE_UNSPECIFIED",
+                            "MALWARE",
+                            "SOCIAL_ENGINEERING",
+                            "UNWANTED_SOFTWARE",
+                            "POTENTIALLY_HARMFUL_APPLICATION",
+                        ],
+                        "platformTypes": [
+                            "PLATFORM_TYPE_UNSPECIFIED",
+                            "WINDOWS",
+                            "LINUX",
+                            "ANDROID",
+                            "OSX",
+                            "IOS",
+                            "ANY_PLATFORM",
+                            "ALL_PLATFORMS",
+                            "CHROME",
+                        ],
+                        "threatEntryTypes": ["THREAT_ENTRY_TYPE_UNSPECIFIED", "URL", "EXECUTABLE"],
+                        "threatEntries": [{"url": url} for url in urls[i : i + MAX_THREAT_ENTRIES]],
+                    },
                 },
-            },
-        )
+            )
+
+            # good response: {} or {"matches":[]}
+            # bad response: {"matches":[{"threat": {"url": "..."}, ...}]}
+            for match in resp.get("matches", []):
+                bad_urls.add(match["threat"]["url"])
+
+        return bad_urls
+
+    def is_url_bad(self, url):
+        return url in self.get_bad_urls([url])
+
+
+class _Batch:
+    def __init__(self) -> None:
+        self.urls: set[str] = set()
+        self.bad_urls: Optional[set[str]] = None
+        self.done = threading.Event()
+
+
+class SafeBrowsingBatcher:
+    """
+    Combines the lookups of concurrent callers into as few threatMatches:find requests as possible.
+    The first caller waits `max_delay` seconds for others to join before the batch is sent.
+    """
+
+    def __init__(self, api: SafeBrowsingAPI, max_delay: float = 0.05) -> None:
+        self.api = api
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.current: Optional[_Batch] = None
+
+    def get_bad_urls(self, urls: list[str], timeout: float = 10) -> set[str]:
+        """Returns the subset of the given URLs that Safe Browsing lists as bad.
+        URLs that could not be looked up are assumed to be fine."""
+        if not urls:
+            return set()
+
+        with self.lock:
+            batch = self.current
+            leader = batch is None
+            if batch is None:
+                batch = self.current = _Batch()
+            batch.urls.update(urls)
+
+        if leader:
+            time.sleep(self.max_delay)
+            with self.lock:
+                self.current = None
+
+            try:
+                batch.bad_urls = self.api.get_bad_urls(list(batch.urls))
+            except:
+                log.exception(f"Failed to look up {len(batch.urls)} URLs with Safe Browsing")
+            finally:
+                batch.done.set()
+        elif not batch.done.wait(timeout):
+            log.warning("Timed out waiting for a Safe Browsing lookup")
 
-        # good response: {} or {"matches":[]}
-        # bad response: {"matches":[{ ... }]}
+        if batch.bad_urls is None:
+            return set()
 
-        return len(resp.get("matches", [])) > 0
+        return {url for url in urls if url in batch.bad_urls}
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
-from typing import Any, Optional, Union
+from typing import Any, Callable, Hashable, Optional, TypeVar, Union
 
 import logging
-import math
+import random
+import threading
 import time
-from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 
-from pajbot import utils
 from pajbot.apiwrappers.response_cache import (
     ClassInstanceSerializer,
     DateTimeSerializer,
@@ -15,14 +16,31 @@ from pajbot.apiwrappers.response_cache import (
     TwitchChannelEmotesSerializer,
 )
 from pajbot.apiwrappers.twitch.base import BaseTwitchAPI
+from pajbot.apiwrappers.twitch.rate_limiter import HelixRateLimiter
 from pajbot.models.emote import Emote
 from pajbot.models.user import UserBasics, UserChannelInformation, UserStream
-from pajbot.utils import iterate_in_chunks
+from pajbot.utils import SingleFlight, iterate_in_chunks
 
-from requests import HTTPError
+from requests import HTTPError, RequestException, Response
+from requests.adapters import HTTPAdapter
 
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Number of threads used to make Helix requests concurrently, e.g. for bulk user lookups
+HELIX_WORKERS = 8
+# Maximum number of Helix requests in flight at once, from all threads
+HELIX_MAX_CONCURRENT_REQUESTS = 16
+# Requests that failed with a status code that might go away are retried this many times
+HELIX_MAX_RETRIES = 3
+# Retries wait up to HELIX_RETRY_BACKOFF * 2^attempt seconds
+HELIX_RETRY_BACKOFF = 0.5
+HELIX_RETRY_STATUS_CODES = {500, 502, 503, 504}
+# Only requests with these methods are retried after a server error,
+# other requests might have been executed already
+HELIX_IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE"}
+
 
 class TwitchGame:
     def __init__(
@@ -229,32 +247,121 @@ class TwitchBadgeSet:
 TwitchBadgeSets = list[TwitchBadgeSet]
 
 
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(v)) for key, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
 class TwitchHelixAPI(BaseTwitchAPI):
     authorization_header_prefix = "Bearer"
 
-    def __init__(self, redis, app_token_manager):
-        super().__init__(base_url="https://api.twitch.tv/helix", redis=redis)
+    def __init__(self, redis, app_token_manager, base_url: str = "https://api.twitch.tv/helix"):
+        super().__init__(base_url=base_url, redis=redis)
         self.app_token_manager = app_token_manager
 
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HELIX_MAX_CONCURRENT_REQUESTS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.request_slots = threading.BoundedSemaphore(HELIX_MAX_CONCURRENT_REQUESTS)
+
+        self.rate_limiter = HelixRateLimiter()
+        self.in_flight: SingleFlight[Response] = SingleFlight()
+
+        self.worker_state = threading.local()
+        self.executor = ThreadPoolExecutor(HELIX_WORKERS, thread_name_prefix="Helix", initializer=self._init_worker)
+
+    def _init_worker(self) -> None:
+        self.worker_state.is_worker = True
+
     @property
     def default_authorization(self):
         return self.app_token_manager
 
-    def request(self, method, endpoint, params, headers, authorization=None, json=None):
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> Future[T]:
+        """Run the given API method on the Helix thread pool, e.g. api.submit(api.get_user_id, "pajlada")"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def _map_concurrently(self, fn: Callable[[Any], T], items: list[Any]) -> list[T]:
+        """Like map(fn, items), but items are processed on the Helix thread pool"""
+        if len(items) <= 1 or getattr(self.worker_state, "is_worker", False):
+            # Waiting for the pool from one of its own threads could deadlock it
+            return [fn(item) for item in items]
+
+        return list(self.executor.map(fn, items))
+
+    @staticmethod
+    def _rate_limit_key(authorization) -> Hashable:
         try:
-            return super().request(method, endpoint, params, headers, authorization, json)
-        except HTTPError as e:
-            if e.response is None:
-                raise e
+            hash(authorization)
+            return authorization
+        except TypeError:
+            return id(authorization)
 
-            if e.response.status_code == 429:
-                # retry once after rate limit resets...
-                rate_limit_reset = datetime.fromtimestamp(int(e.response.headers["Ratelimit-Reset"]), tz=timezone.utc)
-                time_to_wait = rate_limit_reset - utils.now()
-                time.sleep(math.ceil(time_to_wait.total_seconds()))
-                return super().request(method, endpoint, params, headers, authorization, json)
+    def request(self, method, endpoint, params, headers, authorization=None, json=None):
+        if authorization is None:
+            authorization = self.default_authorization
+
+        if method == "GET":
+            try:
+                key: Optional[Hashable] = (
+                    _freeze(endpoint),
+                    _freeze(params),
+                    _freeze(headers),
+                    self._rate_limit_key(authorization),
+                )
+                hash(key)
+            except TypeError:
+                key = None
+
+            if key is not None:
+                # Identical GETs that are already in flight (e.g. looking up the same user during a ban wave)
+                # share its response
+                return self.in_flight.do(
+                    key, lambda: self._request_with_retries(method, endpoint, params, headers, authorization, json)
+                )
+
+        return self._request_with_retries(method, endpoint, params, headers, authorization, json)
 
-            raise e
+    def _request_with_retries(self, method, endpoint, params, headers, authorization, json) -> Response:
+        rate_limit_key = self._rate_limit_key(authorization)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(rate_limit_key)
+
+            try:
+                with self.request_slots:
+                    response = super().request(method, endpoint, params, headers, authorization, json)
+            except HTTPError as e:
+                if e.response is None:
+                    raise e
+
+                # After a 429, the rate limiter makes the retry wait for the rate limit to reset
+                self.rate_limiter.update(rate_limit_key, e.response.headers)
+
+                status_code = e.response.status_code
+                retryable = status_code == 429 or (
+                    status_code in HELIX_RETRY_STATUS_CODES and method in HELIX_IDEMPOTENT_METHODS
+                )
+                if not retryable or attempt >= HELIX_MAX_RETRIES:
+                    raise e
+
+                log.warning(f"Helix {method} {endpoint} failed with status code {status_code}, retrying")
+            except RequestException as e:
+                if method not in HELIX_IDEMPOTENT_METHODS or attempt >= HELIX_MAX_RETRIES:
+                    raise e
+
+                log.warning(f"Helix {method} {endpoint} failed: {e}, retrying")
+            else:
+                self.rate_limiter.update(rate_limit_key, response.headers)
+                return response
+
+            # Full jitter, so clients that failed at the same time don't retry at the same time
+            time.sleep(random.uniform(0, HELIX_RETRY_BACKOFF * 2**attempt))
+            attempt += 1
 
     @staticmethod
     def _with_pagination(after_pagination_cursor: Optional[str] = None) -> dict[str, str]:
@@ -483,11 +590,7 @@ class TwitchHelixAPI(BaseTwitchAPI):
         return set(subscribers)
 
     def _bulk_fetch_user_data(self, key_type: str, lookup_keys: list[str]) -> list[Optional[Any]]:
-        all_entries = []
-
-        # We can fetch a maximum of 100 users on each helix request
-        # so we do it in chunks of 100
-        for lookup_keys_chunk in iterate_in_chunks(lookup_keys, 100):
+        def fetch_chunk(lookup_keys_chunk: list[str]) -> list[Optional[Any]]:
             response = self.get("/users", {key_type: lookup_keys_chunk})
 
             # using a response map means we don't rely on twitch returning the data entries in the exact
@@ -495,8 +598,14 @@ class TwitchHelixAPI(BaseTwitchAPI):
             response_map = {response_entry[key_type]: response_entry for response_entry in response["data"]}
 
             # then fill in the gaps with None
-            for lookup_key in lookup_keys_chunk:
-                all_entries.append(response_map.get(lookup_key, None))
+            return [response_map.get(lookup_key, None) for lookup_key in lookup_keys_chunk]
+
+        all_entries = []
+
+        # We can fetch a maximum of 100 users on each helix request
+        # so we do it in chunks of 100, which are fetched concurrently
+        for chunk_entries in self._map_concurrently(fetch_chunk, list(iterate_in_chunks(lookup_keys, 100))):
+            all_entries.extend(chunk_entries)
 
         return all_entries
 
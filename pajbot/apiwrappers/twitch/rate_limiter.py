@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from typing import Callable, Hashable, Mapping
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class _Bucket:
+    __slots__ = ("remaining", "reset_at")
+
+    def __init__(self, remaining: int, reset_at: float) -> None:
+        self.remaining = remaining
+        # unix timestamp
+        self.reset_at = reset_at
+
+
+class HelixRateLimiter:
+    """
+    Keeps track of the Ratelimit-Remaining and Ratelimit-Reset headers Twitch sends with every Helix response,
+    per rate limit bucket (i.e. per authorization), and makes requests wait for the bucket to be refilled
+    once fewer than `min_remaining` points are left in it.
+    Requests that are let through count against the bucket right away, so concurrent requests don't overshoot it.
+    """
+
+    def __init__(
+        self,
+        min_remaining: int = 5,
+        max_wait: float = 60.0,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.min_remaining = min_remaining
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.buckets: dict[Hashable, _Bucket] = {}
+
+    def acquire(self, key: Hashable) -> None:
+        with self.lock:
+            bucket = self.buckets.get(key, None)
+            now = self.clock()
+            if bucket is None or bucket.reset_at <= now:
+                return
+
+            if bucket.remaining > self.min_remaining:
+                bucket.remaining -= 1
+                return
+
+            delay = min(bucket.reset_at - now, self.max_wait)
+
+        log.debug(f"Helix rate limit nearly exhausted, waiting {delay:.2f}s for it to reset")
+        self.sleep(delay)
+
+    def update(self, key: Hashable, headers: Mapping[str, str]) -> None:
+        try:
+            remaining = int(headers["Ratelimit-Remaining"])
+            reset_at = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            self.buckets[key] = _Bucket(remaining, reset_at)
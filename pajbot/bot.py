@@ -22,30 +22,45 @@ from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
 from pajbot.apiwrappers.twitch.id import TwitchIDAPI
 from pajbot.constants import VERSION
 from pajbot.eventloop import SafeDefaultScheduler
+from pajbot.managers.chat_queue import ChatQueue, chat_priority_scope
 from pajbot.managers.command import CommandManager
+from pajbot.managers.command_snapshot import CommandSnapshotPublisher
+from pajbot.managers.cooldown import CooldownStore
 from pajbot.managers.db import DBManager
 from pajbot.managers.deck import DeckManager
 from pajbot.managers.emote import EcountManager, EmoteManager, EpmManager
 from pajbot.managers.handler import HandlerManager
 from pajbot.managers.irc import IRCManager
 from pajbot.managers.kvi import KVIManager, parse_kvi_arguments
+from pajbot.managers.leaderboard import PERIODIC_LEADERBOARDS, REFRESH_INTERVAL, LeaderboardManager
+from pajbot.managers.moderation_dispatcher import ModerationDispatcher
+from pajbot.managers.points_ledger import PointsLedger
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
+from pajbot.managers.urlfetch import URLFetcher
+from pajbot.managers.user_cache import UserCache
 from pajbot.managers.user_ranks_refresh import UserRanksRefreshManager
 from pajbot.managers.websocket import WebSocketManager
 from pajbot.migration.db import DatabaseMigratable
 from pajbot.migration.migrate import Migration
 from pajbot.migration.redis import RedisMigratable
-from pajbot.models.action import ActionParser, SubstitutionFilter
+from pajbot.models.action import ActionParser, ResponseTemplateCache, SubstitutionFilter
 from pajbot.models.banphrase import BanphraseManager
-from pajbot.models.moderation_action import Ban, Timeout, Unban, Untimeout, new_message_processing_scope
+from pajbot.models.moderation_action import (
+    Ban,
+    ModerationAction,
+    Timeout,
+    Unban,
+    Untimeout,
+    new_message_processing_scope,
+)
 from pajbot.models.module import ModuleManager
 from pajbot.models.sock import SocketManager
 from pajbot.models.stream import StreamManager
 from pajbot.models.timer import TimerManager
 from pajbot.models.user import User, UserBasics
 from pajbot.streamhelper import StreamHelper
-from pajbot.tmi import CHARACTER_LIMIT, ChatOutputMode, TMIRateLimits, WhisperOutputMode
+from pajbot.tmi import CHARACTER_LIMIT, ChatOutputMode, ChatPriority, TMIRateLimits, WhisperOutputMode
 
 import irc.client
 import requests
@@ -93,6 +108,9 @@ class Bot:
         self.args = args
         self.config = config
 
+        # Compiled command responses, see compile_response
+        self.response_templates = ResponseTemplateCache()
+
         ScheduleManager.init()
 
         DBManager.init(config["main"]["db"])
@@ -164,6 +182,9 @@ class Bot:
 
         StreamHelper.init_streamer(self.streamer.login, self.streamer.id, self.streamer.name)
 
+        if cfg.get_boolean(config["main"], "replicate_cooldowns", False):
+            CooldownStore.enable_replication(self.streamer.login)
+
         # SQL migrations
         with DBManager.create_dbapi_connection_scope() as sql_conn:
             sql_migratable = DatabaseMigratable(sql_conn)
@@ -178,10 +199,10 @@ class Bot:
         # Thread pool executor for async actions
         self.action_queue = ActionQueue()
 
-        # refresh points_rank and num_lines_rank regularly
-
+        # refresh the user_rank materialized view, if enabled.
+        # points_rank and num_lines_rank of a single user don't depend on it
         self.user_ranks_refresh_manager = UserRanksRefreshManager(config)
-        rank_refresh_mode = config["main"].get("rank_refresh_mode", "0")
+        rank_refresh_mode = config["main"].get("rank_refresh_mode", "2")
         if rank_refresh_mode == "0":
             self.user_ranks_refresh_manager.start(self.action_queue)
         elif rank_refresh_mode == "1":
@@ -200,6 +221,31 @@ class Bot:
         self.start_time = utils.now()
         ActionParser.bot = self
 
+        # Keeps the users who are currently chatting in memory, their changes are written in commit_all
+        self.user_cache = UserCache(config)
+
+        # Top users by points, lines, etc. for the web and the !top commands
+        self.leaderboards = LeaderboardManager()
+        try:
+            leaderboard_refresh_interval = int(
+                config["main"].get("leaderboard_refresh_interval", str(REFRESH_INTERVAL))
+            )
+        except ValueError:
+            log.exception("Bad leaderboard_refresh_interval in your config")
+            leaderboard_refresh_interval = REFRESH_INTERVAL
+        ScheduleManager.execute_every(
+            leaderboard_refresh_interval,
+            lambda: self.action_queue.submit(self.leaderboards.refresh, PERIODIC_LEADERBOARDS),
+        )
+
+        # Changes the points of users other than the one who sent the current message
+        self.points_ledger = PointsLedger(
+            self.user_cache, cfg.get_boolean(config["main"], "points_ledger_audit", False), self.leaderboards
+        )
+
+        # Executes bans and timeouts in the background
+        self.moderation_dispatcher = ModerationDispatcher(self, config)
+
         HandlerManager.init_handlers()
 
         self.socket_manager = SocketManager(self.streamer.login, self.execute_now)
@@ -241,21 +287,25 @@ class Bot:
 
         self.emote_manager = EmoteManager(self.twitch_helix_api, self.action_queue)
         self.epm_manager = EpmManager()
-        self.ecount_manager = EcountManager()
+        self.ecount_manager = EcountManager(cfg.get_boolean(config["main"], "emote_count_buckets", False))
         self.module_manager = ModuleManager(self.socket_manager, bot=self)
         self.module_manager.load()
+        self.command_snapshot_publisher = CommandSnapshotPublisher(RedisManager.get(), self.streamer.login)
+        # Examples are loaded for the command snapshot shown on the web
         self.commands = CommandManager(
             socket_manager=self.socket_manager, module_manager=self.module_manager, bot=self
-        ).load()
+        ).load(load_examples=True)
+        self.command_snapshot_publisher.start(self.commands)
         self.websocket_manager = WebSocketManager(self)
 
         HandlerManager.trigger("on_managers_loaded")
 
         # Commitable managers
-        self.commitable = {"commands": self.commands, "banphrases": self.banphrase_manager}
+        self.commitable = {"commands": self.commands, "banphrases": self.banphrase_manager, "users": self.user_cache}
 
         self.execute_every(60, self.commit_all)
         self.execute_every(1, self.do_tick)
+        self.execute_every(5, self.flush_emote_stats)
 
         admin: Optional[UserBasics] = self._load_admin(config)
 
@@ -282,6 +332,7 @@ class Bot:
             self.version_long = VERSION
 
         self.irc = IRCManager(self)
+        self.chat_queue = ChatQueue(self, self.tmi_rate_limits)
 
         relay_host = config["main"].get("relay_host", None)
         relay_password = config["main"].get("relay_password", None)
@@ -309,6 +360,13 @@ class Bot:
 
         self.user_agent = f"pajbot1/{VERSION} ({self.bot_user.login})"
 
+        urlfetch_cache_ttl = 0
+        try:
+            urlfetch_cache_ttl = int(config["main"].get("urlfetch_cache_ttl", "0"))
+        except ValueError:
+            log.exception("Bad urlfetch_cache_ttl in your config")
+        self.urlfetcher = URLFetcher(RedisManager.get(), self.streamer.login, self.user_agent, urlfetch_cache_ttl)
+
         self.thread_locals = threading.local()
 
         self.subs_only = False
@@ -396,6 +454,14 @@ class Bot:
 
     def get_user_value(self, key, extra={}):
         try:
+            user_lookup = extra.get("user_lookup", None)
+            if user_lookup is not None:
+                # The response being rendered has a database session open for us
+                user = user_lookup.find(extra["argument"])
+                if user is not None:
+                    return getattr(user, key)
+                return None
+
             with DBManager.create_session_scope() as db_session:
                 user = User.find_by_user_input(db_session, extra["argument"])
                 if user is not None:
@@ -424,6 +490,15 @@ class Bot:
 
     def get_usersource_value(self, key, extra={}):
         try:
+            user_lookup = extra.get("user_lookup", None)
+            if user_lookup is not None:
+                # The response being rendered has a database session open for us
+                user = user_lookup.find(extra["argument"])
+                if user is not None:
+                    return getattr(user, key)
+
+                return getattr(extra["source"], key)
+
             with DBManager.create_session_scope() as db_session:
                 user = User.find_by_user_input(db_session, extra["argument"])
                 if user is not None:
@@ -533,8 +608,9 @@ class Bot:
         return None
 
     def privmsg_arr(self, arr, target=None):
-        for msg in arr:
-            self.privmsg(msg, target)
+        with chat_priority_scope(self, ChatPriority.ANNOUNCEMENT):
+            for msg in arr:
+                self.privmsg(msg, target)
 
     def privmsg_arr_chunked(self, arr, per_chunk=35, chunk_delay=30, target=None):
         i = 0
@@ -590,11 +666,14 @@ class Bot:
         if channel is None:
             channel = self.channel
 
-        if self.chat_output_mode == ChatOutputMode.HELIX:
-            if self._send_chat_message_via_helix(channel, message):
-                return
+        self.chat_queue.submit(channel, message, self.get_chat_priority())
 
-        self.irc.privmsg(channel, message)
+    def get_chat_priority(self) -> ChatPriority:
+        """The priority of messages sent by this thread, as set by chat_priority_scope"""
+        priority = getattr(self.thread_locals, "chat_priority", None)
+        if priority is None:
+            return ChatPriority.COMMAND
+        return priority
 
     def _get_channel_id_for_chat_message(self, channel: str) -> Optional[str]:
         if channel == self.channel:
@@ -713,6 +792,14 @@ class Bot:
             return False
         return self.thread_locals.moderation_actions is not None
 
+    def _moderate(self, login: str, action: ModerationAction, user_id: Optional[str] = None) -> None:
+        """Executes the action once the current message processing scope ends,
+        or in the background right away if there is none"""
+        if self._has_moderation_actions():
+            self.thread_locals.moderation_actions.add(login, action, user_id)
+        else:
+            self.moderation_dispatcher.submit(login, action, user_id)
+
     def _ban(self, user_id: str, reason: Optional[str] = None) -> None:
         try:
             self.twitch_helix_api.ban_user(self.streamer.id, self.bot_user.id, self.bot_token_manager, user_id, reason)
@@ -726,21 +813,13 @@ class Bot:
                 log.error(f"Failed to ban user with id {user_id}: {e} - {e.response.text}")
 
     def ban(self, user: User, reason: Optional[str] = None) -> None:
-        self.ban_id(user.id, reason)
+        self._moderate(user.login, Ban(reason), user.id)
 
     def ban_id(self, user_id: str, reason: Optional[str] = None) -> None:
         self._ban(user_id, reason)
 
     def ban_login(self, login: str, reason: Optional[str] = None) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to ban user with login {login}, but no such user was found")
-            return
-
-        if self._has_moderation_actions():
-            self.thread_locals.moderation_actions.add(login, Ban(reason))
-        else:
-            self.ban_id(user_id, reason)
+        self._moderate(login, Ban(reason))
 
     def _unban(self, user_id: str) -> None:
         try:
@@ -755,21 +834,13 @@ class Bot:
                 log.error(f"Failed to unban user with id {user_id}: {e} - {e.response.text}")
 
     def unban(self, user: User) -> None:
-        self.unban_id(user.id)
+        self._moderate(user.login, Unban(), user.id)
 
     def unban_id(self, user_id: str) -> None:
         self._unban(user_id)
 
     def unban_login(self, login: str) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to unban user with login {login}, but no such user was found")
-            return
-
-        if self._has_moderation_actions():
-            self.thread_locals.moderation_actions.add(login, Unban())
-        else:
-            self.unban_id(user_id)
+        self._moderate(login, Unban())
 
     def _untimeout(self, user_id: str) -> None:
         try:
@@ -806,24 +877,16 @@ class Bot:
                 log.error(f"Failed to untimeout user with id {user_id}: {e} - {e.response.text}")
 
     def untimeout(self, user: User) -> None:
-        self.untimeout_id(user.id)
+        self._moderate(user.login, Untimeout(), user.id)
 
     def untimeout_id(self, user_id: str) -> None:
         self._untimeout(user_id)
 
     def untimeout_login(self, login: str) -> None:
-        user_id = self.twitch_helix_api.get_user_id(login)
-        if user_id is None:
-            log.error(f"Attempted to untimeout user with login {login}, but no such user was found")
-            return
-
-        if self._has_moderation_actions():
-            self.thread_locals.moderation_actions.add(login, Untimeout())
-        else:
-            self.untimeout_id(user_id)
+        self._moderate(login, Untimeout())
 
     def timeout(self, user: User, duration: int, reason: Optional[str] = None) -> None:
-        self.timeout_login(user.login, duration, reason)
+        self._moderate(user.login, Timeout(duration, reason), user.id)
 
     def _timeout(self, user_id: str, duration: int, reason: Optional[str] = None) -> None:
         try:
@@ -840,14 +903,7 @@ class Bot:
                 log.error(f"Failed to timeout user with id {user_id}: {e} - {e.response.text}")
 
     def timeout_login(self, login: str, duration: int, reason: Optional[str] = None) -> None:
-        if self._has_moderation_actions():
-            self.thread_locals.moderation_actions.add(login, Timeout(duration, reason))
-        else:
-            user_id = self.twitch_helix_api.get_user_id(login)
-            if user_id is None:
-                log.error(f"Attempted to ban user with login {login}, but no such user was found")
-                return
-            self._timeout(user_id, duration, reason)
+        self._moderate(login, Timeout(duration, reason))
 
     def timeout_warn(self, user: User, duration: int, reason: Optional[str] = None) -> tuple[int, str]:
         from pajbot.modules import WarningModule
@@ -996,13 +1052,9 @@ class Bot:
 
         message = utils.clean_up_message(message)
 
-        if self.chat_output_mode == ChatOutputMode.HELIX:
-            message = message[:CHARACTER_LIMIT]
-            if self._send_chat_message_via_helix(channel, message, reply_parent_message_id=msg_id):
-                return
-        else:
-            message = f"@reply-parent-msg-id={msg_id} PRIVMSG {channel} :{message}"
-            self.irc.send_raw(message[:CHARACTER_LIMIT])
+        self.chat_queue.submit(
+            channel, message[:CHARACTER_LIMIT], self.get_chat_priority(), reply_parent_message_id=msg_id
+        )
 
     def say(self, message: str, channel: Optional[str] = None) -> None:
         if message is None:
@@ -1150,8 +1202,7 @@ class Bot:
         login = event.source.user
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             self.parse_message(event.arguments[0], source, event, tags, whisper=True)
 
     def on_usernotice(self, chatconn, event):
@@ -1164,8 +1215,7 @@ class Bot:
         login = tags["login"]
         name = tags["display-name"]
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             if event.arguments and len(event.arguments) > 0:
                 msg = event.arguments[0]
             else:
@@ -1192,7 +1242,7 @@ class Bot:
 
         if self.streamer.login == "forsen":
             if "zonothene" in login:
-                self._ban(id)
+                self.moderation_dispatcher.submit(login, Ban(None), id)
                 return True
 
             raw_m = event.arguments[0].lower()
@@ -1219,9 +1269,7 @@ class Bot:
                 self.timeout_login(login, 3600, reason="Bad username")
                 return True
 
-        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
-            source = User.from_basics(db_session, UserBasics(id, login, name))
-
+        with self.user_cache.user_scope(UserBasics(id, login, name)) as source:
             with new_message_processing_scope(self):
                 res = HandlerManager.trigger("on_pubmsg", source=source, message=event.arguments[0], tags=tags)
                 if res is False:
@@ -1290,6 +1338,20 @@ class Bot:
 
         HandlerManager.trigger("on_commit", stop_on_false=False)
 
+        try:
+            HandlerManager.save_stats(RedisManager.get(), self.streamer.login)
+        except:
+            log.exception("Failed to save event handler stats to redis")
+
+    def flush_emote_stats(self) -> None:
+        try:
+            with RedisManager.pipeline_context() as pipeline:
+                self.epm_manager.flush(pipeline)
+                current_stream = self.stream_manager.current_stream
+                self.ecount_manager.flush(pipeline, current_stream.id if current_stream is not None else None)
+        except:
+            log.exception("Failed to write emote stats to redis")
+
     @staticmethod
     def do_tick() -> None:
         HandlerManager.trigger("on_tick")
@@ -1311,6 +1373,7 @@ class Bot:
 
     def quit_bot(self, **options) -> None:
         self.commit_all()
+        self.flush_emote_stats()
         HandlerManager.trigger("on_quit")
         phrase_data = {"nickname": self.bot_user.login, "version": self.version_long}
 
@@ -1329,6 +1392,10 @@ class Bot:
 
         self.socket_manager.quit()
 
+        self.moderation_dispatcher.stop()
+        self.chat_queue.stop()
+        self.urlfetcher.stop()
+
         sys.exit(0)
 
     def apply_filter(self, resp, f: SubstitutionFilter) -> Any:
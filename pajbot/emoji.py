@@ -1,3 +1,5 @@
+from pajbot.utils import EmojiMatcher
+
 ALL_EMOJI = [
     "😀",
     "😃",
@@ -3836,3 +3838,6 @@ ALL_EMOJI = [
     "🏴󠁧󠁢󠁳󠁣󠁴󠁿",
     "🏴󠁧󠁢󠁷󠁬󠁳󠁿",
 ]
+
+# Use this to find emoji in messages, instead of looking for each emoji in ALL_EMOJI
+EMOJI_MATCHER = EmojiMatcher(ALL_EMOJI)
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterator, Optional
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from pajbot.tmi import ChatOutputMode, ChatPriority, TMIRateLimits
+from pajbot.utils import SlidingWindowRateLimit
+
+if TYPE_CHECKING:
+    from pajbot.bot import Bot
+
+log = logging.getLogger(__name__)
+
+# Messages queued in a single lane before new messages for that lane are dropped
+MAX_QUEUED_MESSAGES = 500
+# Twitch allows privmsg_per_30 messages per 30 seconds, the extra second is a margin for latency
+RATE_LIMIT_PERIOD = 31
+
+
+class _OutgoingMessage:
+    __slots__ = ("channel", "message", "reply_parent_message_id", "queued_at")
+
+    def __init__(self, channel: str, message: str, reply_parent_message_id: Optional[str], queued_at: float) -> None:
+        self.channel = channel
+        self.message = message
+        self.reply_parent_message_id = reply_parent_message_id
+        self.queued_at = queued_at
+
+    @property
+    def key(self) -> tuple[str, str, Optional[str]]:
+        return (self.channel, self.message, self.reply_parent_message_id)
+
+
+class ChatQueue:
+    """
+    Sends chat messages from a single background thread, within Twitch's chat rate limits.
+
+    Messages are queued in one lane per ChatPriority, and the lane with the highest priority is always emptied first.
+    IRC and Helix each allow at most TMIRateLimits.privmsg_per_30 messages within any RATE_LIMIT_PERIOD seconds.
+    A message that is equal to a message that is still queued is dropped.
+    """
+
+    def __init__(self, bot: Bot, rate_limits: TMIRateLimits) -> None:
+        self.bot = bot
+
+        self.irc_rate_limit = SlidingWindowRateLimit(rate_limits.privmsg_per_30, RATE_LIMIT_PERIOD)
+        self.helix_rate_limit = SlidingWindowRateLimit(rate_limits.privmsg_per_30, RATE_LIMIT_PERIOD)
+
+        self.condition = threading.Condition()
+        self.lanes: list[deque[_OutgoingMessage]] = [deque() for _ in ChatPriority]
+        self.queued_keys: set[tuple[str, str, Optional[str]]] = set()
+        self.running = True
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+        self.worker = threading.Thread(target=self._run, name="ChatQueue", daemon=True)
+        self.worker.start()
+
+    def submit(
+        self,
+        channel: str,
+        message: str,
+        priority: ChatPriority = ChatPriority.COMMAND,
+        reply_parent_message_id: Optional[str] = None,
+    ) -> bool:
+        """Queue the message. Returns False if it was dropped"""
+        outgoing = _OutgoingMessage(channel, message, reply_parent_message_id, time.monotonic())
+
+        with self.condition:
+            self.submitted += 1
+
+            if outgoing.key in self.queued_keys:
+                self.coalesced += 1
+                return False
+
+            lane = self.lanes[priority]
+            if len(lane) >= MAX_QUEUED_MESSAGES:
+                self.dropped += 1
+                log.error(f"Chat queue lane {priority.name} is full, dropping message {message!r}")
+                return False
+
+            lane.append(outgoing)
+            self.queued_keys.add(outgoing.key)
+            self.condition.notify()
+
+        return True
+
+    def _rate_limit(self) -> SlidingWindowRateLimit:
+        if self.bot.chat_output_mode == ChatOutputMode.HELIX:
+            return self.helix_rate_limit
+
+        return self.irc_rate_limit
+
+    def _wait_for_message(self) -> bool:
+        """Block until a message is queued. Returns False if the queue was stopped"""
+        with self.condition:
+            while self.running and not any(self.lanes):
+                self.condition.wait()
+
+            return self.running
+
+    def _pop(self) -> Optional[tuple[ChatPriority, _OutgoingMessage]]:
+        with self.condition:
+            for priority, lane in zip(ChatPriority, self.lanes):
+                if lane:
+                    outgoing = lane.popleft()
+                    self.queued_keys.discard(outgoing.key)
+                    return priority, outgoing
+
+        return None
+
+    def _run(self) -> None:
+        while self._wait_for_message():
+            # The rate limit is taken before the message is picked,
+            # so a message with a higher priority that is queued in the meantime still goes first
+            self._rate_limit().acquire()
+
+            popped = self._pop()
+            if popped is None:
+                continue
+
+            priority, outgoing = popped
+            try:
+                sent = self._send(outgoing)
+            except:
+                log.exception(f"Failed to send chat message {outgoing.message!r}")
+                sent = False
+
+            if sent is None:
+                # Not connected, try again in a bit
+                with self.condition:
+                    self.lanes[priority].appendleft(outgoing)
+                    self.queued_keys.add(outgoing.key)
+                time.sleep(2)
+                continue
+
+            latency = time.monotonic() - outgoing.queued_at
+            with self.condition:
+                if sent:
+                    self.sent += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+                else:
+                    self.failed += 1
+
+    def _send(self, outgoing: _OutgoingMessage) -> Optional[bool]:
+        """Returns None if the message should be retried later"""
+        if self.bot.chat_output_mode == ChatOutputMode.HELIX:
+            if self.bot._send_chat_message_via_helix(
+                outgoing.channel, outgoing.message, reply_parent_message_id=outgoing.reply_parent_message_id
+            ):
+                return True
+
+            # Falls back to IRC
+            self.irc_rate_limit.acquire()
+
+        if outgoing.reply_parent_message_id is not None:
+            sent = self.bot.irc.send_raw(
+                f"@reply-parent-msg-id={outgoing.reply_parent_message_id} PRIVMSG {outgoing.channel} :{outgoing.message}"
+            )
+        else:
+            sent = self.bot.irc.privmsg(outgoing.channel, outgoing.message)
+
+        if not sent:
+            log.error("Not connected to IRC. Delaying message a few seconds.")
+            return None
+
+        return True
+
+    def stop(self, timeout: float = 5) -> None:
+        """Wait up to `timeout` seconds for the queued messages to be sent, then stop the worker"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.condition:
+                if not any(self.lanes):
+                    break
+            time.sleep(0.05)
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        self.worker.join(max(0, deadline - time.monotonic()))
+
+    def stats(self) -> dict[str, float]:
+        with self.condition:
+            data: dict[str, float] = {
+                f"queued_{priority.name.lower()}": len(lane) for priority, lane in zip(ChatPriority, self.lanes)
+            }
+            data.update(
+                {
+                    "submitted": self.submitted,
+                    "coalesced": self.coalesced,
+                    "dropped": self.dropped,
+                    "sent": self.sent,
+                    "failed": self.failed,
+                    "avg_latency": round(self.total_latency / self.sent, 3) if self.sent > 0 else 0.0,
+                    "max_latency": round(self.max_latency, 3),
+                }
+            )
+            return data
+
+
+@contextmanager
+def chat_priority_scope(bot: Bot, priority: ChatPriority) -> Iterator[None]:
+    """Messages sent by the current thread inside this scope are queued with the given priority"""
+    previous = getattr(bot.thread_locals, "chat_priority", None)
+    bot.thread_locals.chat_priority = priority
+
+    try:
+        yield
+    finally:
+        bot.thread_locals.chat_priority = previous
@@ -1,12 +1,13 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Literal, Optional, Union
+from typing import TYPE_CHECKING, Any, Iterable, Literal, Optional, Union
 
 import argparse
 import logging
 from collections import UserDict
 
 from pajbot.managers.db import DBManager
+from pajbot.models.action import MultiAction
 from pajbot.models.command import Command, CommandData, CommandExample, WebCommand, parse_command_for_web
 from pajbot.utils import find
 
@@ -46,18 +47,28 @@ class CommandManager(UserDict[str, Command]):
         self.module_commands: dict[str, Command] = {}
         self.data = {}
 
+        # The commands of each layer as of the last rebuild/update, see _get_layers
+        self.layer_order: list[str] = []
+        self.layers: dict[str, dict[str, Command]] = {}
+        # alias -> the commands with that alias, in the order they are merged
+        self.alias_index: dict[str, list[Command]] = {}
+        # multi-action command -> the aliases it is merged in
+        self.multi_command_aliases: dict[Command, set[str]] = {}
+
         self.bot = bot
         self.module_manager = module_manager
+        # Whether the examples of database commands are loaded too, see load_db_commands
+        self.load_examples = False
 
         if socket_manager:
             socket_manager.add_handler("module.update", self.on_module_reload)
             socket_manager.add_handler("command.update", self.on_command_update)
             socket_manager.add_handler("command.remove", self.on_command_remove)
 
-    def on_module_reload(self, _data: HandlerParam) -> None:
-        log.debug("Rebuilding commands...")
-        self.rebuild()
-        log.debug("Done rebuilding commands")
+    def on_module_reload(self, data: HandlerParam) -> None:
+        log.debug("Updating commands...")
+        self.update_layers([f"module:{data['id']}"] if "id" in data else None)
+        log.debug("Done updating commands")
 
     def on_command_update(self, data: HandlerParam) -> None:
         try:
@@ -74,7 +85,7 @@ class CommandManager(UserDict[str, Command]):
 
         log.debug(f"Reloaded command with id {command_id}")
 
-        self.rebuild()
+        self.update_layers(["db"])
 
     def on_command_remove(self, data: HandlerParam) -> None:
         try:
@@ -93,7 +104,7 @@ class CommandManager(UserDict[str, Command]):
 
         log.debug(f"Remove command with id {command_id}")
 
-        self.rebuild()
+        self.update_layers(["db"])
 
     def __del__(self) -> None:
         self.db_session.close()
@@ -302,7 +313,7 @@ class CommandManager(UserDict[str, Command]):
         self.db_session.add(command.data)
         self.commit()
 
-        self.rebuild()
+        self.update_layers(["db"])
         return command, True, ""
 
     def edit_command(self, command_to_edit: Command, **options: Any) -> None:
@@ -327,7 +338,7 @@ class CommandManager(UserDict[str, Command]):
             db_session.delete(command.data)
             db_session.delete(command)
 
-        self.rebuild()
+        self.update_layers(["db"])
 
     def add_db_command_aliases(self, command: Command) -> int:
         aliases = command.command.split("|")
@@ -348,7 +359,8 @@ class CommandManager(UserDict[str, Command]):
 
         query = self.db_session.query(Command)
 
-        if options.get("load_examples", False) is True:
+        self.load_examples = options.get("load_examples", False) is True
+        if self.load_examples:
             query = query.options(joinedload(Command.examples))
         if options.get("enabled", True) is True:
             query = query.filter_by(enabled=True)
@@ -363,39 +375,147 @@ class CommandManager(UserDict[str, Command]):
 
         return self.db_commands
 
+    def _get_layers(self) -> list[tuple[str, dict[str, Command]]]:
+        """The sources of commands, in the order they are merged. Later layers override earlier ones"""
+        layers = [("internal", self.internal_commands), ("db", self.db_commands)]
+        if self.module_manager is not None:
+            layers += [(f"module:{module.ID}", module.commands) for module in self.module_manager.modules]
+        return layers
+
+    def _index_alias(self, alias: str) -> None:
+        """Update which layers provide the given alias, and which aliases the multi-action commands are merged in"""
+        for command in self.alias_index.pop(alias, []):
+            if isinstance(command.action, MultiAction):
+                aliases = self.multi_command_aliases[command]
+                aliases.discard(alias)
+                if not aliases:
+                    del self.multi_command_aliases[command]
+
+        commands = [self.layers[layer_key][alias] for layer_key in self.layer_order if alias in self.layers[layer_key]]
+        if not commands:
+            return
+
+        self.alias_index[alias] = commands
+        for command in commands:
+            if isinstance(command.action, MultiAction):
+                self.multi_command_aliases.setdefault(command, set()).add(alias)
+
+    def _merge_aliases(self, aliases: Iterable[str], out: dict[str, Command]) -> None:
+        """Must be called with every alias the multi-action commands of the given aliases are merged in"""
+        for multi_command in {
+            command
+            for alias in aliases
+            for command in self.alias_index.get(alias, [])
+            if command in self.multi_command_aliases
+        }:
+            if multi_command.action:
+                # Resets any previous modifications to the action.
+                # Right now, the only thing this resets is the MultiAction
+                # command list.
+                multi_command.action.reset()
+
+        for alias in aliases:
+            commands = self.alias_index.get(alias, None)
+            if commands is None:
+                out.pop(alias, None)
+                continue
+
+            merged = commands[0]
+            for command in commands[1:]:
+                if isinstance(command.action, MultiAction) and isinstance(merged.action, MultiAction):
+                    merged.action += command.action
+                else:
+                    merged = command
+
+            out[alias] = merged
+
+    def _publish_snapshot(self) -> None:
+        """Let the web know the commands changed"""
+        if self.bot is not None:
+            self.bot.command_snapshot_publisher.schedule()
+
     def rebuild(self) -> None:
         """Rebuild the internal commands list from all sources."""
 
-        def merge_commands(in_dict, out) -> None:
-            for alias, command in in_dict.items():
-                if command.action:
-                    # Resets any previous modifications to the action.
-                    # Right now, the only thing this resets is the MultiAction
-                    # command list.
-                    command.action.reset()
-
-                if alias in out:
-                    if (
-                        command.action
-                        and command.action.type == "multi"
-                        and out[alias].action
-                        and out[alias].action.type == "multi"
-                    ):
-                        out[alias].action += command.action
-                    else:
-                        out[alias] = command
-                else:
-                    out[alias] = command
+        layers = self._get_layers()
+        self.layer_order = [layer_key for layer_key, _ in layers]
+        self.layers = {layer_key: dict(commands) for layer_key, commands in layers}
+        self.alias_index = {}
+        self.multi_command_aliases = {}
 
-        self.data = {}
-        db_commands = {alias: command for alias, command in self.db_commands.items()}
+        for layer_key in self.layer_order:
+            for alias, command in self.layers[layer_key].items():
+                self.alias_index.setdefault(alias, []).append(command)
+                if isinstance(command.action, MultiAction):
+                    self.multi_command_aliases.setdefault(command, set()).add(alias)
 
-        merge_commands(self.internal_commands, self.data)
-        merge_commands(db_commands, self.data)
+        data: dict[str, Command] = {}
+        self._merge_aliases(self.alias_index.keys(), data)
+        self.data = data
 
-        if self.module_manager is not None:
-            for enabled_module in self.module_manager.modules:
-                merge_commands(enabled_module.commands, self.data)
+        self._publish_snapshot()
+
+    def update_layers(self, layer_keys: Optional[list[str]] = None) -> None:
+        """
+        Apply the changes made to the given layers since the last update to the commands list.
+        Layers are "internal", "db" and "module:<module ID>", all layers are checked if layer_keys is None.
+
+        Only the aliases that changed are merged again, and the new commands list is swapped in at once.
+        """
+
+        self._publish_snapshot()
+
+        if not self.layer_order:
+            self.rebuild()
+            return
+
+        layers = self._get_layers()
+        layer_order = [layer_key for layer_key, _ in layers]
+        current = dict(layers)
+        if [layer_key for layer_key in layer_order if layer_key in self.layers] != [
+            layer_key for layer_key in self.layer_order if layer_key in current
+        ]:
+            # The layers that are still there were reordered
+            self.rebuild()
+            return
+
+        # Layers that were added or removed have changed too
+        changed_layers = set(layer_order).symmetric_difference(self.layer_order)
+        changed_layers.update(layer_order if layer_keys is None else layer_keys)
+
+        changed_aliases: set[str] = set()
+        for layer_key in changed_layers:
+            old_commands = self.layers.get(layer_key, {})
+            new_commands = current.get(layer_key, {})
+            # Commands are compared by identity
+            changed_aliases.update(alias for alias, _ in old_commands.items() ^ new_commands.items())
+
+            if layer_key in current:
+                self.layers[layer_key] = dict(new_commands)
+            else:
+                self.layers.pop(layer_key, None)
+
+        self.layer_order = layer_order
+
+        if not changed_aliases:
+            return
+
+        for alias in changed_aliases:
+            self._index_alias(alias)
+
+        # Resetting a multi-action command undoes everything that was merged into it,
+        # so every alias the command is merged in has to be merged again
+        pending = list(changed_aliases)
+        while pending:
+            for command in self.alias_index.get(pending.pop(), []):
+                for alias in self.multi_command_aliases.get(command, ()):
+                    if alias not in changed_aliases:
+                        changed_aliases.add(alias)
+                        pending.append(alias)
+
+        data = dict(self.data)
+        self._merge_aliases(changed_aliases, data)
+        self.data = data
 
     def load(self, **options: Any) -> CommandManager:
         self.load_internal_commands()
@@ -407,7 +527,10 @@ class CommandManager(UserDict[str, Command]):
 
     def load_by_id(self, command_id: int) -> None:
         self.db_session.commit()
-        command = self.db_session.query(Command).filter_by(id=command_id, enabled=True).one_or_none()
+        query = self.db_session.query(Command)
+        if self.load_examples:
+            query = query.options(joinedload(Command.examples))
+        command = query.filter_by(id=command_id, enabled=True).one_or_none()
         if command:
             self.add_db_command_aliases(command)
             self.db_session.expunge(command)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Optional
+
+import hashlib
+import json
+import logging
+import threading
+
+from pajbot.managers.schedule import ScheduleManager
+
+from redis import Redis
+from redis.exceptions import LockError
+
+if TYPE_CHECKING:
+    from pajbot.managers.command import CommandManager
+
+log = logging.getLogger(__name__)
+
+# The snapshot is dropped if it has not been published for this many seconds (e.g. because the bot is not running),
+# so the web rebuilds it instead of showing stale commands forever
+SNAPSHOT_MAX_AGE = 15 * 60
+# How often the bot publishes the snapshot even if no commands changed, to update the usage counts
+SNAPSHOT_REFRESH_INTERVAL = 5 * 60
+# Changes made within this many seconds of each other are published together
+SNAPSHOT_PUBLISH_DELAY = 1.0
+# How long a web worker rebuilding a missing snapshot holds the lock, and how long others wait for it
+SNAPSHOT_LOCK_TIMEOUT = 30
+SNAPSHOT_LOCK_WAIT = 15
+
+
+def get_snapshot_key(streamer: str) -> str:
+    # Versions before the snapshot stored a string at {streamer}:cache:commands, the hash needs a key of its own
+    return f"{streamer}:cache:commands:v2"
+
+
+class CommandSnapshot:
+    """The jsonified list of commands shown on the web, and a version that changes whenever the list does"""
+
+    __slots__ = ("version", "commands")
+
+    def __init__(self, version: str, commands: list[dict[str, Any]]) -> None:
+        self.version = version
+        self.commands = commands
+
+
+def get_command_list(command_manager: CommandManager) -> list[dict[str, Any]]:
+    """The jsonified commands of the given command manager, as shown on the web"""
+    web_commands = command_manager.parse_for_web()
+    web_commands.sort(key=lambda x: (x.id or -1, x.main_alias))
+    return [c.jsonify() for c in web_commands]
+
+
+def build_command_list() -> list[dict[str, Any]]:
+    """Load all commands to build the command list, for when the bot has not published a snapshot"""
+    from pajbot.managers.command import CommandManager
+    from pajbot.models.module import ModuleManager
+
+    command_manager = CommandManager(socket_manager=None, module_manager=ModuleManager(None).load(), bot=None).load(
+        load_examples=True
+    )
+    return get_command_list(command_manager)
+
+
+def publish_command_snapshot(redis: Redis, streamer: str, commands: list[dict[str, Any]]) -> str:
+    """Write the command list to redis, returns its version"""
+    data = json.dumps(commands, separators=(",", ":"))
+    version = hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+    key = get_snapshot_key(streamer)
+    with redis.pipeline() as pipeline:
+        # Written in one transaction, so the version always matches the data
+        pipeline.hset(key, mapping={"version": version, "data": data})
+        pipeline.expire(key, SNAPSHOT_MAX_AGE)
+        pipeline.execute()
+
+    return version
+
+
+def get_command_snapshot_version(redis: Redis, streamer: str) -> Optional[str]:
+    return redis.hget(get_snapshot_key(streamer), "version")
+
+
+def _read_command_snapshot(redis: Redis, streamer: str) -> Optional[CommandSnapshot]:
+    version, data = redis.hmget(get_snapshot_key(streamer), ["version", "data"])
+    if version is None or data is None:
+        return None
+
+    commands = json.loads(data)
+    if not isinstance(commands, list):
+        log.warning("Poorly cached command snapshot")
+        return None
+
+    return CommandSnapshot(version, commands)
+
+
+def get_command_snapshot(redis: Redis, streamer: str) -> CommandSnapshot:
+    """
+    Returns the command snapshot published by the bot.
+    If there is none, only one caller at a time builds and publishes it, the others wait for it to be published.
+    """
+    snapshot = _read_command_snapshot(redis, streamer)
+    if snapshot is not None:
+        return snapshot
+
+    lock = redis.lock(
+        f"{get_snapshot_key(streamer)}:lock", timeout=SNAPSHOT_LOCK_TIMEOUT, blocking_timeout=SNAPSHOT_LOCK_WAIT
+    )
+    if not lock.acquire():
+        log.warning("Timed out waiting for the command snapshot to be rebuilt, building it without the lock")
+        commands = build_command_list()
+        return CommandSnapshot(publish_command_snapshot(redis, streamer, commands), commands)
+
+    try:
+        # Someone else might have published the snapshot while we were waiting for the lock
+        snapshot = _read_command_snapshot(redis, streamer)
+        if snapshot is not None:
+            return snapshot
+
+        log.debug("Building command snapshot...")
+        commands = build_command_list()
+        return CommandSnapshot(publish_command_snapshot(redis, streamer, commands), commands)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            log.warning("Command snapshot lock expired before the snapshot was built")
+
+
+class CommandSnapshotPublisher:
+    """
+    Publishes the command snapshot from the bot, shortly after commands or modules changed.
+    The snapshot is built from the bot's own command manager, which must have been loaded with load_examples=True
+    """
+
+    def __init__(self, redis: Redis, streamer: str) -> None:
+        self.redis = redis
+        self.streamer = streamer
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.version: Optional[str] = None
+        self.command_manager: Optional[CommandManager] = None
+
+    def start(self, command_manager: CommandManager) -> None:
+        self.command_manager = command_manager
+        self.schedule()
+        ScheduleManager.execute_every(SNAPSHOT_REFRESH_INTERVAL, self.publish)
+
+    def schedule(self) -> None:
+        """Publish the snapshot soon. Runs on the scheduler's threads, so it never holds up the caller"""
+        with self.lock:
+            if self.scheduled:
+                return
+            self.scheduled = True
+
+        ScheduleManager.execute_delayed(SNAPSHOT_PUBLISH_DELAY, self.publish)
+
+    def publish(self) -> None:
+        with self.lock:
+            # Changes made from now on need another publish
+            self.scheduled = False
+
+        command_manager = self.command_manager
+        if command_manager is None:
+            # Not started yet, start() publishes it
+            return
+
+        try:
+            self.version = publish_command_snapshot(self.redis, self.streamer, get_command_list(command_manager))
+        except:
+            log.exception("Failed to publish the command snapshot")
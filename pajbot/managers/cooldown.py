@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+import heapq
+import logging
+import threading
+import time
+import weakref
+
+from pajbot.managers.redis import RedisManager
+
+log = logging.getLogger(__name__)
+
+
+class _Cooldown:
+    __slots__ = ("started_at", "expires_at")
+
+    def __init__(self, started_at: float, expires_at: float) -> None:
+        self.started_at = started_at
+        self.expires_at = expires_at
+
+
+class CooldownStore:
+    """
+    Keeps track of when keys (e.g. user IDs) last started a cooldown, using monotonic timestamps.
+
+    Each cooldown is forgotten once it has run out: expired entries are popped off a heap ordered by expiry time
+    whenever the store is used, so memory is bounded by the number of cooldowns that are currently active.
+
+    If replication has been enabled with `CooldownStore.enable_replication`, stores with a namespace also write their
+    cooldowns to redis, so cooldowns survive restarts and are picked up by other bots running for the same streamer
+    when they start. The cooldowns in redis are all read once when replication is enabled, so checking a cooldown
+    never has to wait for redis.
+    A store that replaces another store of the same namespace (e.g. when commands are reloaded) takes over its cooldowns.
+    """
+
+    # Prefix of the redis keys cooldowns are replicated to, None if they are not replicated
+    redis_prefix: Optional[str] = None
+
+    # namespace -> the cooldowns read from redis when replication was enabled, as (key, started at (unix), duration).
+    # Taken by the first store of each namespace
+    replicated: dict[str, list[tuple[str, float, float]]] = {}
+    # namespace -> the latest store of that namespace
+    stores: weakref.WeakValueDictionary[str, CooldownStore] = weakref.WeakValueDictionary()
+    stores_lock = threading.Lock()
+
+    @staticmethod
+    def enable_replication(streamer: str) -> None:
+        CooldownStore.redis_prefix = f"{streamer}:cooldowns"
+        CooldownStore.replicated = CooldownStore._read_replicated(CooldownStore.redis_prefix)
+
+    @staticmethod
+    def _read_replicated(redis_prefix: str, chunk_size: int = 1000) -> dict[str, list[tuple[str, float, float]]]:
+        replicated: dict[str, list[tuple[str, float, float]]] = {}
+        try:
+            redis = RedisManager.get()
+            keys = list(redis.scan_iter(match=f"{redis_prefix}:*", count=chunk_size))
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i : i + chunk_size]
+                for redis_key, value in zip(chunk, redis.mget(chunk)):
+                    if value is None:
+                        # Expired in the meantime
+                        continue
+
+                    namespace, _, key = redis_key[len(redis_prefix) + 1 :].rpartition(":")
+                    started_at_wall, duration = (float(part) for part in value.split(":"))
+                    replicated.setdefault(namespace, []).append((key, started_at_wall, duration))
+        except:
+            log.exception("Failed to read replicated cooldowns from redis")
+
+        log.info(f"Read {sum(len(cooldowns) for cooldowns in replicated.values())} replicated cooldowns from redis")
+        return replicated
+
+    def __init__(self, namespace: Optional[str] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.namespace = namespace
+        self.clock = clock
+        self.cooldowns: dict[str, _Cooldown] = {}
+        # (expires_at, key), may contain entries of cooldowns that have been restarted since
+        self.expiry_heap: list[tuple[float, str]] = []
+        self.lock = threading.Lock()
+
+        if CooldownStore.redis_prefix is not None and namespace is not None:
+            self._take_over(namespace)
+
+    def _take_over(self, namespace: str) -> None:
+        """Start with the running cooldowns of the previous store of the namespace, or the ones read from redis"""
+        with CooldownStore.stores_lock:
+            previous = CooldownStore.stores.get(namespace, None)
+            CooldownStore.stores[namespace] = self
+            replicated = CooldownStore.replicated.pop(namespace, [])
+
+        now = self.clock()
+        if previous is not None:
+            with previous.lock:
+                previous._expire(previous.clock())
+                cooldowns = [
+                    (key, cooldown.started_at, cooldown.expires_at) for key, cooldown in previous.cooldowns.items()
+                ]
+
+            with self.lock:
+                for key, started_at, expires_at in cooldowns:
+                    self._add(key, started_at, expires_at - started_at)
+            return
+
+        wall_now = time.time()
+        with self.lock:
+            for key, started_at_wall, duration in replicated:
+                started_at = now - max(0.0, wall_now - started_at_wall)
+                if started_at + duration > now:
+                    self._add(key, started_at, duration)
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._expire(self.clock())
+            return len(self.cooldowns)
+
+    def _redis_key(self, key: str) -> Optional[str]:
+        if CooldownStore.redis_prefix is None or self.namespace is None:
+            return None
+
+        return f"{CooldownStore.redis_prefix}:{self.namespace}:{key}"
+
+    def _expire(self, now: float) -> None:
+        """Must be called with self.lock held"""
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            cooldown = self.cooldowns.get(key, None)
+            if cooldown is not None and cooldown.expires_at == expires_at:
+                del self.cooldowns[key]
+
+    def _add(self, key: str, started_at: float, duration: float) -> None:
+        """Must be called with self.lock held"""
+        expires_at = started_at + duration
+        self.cooldowns[key] = _Cooldown(started_at, expires_at)
+        heapq.heappush(self.expiry_heap, (expires_at, key))
+
+    def start(self, key: str, duration: float) -> None:
+        """Start a cooldown of `duration` seconds for the key, replacing any running cooldown"""
+        if duration <= 0:
+            with self.lock:
+                self.cooldowns.pop(key, None)
+            return
+
+        with self.lock:
+            now = self.clock()
+            self._expire(now)
+            self._add(key, now, duration)
+
+        redis_key = self._redis_key(key)
+        if redis_key is not None:
+            try:
+                RedisManager.get().set(redis_key, f"{time.time()}:{duration}", px=int(duration * 1000))
+            except:
+                log.exception("Failed to replicate cooldown to redis")
+
+    def _get(self, key: str) -> tuple[Optional[_Cooldown], float]:
+        now = self.clock()
+        with self.lock:
+            self._expire(now)
+            cooldown = self.cooldowns.get(key, None)
+
+        return cooldown, now
+
+    def time_since(self, key: str) -> Optional[float]:
+        """Seconds since the cooldown of the key was started, or None if the key has no cooldown running"""
+        cooldown, now = self._get(key)
+        if cooldown is None:
+            return None
+
+        return now - cooldown.started_at
+
+    def remaining(self, key: str) -> float:
+        """Seconds until the cooldown of the key runs out, 0 if it has no cooldown running"""
+        cooldown, now = self._get(key)
+        if cooldown is None:
+            return 0.0
+
+        return max(0.0, cooldown.expires_at - now)
+
+    def is_active(self, key: str) -> bool:
+        return self.remaining(key) > 0
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cooldowns.clear()
+            self.expiry_heap.clear()
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-from typing import Iterator, Optional
+from typing import Any, Iterable, Iterator, Optional, Sequence
 
+import io
 import logging
+import time
 from contextlib import contextmanager
+from itertools import islice
 
 import sqlalchemy
 from psycopg2.extensions import STATUS_IN_TRANSACTION
@@ -13,6 +16,17 @@ from sqlalchemy.orm import DeclarativeBase, Session, scoped_session, sessionmake
 
 log = logging.getLogger("pajbot")
 
+# Number of rows sent with each COPY in DBManager.bulk_sync
+BULK_SYNC_CHUNK_SIZE = 10000
+
+
+def _copy_escape(value: Any) -> str:
+    """Formats a value for PostgreSQL's COPY text format"""
+    if value is None:
+        return "\\N"
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
 
 class Base(DeclarativeBase):
     pass
@@ -221,6 +235,60 @@ class DBManager:
                     with sql_conn.cursor() as cursor:
                         yield cursor
 
+    @staticmethod
+    def bulk_sync(
+        table: str,
+        columns: Sequence[tuple[str, str]],
+        rows: Iterable[Sequence[Any]],
+        merge_sql: str,
+        params: Optional[dict[str, Any]] = None,
+        chunk_size: int = BULK_SYNC_CHUNK_SIZE,
+    ) -> int:
+        """
+        Streams the rows into a temporary table using COPY FROM STDIN, then runs merge_sql
+        (which reads from the temporary table) to apply them all with a single statement. Both happen
+        in one transaction, and the temporary table is dropped at the end of it.
+        This is a lot faster than INSERTing thousands of rows with executemany.
+
+        columns is a list of (name, type) of the temporary table, and every row has one value for each column.
+        merge_sql can use pyformat parameters, e.g. %(add_points)s, that are filled from params.
+        Returns the number of rows that were copied.
+        """
+
+        column_names = ", ".join(name for name, _ in columns)
+        start = time.perf_counter()
+        num_rows = 0
+        with DBManager.create_dbapi_cursor_scope() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {table}({', '.join(f'{name} {type}' for name, type in columns)}) ON COMMIT DROP"
+            )
+
+            rows_it = iter(rows)
+            while True:
+                chunk = list(islice(rows_it, chunk_size))
+                if not chunk:
+                    break
+
+                buf = io.StringIO()
+                for row in chunk:
+                    buf.write("\t".join(_copy_escape(value) for value in row))
+                    buf.write("\n")
+                buf.seek(0)
+                cursor.copy_expert(f"COPY {table}({column_names}) FROM STDIN", buf)
+
+                num_rows += len(chunk)
+                log.debug(f"bulk_sync {table}: copied {num_rows} rows")
+
+            copy_duration = time.perf_counter() - start
+            cursor.execute(merge_sql, params)
+
+        duration = time.perf_counter() - start
+        log.info(
+            f"bulk_sync {table}: synced {num_rows} rows in {duration:.2f}s "
+            f"(copy {copy_duration:.2f}s, merge {duration - copy_duration:.2f}s, {num_rows / max(duration, 1e-6):.0f} rows/s)"
+        )
+        return num_rows
+
     @staticmethod
     def debug(raw_object: object) -> None:
         try:
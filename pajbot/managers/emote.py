@@ -1,21 +1,30 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional, Protocol
+from typing import TYPE_CHECKING, Callable, Optional, Protocol
 
+import datetime
 import logging
 import random
+import threading
+from collections import OrderedDict
 
+from pajbot import utils
 from pajbot.managers.redis import RedisManager
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.emote import Emote, EmoteInstance, EmoteInstanceCount, EmoteInstanceCountMap
 from pajbot.streamhelper import StreamHelper
-from pajbot.utils import iterate_split_with_index
+from pajbot.utils import SlidingWindowCounter, iterate_split_with_index
+
+from redis.client import Pipeline
 
 if TYPE_CHECKING:
     from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
 
 log = logging.getLogger(__name__)
 
+# Number of parse_all_emotes results kept, so the same message (e.g. copypasta) is only parsed once
+PARSE_CACHE_SIZE = 256
+
 
 class EmoteAPI(Protocol):
     def get_global_emotes(self, force_fetch: bool = ...) -> list[Emote]: ...
@@ -37,6 +46,13 @@ class GenericChannelEmoteManager:
 
         self.api = api
 
+        # Called whenever the global or channel emotes of this manager change
+        self.on_update: Optional[Callable[[], None]] = None
+
+    def _updated(self) -> None:
+        if self.on_update is not None:
+            self.on_update()
+
     @property
     def global_emotes(self) -> list[Emote]:
         return self._global_emotes
@@ -45,6 +61,7 @@ class GenericChannelEmoteManager:
     def global_emotes(self, value: list[Emote]) -> None:
         self._global_emotes = value
         self.global_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        self._updated()
 
     @property
     def channel_emotes(self) -> list[Emote]:
@@ -54,6 +71,7 @@ class GenericChannelEmoteManager:
     def channel_emotes(self, value: list[Emote]) -> None:
         self._channel_emotes = value
         self.channel_lookup_table = {emote.code: emote for emote in value} if value is not None else {}
+        self._updated()
 
     def load_global_emotes(self) -> None:
         """Load channel emotes from the cache if available, or else, query the API."""
@@ -193,6 +211,19 @@ class EmoteManager:
         self.bttv_emote_manager = BTTVEmoteManager()
         self.seventv_emote_manager = SevenTVEmoteManager()
 
+        # Maps emote code -> emote for all FFZ, BTTV and 7TV emotes, with the precedence of match_word_to_emote.
+        # Never modified after it has been built, rebuild_lookup_table replaces it as a whole instead.
+        self.lookup_table: dict[str, Emote] = {}
+        self.lookup_table_lock = threading.Lock()
+        for manager in (self.ffz_emote_manager, self.bttv_emote_manager, self.seventv_emote_manager):
+            manager.on_update = self.rebuild_lookup_table
+
+        # (message, twitch emotes tag) -> (lookup table used, result of parse_all_emotes)
+        self.parse_cache: OrderedDict[
+            tuple[str, str], tuple[dict[str, Emote], tuple[list[EmoteInstance], EmoteInstanceCountMap]]
+        ] = OrderedDict()
+        self.parse_cache_lock = threading.Lock()
+
         # every 1 hour
         # note: whenever emotes are refreshed (cache is saved to redis), the key is additionally set to expire
         # in one hour. This is to prevent emotes from never refreshing if the bot restarts in less than an hour.
@@ -257,35 +288,52 @@ class EmoteManager:
 
         return emote_instances
 
-    def match_word_to_emote(self, word: str) -> Optional[Emote]:
-        emote = self.ffz_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
+    def rebuild_lookup_table(self) -> None:
+        """Merges the emote tables of the FFZ, BTTV and 7TV managers into a new lookup_table"""
+        with self.lookup_table_lock:
+            lookup_table: dict[str, Emote] = {}
+            # Tables further down take precedence:
+            # ffz channel -> bttv channel -> 7tv channel -> ffz global -> bttv global -> 7tv global
+            for table in (
+                self.seventv_emote_manager.global_lookup_table,
+                self.bttv_emote_manager.global_lookup_table,
+                self.ffz_emote_manager.global_lookup_table,
+                self.seventv_emote_manager.channel_lookup_table,
+                self.bttv_emote_manager.channel_lookup_table,
+                self.ffz_emote_manager.channel_lookup_table,
+            ):
+                lookup_table.update(table)
+
+            self.lookup_table = lookup_table
 
-        emote = self.bttv_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
+    def match_word_to_emote(self, word: str) -> Optional[Emote]:
+        return self.lookup_table.get(word, None)
 
-        emote = self.seventv_emote_manager.match_channel_emote(word)
-        if emote is not None:
-            return emote
+    def parse_all_emotes(
+        self, message: str, twitch_emotes_tag: str = ""
+    ) -> tuple[list[EmoteInstance], EmoteInstanceCountMap]:
+        lookup_table = self.lookup_table
+        key = (message, twitch_emotes_tag)
 
-        emote = self.ffz_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
+        with self.parse_cache_lock:
+            cached = self.parse_cache.get(key, None)
+            if cached is not None and cached[0] is lookup_table:
+                self.parse_cache.move_to_end(key)
+                instances, counts = cached[1]
+                return list(instances), dict(counts)
 
-        emote = self.bttv_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
+        result = self._parse_all_emotes(lookup_table, message, twitch_emotes_tag)
 
-        emote = self.seventv_emote_manager.match_global_emote(word)
-        if emote is not None:
-            return emote
+        with self.parse_cache_lock:
+            self.parse_cache[key] = (lookup_table, result)
+            self.parse_cache.move_to_end(key)
+            while len(self.parse_cache) > PARSE_CACHE_SIZE:
+                self.parse_cache.popitem(last=False)
 
-        return None
+        return list(result[0]), dict(result[1])
 
-    def parse_all_emotes(
-        self, message: str, twitch_emotes_tag: str = ""
+    def _parse_all_emotes(
+        self, lookup_table: dict[str, Emote], message: str, twitch_emotes_tag: str
     ) -> tuple[list[EmoteInstance], EmoteInstanceCountMap]:
         # Twitch Emotes
         twitch_emote_instances = self.parse_twitch_emotes_tag(twitch_emotes_tag, message)
@@ -302,7 +350,7 @@ class EmoteManager:
             if is_twitch_emote:
                 continue
 
-            emote = self.match_word_to_emote(word)
+            emote = lookup_table.get(word, None)
             if emote is None:
                 # this word is not an emote
                 continue
@@ -377,7 +425,10 @@ def compute_emote_counts(emote_instances: list[EmoteInstance]) -> dict[str, Emot
 
 class EpmManager:
     def __init__(self) -> None:
-        self.epm: dict[str, int] = {}
+        self.epm = SlidingWindowCounter(60)
+        self.lock = threading.Lock()
+        # emote code -> highest epm seen since the last flush
+        self.pending_records: dict[str, int] = {}
 
         redis = RedisManager.get()
         self.redis_zadd_if_higher = redis.register_script("""
@@ -397,26 +448,30 @@ end
 
     def handle_emotes(self, emote_counts: EmoteInstanceCountMap) -> None:
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
-        for emote_code, obj in emote_counts.items():
-            self.epm_incr(emote_code, obj.count)
+        with self.lock:
+            for emote_code, obj in emote_counts.items():
+                self.epm_incr(emote_code, obj.count)
 
     def epm_incr(self, code: str, count: int) -> None:
-        new_epm = self.epm.get(code, 0) + count
-        self.epm[code] = new_epm
-        self.save_epm_record(code, new_epm)
-        ScheduleManager.execute_delayed(60, self.epm_decr, args=[code, count])
+        new_epm = self.epm.add(code, count)
+        if new_epm > self.pending_records.get(code, 0):
+            self.pending_records[code] = new_epm
 
-    def epm_decr(self, code: str, count: int) -> None:
-        self.epm[code] -= count
+    def flush(self, pipeline: Pipeline[str]) -> None:
+        """Queue writes of the epm records seen since the last flush on the given pipeline"""
+        with self.lock:
+            records = self.pending_records
+            self.pending_records = {}
 
-    def save_epm_record(self, code: str, count: int) -> None:
         streamer = StreamHelper.get_streamer()
-        self.redis_zadd_if_higher(keys=[f"{streamer}:emotes:epmrecord", count], args=[code])
+        for code, count in records.items():
+            self.redis_zadd_if_higher(keys=[f"{streamer}:emotes:epmrecord", count], args=[code], client=pipeline)
 
     def get_emote_epm(self, emote_code: str) -> Optional[int]:
         """Returns the current "emote per minute" usage of the given emote code,
         or None if the emote is unknown to the bot."""
-        return self.epm.get(emote_code, None)
+        with self.lock:
+            return self.epm.get(emote_code)
 
     @staticmethod
     def get_emote_epm_record(emote_code) -> Optional[float]:
@@ -426,20 +481,66 @@ end
 
 
 class EcountManager:
+    # Per-stream and per-day counts are forgotten this many seconds after they were last written to
+    BUCKET_TTL = 31 * 24 * 60 * 60
+
+    def __init__(self, bucketed: bool = False) -> None:
+        # If enabled, emote uses are additionally counted per stream and per day (UTC)
+        self.bucketed = bucketed
+        self.lock = threading.Lock()
+        # emote code -> uses since the last flush
+        self.pending_counts: dict[str, int] = {}
+
+    @staticmethod
+    def get_count_key(streamer: str) -> str:
+        return f"{streamer}:emotes:count"
+
     @staticmethod
-    def handle_emotes(emote_counts: EmoteInstanceCountMap) -> None:
+    def get_stream_count_key(streamer: str, stream_id: int) -> str:
+        return f"{streamer}:emotes:count:stream:{stream_id}"
+
+    @staticmethod
+    def get_day_count_key(streamer: str, day: datetime.date) -> str:
+        return f"{streamer}:emotes:count:day:{day.isoformat()}"
+
+    def handle_emotes(self, emote_counts: EmoteInstanceCountMap) -> None:
         # passed dict maps emote code (e.g. "Kappa") to an EmoteInstanceCount instance
-        streamer = StreamHelper.get_streamer()
-        redis_key = f"{streamer}:emotes:count"
-        with RedisManager.pipeline_context() as redis:
+        with self.lock:
             for emote_code, instance_counts in emote_counts.items():
-                redis.zincrby(redis_key, instance_counts.count, emote_code)
+                self.pending_counts[emote_code] = self.pending_counts.get(emote_code, 0) + instance_counts.count
 
-    @staticmethod
-    def get_emote_count(emote_code: str) -> Optional[int]:
+    def flush(self, pipeline: Pipeline[str], stream_id: Optional[int] = None) -> None:
+        """Queue the emote count increments collected since the last flush on the given pipeline.
+        stream_id is the ID of the stream that is currently live, if any"""
+        with self.lock:
+            counts = self.pending_counts
+            self.pending_counts = {}
+
+        if not counts:
+            return
+
+        streamer = StreamHelper.get_streamer()
+        redis_keys = [self.get_count_key(streamer)]
+        if self.bucketed:
+            bucket_keys = [self.get_day_count_key(streamer, utils.now().date())]
+            if stream_id is not None:
+                bucket_keys.append(self.get_stream_count_key(streamer, stream_id))
+            redis_keys += bucket_keys
+
+        for redis_key in redis_keys:
+            for emote_code, count in counts.items():
+                pipeline.zincrby(redis_key, count, emote_code)
+
+        if self.bucketed:
+            for bucket_key in bucket_keys:
+                pipeline.expire(bucket_key, self.BUCKET_TTL)
+
+    def get_emote_count(self, emote_code: str) -> Optional[int]:
         redis = RedisManager.get()
         streamer = StreamHelper.get_streamer()
-        emote_count = redis.zscore(f"{streamer}:emotes:count", emote_code)
-        if emote_count is None:
+        emote_count = redis.zscore(self.get_count_key(streamer), emote_code)
+        with self.lock:
+            pending_count = self.pending_counts.get(emote_code, None)
+        if emote_count is None and pending_count is None:
             return None
-        return int(emote_count)
+        return int(emote_count or 0) + (pending_count or 0)
@@ -1,22 +1,66 @@
 from typing import Any, Callable
 
+import json
 import logging
 import operator
+import threading
+import time
 
 from pajbot.utils import find
 
 log = logging.getLogger("pajbot")
 
 
+class HandlerStats:
+    """Call count and latency of a single event handler"""
+
+    __slots__ = ("event", "handler", "calls", "total_time", "max_time")
+
+    def __init__(self, event: str, handler: Callable[..., bool]) -> None:
+        self.event = event
+        self.handler = handler
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def name(self) -> str:
+        return getattr(self.handler, "__qualname__", repr(self.handler))
+
+    def jsonify(self) -> dict[str, Any]:
+        return {
+            "event": self.event,
+            "handler": self.name,
+            "calls": self.calls,
+            "total_ms": round(self.total_time * 1000, 3),
+            "avg_ms": round(self.total_time * 1000 / self.calls, 3) if self.calls > 0 else 0.0,
+            "max_ms": round(self.max_time * 1000, 3),
+        }
+
+
 class HandlerManager:
     """This Dict maps event name -> List of event handlers
     Event handler is a triple: (Callable event handler, priority, run_if_propagation_stopped)"""
 
     handlers: dict[str, list[tuple[Callable[..., bool], int, bool]]] = {}
 
+    """This Dict maps event name -> the handlers to run for the event, in order.
+    Compiled from handlers when the event is first triggered after its handlers changed"""
+    plans: dict[str, tuple[tuple[Callable[..., bool], bool, HandlerStats], ...]] = {}
+
+    """Maps (event name, event handler) -> statistics of the handler"""
+    stats: dict[tuple[str, Callable[..., bool]], HandlerStats] = {}
+
+    """Held while handlers are added or removed and while plans are compiled.
+    Modules are enabled and disabled on other threads than the ones triggering events"""
+    lock = threading.RLock()
+
     @staticmethod
     def init_handlers() -> None:
-        HandlerManager.handlers = {}
+        with HandlerManager.lock:
+            HandlerManager.handlers = {}
+            HandlerManager.plans = {}
+            HandlerManager.stats = {}
 
         # on_pubmsg(source, message, tags)
         HandlerManager.create_handler("on_pubmsg")
@@ -81,46 +125,111 @@ class HandlerManager:
     @staticmethod
     def create_handler(event: str) -> None:
         """Create an empty list for the given event"""
-        HandlerManager.handlers[event] = []
+        with HandlerManager.lock:
+            HandlerManager.handlers[event] = []
+            HandlerManager.plans.pop(event, None)
 
     @staticmethod
     def add_handler(
         event: str, method: Callable[..., bool], priority: int = 0, run_if_propagation_stopped: bool = False
     ) -> None:
-        try:
-            HandlerManager.handlers[event].append((method, priority, run_if_propagation_stopped))
-            HandlerManager.handlers[event].sort(key=operator.itemgetter(1), reverse=True)
-        except KeyError:
-            # No handlers for this event found
-            log.error(f"HandlerManager.add_handler: No handler for {event} found.")
+        with HandlerManager.lock:
+            try:
+                HandlerManager.handlers[event].append((method, priority, run_if_propagation_stopped))
+            except KeyError:
+                # No handlers for this event found
+                log.error(f"HandlerManager.add_handler: No handler for {event} found.")
+                return
+
+            # Sorted when the plan is compiled again
+            HandlerManager.plans.pop(event, None)
 
     @staticmethod
     def remove_handler(event: str, method: Callable[..., bool]) -> None:
-        try:
-            handler = find(lambda h: h[0] == method, HandlerManager.handlers[event])
-            if handler is not None:
-                HandlerManager.handlers[event].remove(handler)
-        except KeyError:
-            # No handlers for this event found
-            log.error(f"remove_handler No handler for {event} found.")
+        with HandlerManager.lock:
+            try:
+                handler = find(lambda h: h[0] == method, HandlerManager.handlers[event])
+                if handler is not None:
+                    HandlerManager.handlers[event].remove(handler)
+                    HandlerManager.stats.pop((event, method), None)
+                    HandlerManager.plans.pop(event, None)
+            except KeyError:
+                # No handlers for this event found
+                log.error(f"remove_handler No handler for {event} found.")
+
+    @staticmethod
+    def _compile(event_name: str) -> tuple[tuple[Callable[..., bool], bool, HandlerStats], ...]:
+        with HandlerManager.lock:
+            # Another thread might have compiled it while we waited for the lock
+            compiled = HandlerManager.plans.get(event_name, None)
+            if compiled is not None:
+                return compiled
+
+            # Stable, so handlers with the same priority run in the order they were added
+            handlers = sorted(HandlerManager.handlers[event_name], key=operator.itemgetter(1), reverse=True)
+
+            plan = []
+            for handler, _, run_if_propagation_stopped in handlers:
+                stats = HandlerManager.stats.get((event_name, handler), None)
+                if stats is None:
+                    stats = HandlerManager.stats[(event_name, handler)] = HandlerStats(event_name, handler)
+                plan.append((handler, run_if_propagation_stopped, stats))
+
+            compiled = tuple(plan)
+            HandlerManager.plans[event_name] = compiled
+            return compiled
+
+    @staticmethod
+    def get_stats() -> list[HandlerStats]:
+        """Statistics of all handlers that have been called, the handlers that took the most time in total first"""
+        return sorted(
+            (stats for stats in list(HandlerManager.stats.values()) if stats.calls > 0),
+            key=lambda stats: stats.total_time,
+            reverse=True,
+        )
+
+    @staticmethod
+    def save_stats(redis: Any, streamer: str) -> None:
+        """Save the handler statistics to redis, for the web interface"""
+        redis.set(f"{streamer}:handler_stats", json.dumps([stats.jsonify() for stats in HandlerManager.get_stats()]))
+
+    @staticmethod
+    def load_saved_stats(redis: Any, streamer: str) -> list[dict[str, Any]]:
+        data = redis.get(f"{streamer}:handler_stats")
+        if data is None:
+            return []
+        return json.loads(data)
 
     @staticmethod
     def trigger(event_name: str, stop_on_false: bool = True, *args: Any, **kwargs: Any) -> bool:
-        if event_name not in HandlerManager.handlers:
-            log.error(f"HandlerManager.trigger: No handler set for event {event_name}")
-            return False
+        plan = HandlerManager.plans.get(event_name, None)
+        if plan is None:
+            if event_name not in HandlerManager.handlers:
+                log.error(f"HandlerManager.trigger: No handler set for event {event_name}")
+                return False
 
+            plan = HandlerManager._compile(event_name)
+
+        perf_counter = time.perf_counter
         propagation_stopped = False
-        for handler, _, run_if_propagation_stopped in HandlerManager.handlers[event_name]:
+        for handler, run_if_propagation_stopped, stats in plan:
             if propagation_stopped and not run_if_propagation_stopped:
                 continue
 
             res = None
+            start = perf_counter()
             try:
                 res = handler(*args, **kwargs)
             except:
                 log.exception(f"Unhandled exception from {handler} in {event_name}")
 
+            # Not synchronized, events triggered from several threads at once might lose an update here and there
+            elapsed = perf_counter() - start
+            stats.calls += 1
+            stats.total_time += elapsed
+            if elapsed > stats.max_time:
+                stats.max_time = elapsed
+
             if res is False and stop_on_false is True:
                 # Abort if handler returns False and stop_on_false is enabled
                 propagation_stopped = True
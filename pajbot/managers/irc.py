@@ -57,8 +57,6 @@ class IRCManager:
         self.conn: Optional[Connection] = None
         self.ping_task: Optional[ScheduledJob] = None
 
-        self.num_privmsg_sent = 0
-
         self.channels: list[str] = [self.bot.channel]
 
         if self.bot.control_hub_channel is not None:
@@ -107,33 +105,25 @@ class IRCManager:
         if self.conn is not None:
             self.conn.ping("tmi.twitch.tv")
 
-    def privmsg(self, channel: str, message: str) -> None:
-        if self.conn is None:
-            log.error("Not connected or rate limit was reached. Delaying message a few seconds.")
-            self.bot.execute_delayed(2, self.privmsg, channel, message)
-            return
-
-        self.conn.privmsg(channel, message)
-
-        self.num_privmsg_sent += 1
-        self.bot.execute_delayed(31, self._reduce_num_privmsg_sent)
-
-    def send_raw(self, message):
-        if self.conn is None:
-            log.error("Not connected or rate limit was reached. Delaying message a few seconds.")
-            self.bot.execute_delayed(2, self.send_raw, message)
-            return
+    # Rate limiting is done by the ChatQueue, these send right away
 
-        self.conn.send_raw(message)
+    def privmsg(self, channel: str, message: str) -> bool:
+        """Returns False if we are not connected"""
+        conn = self.conn
+        if conn is None:
+            return False
 
-        self.num_privmsg_sent += 1
-        self.bot.execute_delayed(31, self._reduce_num_privmsg_sent)
+        conn.privmsg(channel, message)
+        return True
 
-    def _can_send(self) -> bool:
-        return self.num_privmsg_sent < self.bot.tmi_rate_limits.privmsg_per_30
+    def send_raw(self, message: str) -> bool:
+        """Returns False if we are not connected"""
+        conn = self.conn
+        if conn is None:
+            return False
 
-    def _reduce_num_privmsg_sent(self):
-        self.num_privmsg_sent -= 1
+        conn.send_raw(message)
+        return True
 
     def _dispatcher(self, conn, event):
         method = getattr(self.bot, "on_" + event.type, None)
@@ -0,0 +1,462 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+
+import datetime
+import json
+import logging
+
+from pajbot.managers.db import DBManager
+from pajbot.managers.redis import RedisManager
+from pajbot.models.duel import UserDuelStats
+from pajbot.models.user import User
+from pajbot.streamhelper import StreamHelper
+
+from sqlalchemy import event
+from sqlalchemy.orm import Query, Session
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+log = logging.getLogger(__name__)
+
+# Number of entries kept per leaderboard. Pages and commands show at most this many
+LEADERBOARD_SIZE = 100
+# Leaderboards that are not refreshed within this time (in seconds) are computed from the database again when read
+LEADERBOARD_TTL = 60 * 60
+# Every this many seconds, the leaderboards in PERIODIC_LEADERBOARDS are computed from the database again
+REFRESH_INTERVAL = 60
+
+# Columns of User that are stored along with each entry
+USER_FIELDS = ["id", "login", "name", "level", "subscriber", "moderator", "vip", "founder"]
+DUEL_FIELDS = ["duels_won", "duels_total", "points_won", "points_lost"]
+
+
+def _winrate_score(stats: UserDuelStats) -> float:
+    # Sorts by winrate first (in hundredths of a percent), and then by number of duels won
+    return round(stats.winrate * 100) * 10_000_000 + min(stats.duels_won, 9_999_999)
+
+
+class Leaderboard:
+    """
+    Describes one leaderboard: how to get its top entries from the database, and the score each entry is sorted by.
+    Entries are either users or duel stats
+    """
+
+    def __init__(
+        self,
+        name: str,
+        query: Callable[[Session], Query[Any]],
+        score: Callable[[Any], float],
+        ascending: bool = False,
+        eligible: Callable[[Any], bool] = lambda entry: True,
+    ) -> None:
+        self.name = name
+        self.query = query
+        self.score = score
+        # If true, the entries with the lowest score are kept instead of the highest
+        self.ascending = ascending
+        # Whether an entry can be on the leaderboard at all (e.g. a minimum number of duels)
+        self.eligible = eligible
+
+    @property
+    def is_duel_leaderboard(self) -> bool:
+        return self.name.startswith("duel_")
+
+
+LEADERBOARDS = {
+    leaderboard.name: leaderboard
+    for leaderboard in [
+        Leaderboard("points", lambda s: s.query(User).order_by(User.points.desc()), lambda u: u.points),
+        Leaderboard("num_lines", lambda s: s.query(User).order_by(User.num_lines.desc()), lambda u: u.num_lines),
+        Leaderboard(
+            "time_in_chat_online",
+            lambda s: s.query(User).order_by(User.time_in_chat_online.desc()),
+            lambda u: u.time_in_chat_online.total_seconds(),
+        ),
+        Leaderboard(
+            "time_in_chat_offline",
+            lambda s: s.query(User).order_by(User.time_in_chat_offline.desc()),
+            lambda u: u.time_in_chat_offline.total_seconds(),
+        ),
+        Leaderboard(
+            "duel_won",
+            lambda s: s.query(UserDuelStats).order_by(UserDuelStats.duels_won.desc()),
+            lambda d: d.duels_won,
+        ),
+        Leaderboard(
+            "duel_lost",
+            lambda s: s.query(UserDuelStats).order_by(UserDuelStats.duels_lost.desc()),
+            lambda d: d.duels_lost,
+        ),
+        Leaderboard(
+            "duel_points_won",
+            lambda s: s.query(UserDuelStats).order_by(UserDuelStats.profit.desc()),
+            lambda d: d.profit,
+        ),
+        Leaderboard(
+            "duel_points_lost",
+            lambda s: s.query(UserDuelStats).order_by(UserDuelStats.profit.asc()),
+            lambda d: d.profit,
+            ascending=True,
+        ),
+        Leaderboard(
+            "duel_winrate",
+            lambda s: s.query(UserDuelStats)
+            .filter(UserDuelStats.duels_won >= 5)
+            .order_by(UserDuelStats.winrate.desc())
+            .order_by(UserDuelStats.duels_won.desc()),
+            _winrate_score,
+            eligible=lambda d: d.duels_won >= 5,
+        ),
+        Leaderboard(
+            "duel_winrate_bottom",
+            lambda s: s.query(UserDuelStats)
+            .filter(UserDuelStats.duels_lost >= 5)
+            .order_by(UserDuelStats.winrate.asc())
+            .order_by(UserDuelStats.duels_won.asc()),
+            _winrate_score,
+            ascending=True,
+            eligible=lambda d: d.duels_lost >= 5,
+        ),
+    ]
+}
+
+# Leaderboards whose values change all the time (e.g. with every message), and are cheap to compute
+PERIODIC_LEADERBOARDS = ["points", "num_lines"] + [name for name in LEADERBOARDS if name.startswith("duel_")]
+# Leaderboards that only change when the chatters are refreshed
+CHATTERS_REFRESH_LEADERBOARDS = ["points", "time_in_chat_online", "time_in_chat_offline"]
+
+
+def _dump_entry(entry: Any) -> str:
+    if isinstance(entry, UserDuelStats):
+        data = {field: getattr(entry.user, field) for field in USER_FIELDS}
+        data.update({field: getattr(entry, field) for field in DUEL_FIELDS})
+    else:
+        data = {field: getattr(entry, field) for field in USER_FIELDS}
+    return json.dumps(data)
+
+
+def _load_entry(leaderboard: Leaderboard, data: dict[str, Any], score: float) -> Any:
+    """Returns a (transient) User or UserDuelStats with the stored values, and the value of the score"""
+    user = User()
+    for field in USER_FIELDS:
+        setattr(user, "_login" if field == "login" else field, data[field])
+
+    if not leaderboard.is_duel_leaderboard:
+        if leaderboard.name.startswith("time_in_chat"):
+            setattr(user, leaderboard.name, datetime.timedelta(seconds=score))
+        else:
+            setattr(user, leaderboard.name, int(score))
+        return user
+
+    stats = UserDuelStats()
+    for field in DUEL_FIELDS:
+        setattr(stats, field, data[field])
+    stats.user = user
+    return stats
+
+
+class LeaderboardManager:
+    """
+    Keeps the top LEADERBOARD_SIZE entries of each leaderboard in LEADERBOARDS in redis, so the web pages and
+    commands that show them only read those instead of sorting the user table.
+
+    Each leaderboard is a sorted set of user IDs (by score), along with a hash of the stored entries.
+    They are computed from the database by refresh(), and updated in between by update_points and
+    update_duel_stats. Reading a leaderboard that doesn't exist (yet) computes it first, which is also how
+    a leaderboard is fixed up when one of its entries drops to its last place.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, streamer: Optional[str] = None) -> None:
+        self._redis = redis
+        self._streamer = streamer
+
+    @property
+    def redis(self) -> Redis:
+        return self._redis if self._redis is not None else RedisManager.get()
+
+    @property
+    def streamer(self) -> str:
+        return self._streamer if self._streamer is not None else StreamHelper.get_streamer()
+
+    def get_key(self, name: str) -> str:
+        return f"{self.streamer}:leaderboard:{name}"
+
+    def get_entries_key(self, name: str) -> str:
+        return f"{self.streamer}:leaderboard:{name}:entries"
+
+    def refresh(self, names: Optional[Iterable[str]] = None) -> None:
+        """Compute the given leaderboards (or all of them) from the database again"""
+        if names is None:
+            names = LEADERBOARDS.keys()
+
+        with DBManager.create_session_scope() as db_session:
+            for name in names:
+                self._refresh(db_session, LEADERBOARDS[name])
+
+    def _refresh(self, db_session: Session, leaderboard: Leaderboard) -> None:
+        entries = leaderboard.query(db_session).limit(LEADERBOARD_SIZE).all()
+        key = self.get_key(leaderboard.name)
+        entries_key = self.get_entries_key(leaderboard.name)
+
+        pipeline = self.redis.pipeline()
+        pipeline.delete(key, entries_key)
+        if entries:
+            pipeline.zadd(key, {self._user_id(entry): leaderboard.score(entry) for entry in entries})
+            pipeline.hset(entries_key, mapping={self._user_id(entry): _dump_entry(entry) for entry in entries})
+        else:
+            # An empty sorted set does not exist in redis, the placeholder keeps it from being computed on every read
+            pipeline.hset(entries_key, "", "")
+        pipeline.expire(key, LEADERBOARD_TTL)
+        pipeline.expire(entries_key, LEADERBOARD_TTL)
+        pipeline.execute()
+
+    @staticmethod
+    def _user_id(entry: Any) -> str:
+        return entry.user_id if isinstance(entry, UserDuelStats) else entry.id
+
+    def update_points(self, balances: dict[str, int]) -> None:
+        """
+        Update the scores of the given users on the points leaderboard.
+        Users that are not on it yet are added if they have more points than its last entry
+        """
+        if not balances:
+            return
+
+        leaderboard = LEADERBOARDS["points"]
+        key = self.get_key(leaderboard.name)
+        entries_key = self.get_entries_key(leaderboard.name)
+
+        try:
+            [position] = self._read_positions([leaderboard], list(balances.keys()))
+            # Don't start a leaderboard that has to be computed from the database first
+            if position is None:
+                return
+
+            changes = self._get_changes(
+                leaderboard, position, {user_id: points for user_id, points in balances.items()}
+            )
+            if changes is None:
+                self.redis.delete(key, entries_key)
+                return
+
+            scores, _ = changes
+            current = dict(zip(balances.keys(), position[1]))
+            new_user_ids = [user_id for user_id in scores if current[user_id] is None]
+
+            # Only users that make it onto the leaderboard are loaded, for the fields needed to display them
+            entries = {}
+            if new_user_ids:
+                with DBManager.create_session_scope() as db_session:
+                    users = db_session.query(User).filter(User.id.in_(new_user_ids)).all()
+                    entries = {user.id: _dump_entry(user) for user in users}
+
+            scores = {
+                user_id: score
+                for user_id, score in scores.items()
+                if current[user_id] is not None or user_id in entries
+            }
+            if not scores:
+                return
+
+            pipeline = self.redis.pipeline()
+            pipeline.zadd(key, {user_id: score for user_id, score in scores.items()})
+            if entries:
+                pipeline.hset(entries_key, mapping={user_id: data for user_id, data in entries.items()})
+            pipeline.execute()
+
+            if entries:
+                self._trim([leaderboard])
+        except:
+            log.exception("Failed to update the points leaderboard")
+
+    def update_duel_stats(self, users: Iterable[User], db_session: Optional[Session] = None) -> None:
+        """
+        Add or update the duel stats of the given users on the duel leaderboards.
+        If db_session is given, that is done once its transaction is committed
+        """
+        # Read right away, the users are expired once the session is committed
+        updates: dict[str, dict[str, tuple[Optional[float], str]]] = {}
+        for name, leaderboard in LEADERBOARDS.items():
+            if not leaderboard.is_duel_leaderboard:
+                continue
+
+            updates[name] = {
+                user.id: (
+                    leaderboard.score(user.duel_stats) if leaderboard.eligible(user.duel_stats) else None,
+                    _dump_entry(user.duel_stats),
+                )
+                for user in users
+            }
+
+        if db_session is None:
+            self._write_duel_stats(updates)
+        else:
+            event.listen(db_session, "after_commit", lambda db_session: self._write_duel_stats(updates), once=True)
+
+    def _write_duel_stats(self, updates: dict[str, dict[str, tuple[Optional[float], str]]]) -> None:
+        try:
+            leaderboards = [LEADERBOARDS[name] for name in updates]
+            user_ids = list(next(iter(updates.values()), {}).keys())
+
+            updated = []
+            pipeline = self.redis.pipeline()
+            for leaderboard, position in zip(leaderboards, self._read_positions(leaderboards, user_ids)):
+                # Don't start a leaderboard that has to be computed from the database first
+                if position is None:
+                    continue
+
+                key = self.get_key(leaderboard.name)
+                entries_key = self.get_entries_key(leaderboard.name)
+                entries = updates[leaderboard.name]
+                changes = self._get_changes(
+                    leaderboard, position, {user_id: score for user_id, (score, _) in entries.items()}
+                )
+                if changes is None:
+                    pipeline.delete(key, entries_key)
+                    continue
+
+                scores, removed = changes
+                if scores:
+                    pipeline.zadd(key, {user_id: score for user_id, score in scores.items()})
+                    pipeline.hset(entries_key, mapping={user_id: entries[user_id][1] for user_id in scores})
+                if removed:
+                    pipeline.zrem(key, *removed)
+                    pipeline.hdel(entries_key, *removed)
+                updated.append(leaderboard)
+            pipeline.execute()
+
+            self._trim(updated)
+        except:
+            log.exception("Failed to update the duel leaderboards")
+
+    def _read_positions(
+        self, leaderboards: list[Leaderboard], user_ids: list[str]
+    ) -> list[Optional[tuple[Optional[float], list[Optional[float]]]]]:
+        """
+        For each of the given leaderboards, returns the score of its last entry (None if it has room for more entries)
+        and the current scores of the given users (None for users that are not on it).
+        Returns None instead for leaderboards that have to be computed from the database first
+        """
+        pipeline = self.redis.pipeline()
+        for leaderboard in leaderboards:
+            key = self.get_key(leaderboard.name)
+            pipeline.exists(self.get_entries_key(leaderboard.name))
+            pipeline.zcard(key)
+            if leaderboard.ascending:
+                pipeline.zrevrange(key, 0, 0, withscores=True)
+            else:
+                pipeline.zrange(key, 0, 0, withscores=True)
+            for user_id in user_ids:
+                pipeline.zscore(key, user_id)
+        results = pipeline.execute()
+
+        positions: list[Optional[tuple[Optional[float], list[Optional[float]]]]] = []
+        step = 3 + len(user_ids)
+        for i in range(0, len(results), step):
+            exists, size, last, *scores = results[i : i + step]
+            if not exists:
+                positions.append(None)
+            else:
+                positions.append((last[0][1] if last and size >= LEADERBOARD_SIZE else None, scores))
+        return positions
+
+    @staticmethod
+    def _get_changes(
+        leaderboard: Leaderboard,
+        position: tuple[Optional[float], list[Optional[float]]],
+        scores: dict[str, Optional[float]],
+    ) -> Optional[tuple[dict[str, float], list[str]]]:
+        """
+        Returns the scores to add or update on the leaderboard, and the users to remove from it.
+        Scores of None mean the user is not eligible for the leaderboard.
+        Returns None if the leaderboard has to be computed from the database again, because a user on it dropped to
+        or past its last entry, and the entry that takes their place might not be on the leaderboard
+        """
+        last, current = position
+        added: dict[str, float] = {}
+        removed: list[str] = []
+        for (user_id, score), current_score in zip(scores.items(), current):
+            if score is not None and (
+                last is None or (score < last if leaderboard.ascending else score > last) or score == current_score
+            ):
+                added[user_id] = score
+            elif current_score is not None:
+                if last is not None:
+                    return None
+                # The leaderboard has every entry, so there is nothing to take the user's place
+                removed.append(user_id)
+        return added, removed
+
+    def _trim(self, leaderboards: list[Leaderboard]) -> None:
+        """Remove the entries past the first LEADERBOARD_SIZE from the given leaderboards, and their stored values"""
+        if not leaderboards:
+            return
+
+        pipeline = self.redis.pipeline()
+        for leaderboard in leaderboards:
+            if leaderboard.ascending:
+                pipeline.zrange(self.get_key(leaderboard.name), LEADERBOARD_SIZE, -1)
+            else:
+                pipeline.zrange(self.get_key(leaderboard.name), 0, -LEADERBOARD_SIZE - 1)
+        removed = pipeline.execute()
+
+        pipeline = self.redis.pipeline()
+        for leaderboard, user_ids in zip(leaderboards, removed):
+            if user_ids:
+                pipeline.zrem(self.get_key(leaderboard.name), *user_ids)
+                pipeline.hdel(self.get_entries_key(leaderboard.name), *user_ids)
+        pipeline.execute()
+
+    def get(self, name: str, num_entries: int) -> list[tuple[Any, int]]:
+        """
+        Returns the top num_entries entries of the given leaderboard, along with their rank.
+        Entries are User objects (or UserDuelStats for the duel leaderboards) that are not in the database session,
+        with the value of the leaderboard and the fields needed to display the user.
+        Entries with the same score have the same rank.
+        """
+        leaderboard = LEADERBOARDS[name]
+        key = self.get_key(name)
+
+        entries = self._read(leaderboard, num_entries)
+        if entries is None:
+            self.refresh([name])
+            entries = self._read(leaderboard, num_entries) or []
+
+        ranked = []
+        previous_score = None
+        rank = 0
+        for i, (entry, score) in enumerate(entries, start=1):
+            if score != previous_score:
+                rank = i
+                previous_score = score
+            ranked.append((entry, rank))
+
+        log.debug(f"Read {len(ranked)} entries from {key}")
+        return ranked
+
+    def _read(self, leaderboard: Leaderboard, num_entries: int) -> Optional[list[tuple[Any, float]]]:
+        key = self.get_key(leaderboard.name)
+        entries_key = self.get_entries_key(leaderboard.name)
+
+        pipeline = self.redis.pipeline()
+        if leaderboard.ascending:
+            pipeline.zrange(key, 0, num_entries - 1, withscores=True)
+        else:
+            pipeline.zrevrange(key, 0, num_entries - 1, withscores=True)
+        pipeline.exists(entries_key)
+        scores, exists = pipeline.execute()
+
+        if not exists:
+            return None
+
+        if not scores:
+            return []
+
+        entries = []
+        for (user_id, score), data in zip(scores, self.redis.hmget(entries_key, [user_id for user_id, _ in scores])):
+            if data is None:
+                continue
+            entries.append((_load_entry(leaderboard, json.loads(data), score), score))
+        return entries
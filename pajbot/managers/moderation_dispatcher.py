@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import pajbot.config as cfg
+from pajbot.models.moderation_action import Ban, ModerationAction, Timeout, Unban, Untimeout, merge_moderation_actions
+from pajbot.utils import TokenBucket
+
+if TYPE_CHECKING:
+    from pajbot.bot import Bot
+
+log = logging.getLogger(__name__)
+
+
+class _PendingActions:
+    __slots__ = ("user_id", "actions", "queued_at")
+
+    def __init__(self, user_id: Optional[str], action: ModerationAction, queued_at: float) -> None:
+        self.user_id = user_id
+        # Executed in order. Consecutive actions that can be merged are merged on submit
+        self.actions: list[ModerationAction] = [action]
+        self.queued_at = queued_at
+
+
+class ModerationDispatcher:
+    """
+    Executes bans, timeouts, unbans and untimeouts on a pool of worker threads,
+    so the thread handling chat never waits on the Twitch API.
+
+    Actions are queued per user: actions submitted for a user that is already waiting in the queue are merged
+    into its pending actions (a timeout followed by a ban becomes a single ban), and actions for the same user
+    are never executed concurrently, so they are applied in the order they were submitted.
+    Actions that would not change anything because an equal or stronger action was executed
+    for the same user within the last `dedupe_window` seconds are dropped.
+    """
+
+    def __init__(self, bot: Bot, config: cfg.Config) -> None:
+        self.bot = bot
+
+        self.num_workers = self._get_int_option(config, "moderation_workers", 4)
+        self.dedupe_window = self._get_int_option(config, "moderation_dedupe_window", 10)
+        # Helix allows 800 requests per minute for the bot's token, some of them are left for everything else
+        self.rate_limit = TokenBucket(self._get_int_option(config, "moderation_rate_limit", 400), 60)
+
+        self.lock = threading.Lock()
+        self.queue: queue.Queue[Optional[str]] = queue.Queue(
+            self._get_int_option(config, "moderation_queue_size", 1000)
+        )
+        # login -> actions that have been submitted but not started yet
+        self.pending: dict[str, _PendingActions] = {}
+        # logins whose actions are being executed right now
+        self.in_flight: set[str] = set()
+        # login -> (last executed action, when it was executed). Oldest first
+        self.recent: OrderedDict[str, tuple[ModerationAction, float]] = OrderedDict()
+
+        self.submitted = 0
+        self.merged = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.executed = 0
+        self.failed = 0
+        # latency is measured from the first submit to the end of execution, per user
+        self.completed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+        self.workers: list[threading.Thread] = []
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name=f"ModerationDispatcher-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    @staticmethod
+    def _get_int_option(config: cfg.Config, key: str, default: int) -> int:
+        try:
+            return int(config["main"].get(key, str(default)))
+        except ValueError:
+            log.exception(f"Bad {key} in your config")
+            return default
+
+    def submit(self, login: str, action: ModerationAction, user_id: Optional[str] = None) -> bool:
+        """Queue the action for the given user. Returns False if the action was dropped"""
+        now = time.monotonic()
+
+        with self.lock:
+            self.submitted += 1
+
+            pending = self.pending.get(login, None)
+            if pending is not None:
+                if pending.user_id is None:
+                    pending.user_id = user_id
+
+                merged = merge_moderation_actions(pending.actions[-1], action)
+                if merged is not None:
+                    pending.actions[-1] = merged
+                else:
+                    pending.actions.append(action)
+                self.merged += 1
+                return True
+
+            if self._is_duplicate(login, action, now):
+                self.deduplicated += 1
+                return False
+
+            self.pending[login] = _PendingActions(user_id, action, now)
+            if login in self.in_flight:
+                # The worker currently handling this user queues it again once it is done
+                return True
+
+            return self._enqueue(login)
+
+    def _is_duplicate(self, login: str, action: ModerationAction, now: float) -> bool:
+        # Forget about actions that are out of the window
+        while self.recent:
+            oldest_login, (_, executed_at) = next(iter(self.recent.items()))
+            if now - executed_at <= self.dedupe_window:
+                break
+            del self.recent[oldest_login]
+
+        recent = self.recent.get(login, None)
+        if recent is None:
+            return False
+
+        recent_action = recent[0]
+        merged = merge_moderation_actions(recent_action, action)
+        if merged is None or type(merged) is not type(recent_action):
+            return False
+
+        if isinstance(merged, Timeout) and isinstance(recent_action, Timeout):
+            return merged.duration == recent_action.duration
+
+        return True
+
+    def _enqueue(self, login: str) -> bool:
+        """Must be called with self.lock held"""
+        try:
+            self.queue.put_nowait(login)
+        except queue.Full:
+            pending = self.pending.pop(login)
+            self.dropped += len(pending.actions)
+            log.error(f"Moderation queue is full, dropping {pending.actions} for {login}")
+            return False
+
+        return True
+
+    def _run(self) -> None:
+        while True:
+            login = self.queue.get()
+            if login is None:
+                return
+
+            with self.lock:
+                pending = self.pending.pop(login, None)
+                if pending is None:
+                    continue
+                self.in_flight.add(login)
+
+            succeeded = False
+            try:
+                succeeded = self._execute(login, pending)
+            except:
+                log.exception(f"Failed to execute moderation actions {pending.actions} for {login}")
+            finally:
+                now = time.monotonic()
+                with self.lock:
+                    self.in_flight.discard(login)
+
+                    latency = now - pending.queued_at
+                    self.completed += 1
+                    self.total_latency += latency
+                    self.max_latency = max(self.max_latency, latency)
+
+                    self.recent.pop(login, None)
+                    if succeeded:
+                        self.recent[login] = (pending.actions[-1], now)
+                    else:
+                        self.failed += 1
+
+                    if login in self.pending:
+                        # More actions were submitted while we were busy
+                        self._enqueue(login)
+
+    def _execute(self, login: str, pending: _PendingActions) -> bool:
+        user_id = pending.user_id
+        if user_id is None:
+            self.rate_limit.acquire()
+            user_id = self.bot.twitch_helix_api.get_user_id(login)
+            if user_id is None:
+                log.error(
+                    f"Attempted to execute {pending.actions} on user with login {login}, but no such user was found"
+                )
+                return False
+
+        for action in pending.actions:
+            if isinstance(action, Ban):
+                self.rate_limit.acquire()
+                self.bot._ban(user_id, action.reason)
+            elif isinstance(action, Timeout):
+                self.rate_limit.acquire()
+                self.bot._timeout(user_id, action.duration, action.reason)
+            elif isinstance(action, Unban):
+                self.rate_limit.acquire()
+                self.bot._unban(user_id)
+            elif isinstance(action, Untimeout):
+                # Looks up the ban status first
+                self.rate_limit.acquire(2)
+                self.bot._untimeout(user_id)
+
+            with self.lock:
+                self.executed += 1
+
+        return True
+
+    def stop(self, timeout: float = 5) -> None:
+        """Wait up to `timeout` seconds for the queued actions to be executed, then stop the workers"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if not self.pending and not self.in_flight:
+                    break
+            time.sleep(0.05)
+
+        for _ in self.workers:
+            try:
+                self.queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def stats(self) -> dict[str, float]:
+        with self.lock:
+            return {
+                "queued": self.queue.qsize(),
+                "in_flight": len(self.in_flight),
+                "submitted": self.submitted,
+                "merged": self.merged,
+                "deduplicated": self.deduplicated,
+                "dropped": self.dropped,
+                "executed": self.executed,
+                "failed": self.failed,
+                "avg_latency": round(self.total_latency / self.completed, 3) if self.completed > 0 else 0.0,
+                "max_latency": round(self.max_latency, 3),
+            }
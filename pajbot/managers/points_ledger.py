@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Optional, Union
+
+import logging
+
+from pajbot.models.user import User
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+if TYPE_CHECKING:
+    from pajbot.managers.leaderboard import LeaderboardManager
+    from pajbot.managers.user_cache import UserCache
+
+log = logging.getLogger(__name__)
+
+_APPLY_SQL = """
+UPDATE "user" SET points = "user".points + d.delta
+FROM unnest(CAST(:user_ids AS TEXT[]), CAST(:deltas AS BIGINT[])) AS d(user_id, delta)
+WHERE "user".id = d.user_id
+RETURNING "user".id, "user".points, d.delta
+"""
+
+
+_APPLY_WITH_AUDIT_SQL = f"""
+WITH changed AS ({_APPLY_SQL}), audit AS (
+    INSERT INTO user_points_ledger(user_id, delta, reason) SELECT id, delta, :reason FROM changed
+)
+SELECT * FROM changed
+"""
+
+# Key in Session.info of the balances changed in the session's transaction, by user ID
+_PENDING_BALANCES = "points_ledger_balances"
+
+
+class PointsLedger:
+    """
+    Changes the points of users with `points = points + delta` statements, so concurrent changes to the same user
+    (e.g. from the chatters refresh) are not lost.
+    All changes passed to apply() are written with a single statement, no matter how many users they touch.
+
+    If audit is enabled, every change is also recorded in the user_points_ledger table, within the same statement.
+
+    The user cache and the leaderboards are told about the changes once the session's transaction is committed.
+    """
+
+    def __init__(
+        self,
+        user_cache: Optional[UserCache] = None,
+        audit: bool = False,
+        leaderboards: Optional[LeaderboardManager] = None,
+    ) -> None:
+        self.user_cache = user_cache
+        self.audit = audit
+        self.leaderboards = leaderboards
+
+        self.apply_sql = text(_APPLY_WITH_AUDIT_SQL if audit else _APPLY_SQL)
+
+    def apply(
+        self,
+        db_session: Session,
+        deltas: Union[Mapping[str, int], Iterable[tuple[str, int]]],
+        reason: str,
+        users: Iterable[User] = (),
+    ) -> dict[str, int]:
+        """
+        Adds the given amount of points (which can be negative) to each user ID.
+        Multiple deltas for the same user are summed up.
+        Users loaded in db_session get the change applied, pass users loaded in other sessions
+        (e.g. the user who sent the message) as `users` to have it applied to them too.
+        Returns the new balance of each user that exists, by user ID.
+        """
+        summed: dict[str, int] = {}
+        for user_id, delta in deltas.items() if isinstance(deltas, Mapping) else deltas:
+            summed[user_id] = summed.get(user_id, 0) + delta
+
+        summed = {user_id: delta for user_id, delta in summed.items() if delta != 0}
+        if not summed:
+            return {}
+
+        rows = db_session.execute(
+            self.apply_sql, {"user_ids": list(summed.keys()), "deltas": list(summed.values()), "reason": reason}
+        )
+        return self._on_changed(db_session, rows, users)
+
+    def credit(self, db_session: Session, user_ids: Iterable[str], amount: int, reason: str) -> dict[str, int]:
+        """Gives each of the given users the same amount of points"""
+        return self.apply(db_session, {user_id: amount for user_id in user_ids}, reason)
+
+    def _on_changed(self, db_session: Session, rows: Iterable[Any], users: Iterable[User] = ()) -> dict[str, int]:
+        balances: dict[str, int] = {}
+        deltas: dict[str, int] = {}
+        for user_id, points, delta in rows:
+            balances[user_id] = points
+            deltas[user_id] = delta
+
+        if not balances:
+            return balances
+
+        # Users loaded in the same session get the change applied, without marking them as modified.
+        # Changes that have not been written yet are kept, so they are still written (or stashed by the user cache)
+        objs = {id(obj): obj for obj in db_session.identity_map.values() if isinstance(obj, User)}
+        objs.update({id(user): user for user in users})
+        for obj in objs.values():
+            if obj.id not in deltas:
+                continue
+
+            history = inspect(obj).attrs.points.history
+            current = obj.points
+            original = history.deleted[0] if history.deleted else current
+            set_committed_value(obj, "points", original + deltas[obj.id])
+            if current != original:
+                obj.points = current + deltas[obj.id]
+
+        self._notify_after_commit(db_session, balances)
+
+        return balances
+
+    def _notify_after_commit(self, db_session: Session, balances: dict[str, int]) -> None:
+        """
+        Tell the user cache and the leaderboards about the new balances once they are committed.
+        Until then, other sessions still read the old balances, which must not be cached as fresh
+        """
+        if self.user_cache is None and self.leaderboards is None:
+            return
+
+        pending = db_session.info.get(_PENDING_BALANCES, None)
+        if pending is None:
+            pending = db_session.info[_PENDING_BALANCES] = {}
+            event.listen(db_session, "after_commit", self._on_commit, once=True)
+            event.listen(db_session, "after_rollback", self._on_rollback, once=True)
+        pending.update(balances)
+
+    def _on_commit(self, db_session: Session) -> None:
+        balances = db_session.info.pop(_PENDING_BALANCES, None)
+        if not balances:
+            return
+
+        # Cached copies of these users are outdated now
+        if self.user_cache is not None:
+            self.user_cache.invalidate(list(balances.keys()))
+
+        if self.leaderboards is not None:
+            self.leaderboards.update_points(balances)
+
+    def _on_rollback(self, db_session: Session) -> None:
+        db_session.info.pop(_PENDING_BALANCES, None)
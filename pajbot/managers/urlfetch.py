@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from typing import Callable
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pajbot.utils import get_content_type_mime_type
+
+import requests
+from redis import Redis
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+# Number of URLs fetched at the same time
+URLFETCH_WORKERS = 8
+# (connect, read) timeouts of a single request
+URLFETCH_TIMEOUT = (3.0, 5.0)
+# Maximum time spent downloading a response, in seconds
+URLFETCH_DEADLINE = 8.0
+# Only this many bytes of a response are read
+URLFETCH_MAX_BODY_SIZE = 64 * 1024
+# Only this many characters of a response end up in the message
+URLFETCH_MAX_VALUE_LENGTH = 400
+
+
+class URLFetcher:
+    """
+    Fetches the values of $(urlfetch ...) substitutions on a dedicated thread pool, with a pooled session.
+
+    Requests for a URL that is already being fetched wait for that request instead of making their own,
+    and if `cache_ttl` is set, successful responses are cached in redis for that many seconds.
+    """
+
+    def __init__(self, redis: Redis, streamer: str, user_agent: str, cache_ttl: int = 0) -> None:
+        self.redis = redis
+        self.streamer = streamer
+        self.cache_ttl = cache_ttl
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=URLFETCH_WORKERS, pool_maxsize=URLFETCH_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Accept": "text/plain",
+                "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
+                "User-Agent": user_agent,
+            }
+        )
+
+        self.executor = ThreadPoolExecutor(URLFETCH_WORKERS, thread_name_prefix="URLFetch")
+
+        # url -> the request for it that is queued or running
+        self.in_flight: dict[str, Future[str]] = {}
+        self.lock = threading.Lock()
+
+    def _cache_key(self, url: str) -> str:
+        return f"{self.streamer}:urlfetch:{url}"
+
+    def fetch(self, url: str) -> Future[str]:
+        """Returns a future that resolves to the value the URL should be substituted with"""
+        with self.lock:
+            future = self.in_flight.get(url, None)
+            if future is not None:
+                return future
+
+            future = self.executor.submit(self._fetch, url)
+            self.in_flight[url] = future
+
+        # Added outside of the lock, the callback runs right away if the future is already done
+        future.add_done_callback(lambda f: self._forget(url, f))
+        return future
+
+    def _forget(self, url: str, future: Future[str]) -> None:
+        with self.lock:
+            if self.in_flight.get(url, None) is future:
+                del self.in_flight[url]
+
+    def fetch_all(self, urls: list[str], callback: Callable[[dict[str, str]], None]) -> None:
+        """Fetches all URLs in parallel, then calls callback with a dict of url -> value from the thread pool"""
+        futures = {url: self.fetch(url) for url in set(urls)}
+        if not futures:
+            callback({})
+            return
+
+        remaining = [len(futures)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_: Future[str]) -> None:
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+
+            values: dict[str, str] = {}
+            for url, future in futures.items():
+                try:
+                    values[url] = future.result()
+                except:
+                    log.exception(f"Unhandled exception while fetching {url}")
+                    values[url] = "urlfetch error"
+
+            try:
+                callback(values)
+            except:
+                log.exception("Unhandled exception in urlfetch callback")
+
+        for future in futures.values():
+            future.add_done_callback(on_done)
+
+    def _fetch(self, url: str) -> str:
+        if self.cache_ttl > 0:
+            try:
+                cached = self.redis.get(self._cache_key(url))
+                if cached is not None:
+                    return cached
+            except:
+                log.exception("Failed to read cached urlfetch response from redis")
+
+        try:
+            ok, value = self._download(url)
+        except requests.Timeout:
+            log.info(f"urlfetch of {url} timed out")
+            return "urlfetch error: timed out"
+        except requests.RequestException as e:
+            log.info(f"urlfetch of {url} failed: {e}")
+            return "urlfetch error"
+
+        if ok and self.cache_ttl > 0:
+            try:
+                self.redis.setex(self._cache_key(url), self.cache_ttl, value)
+            except:
+                log.exception("Failed to cache urlfetch response in redis")
+
+        return value
+
+    def _download(self, url: str) -> tuple[bool, str]:
+        """Returns whether the response was successful, and the value to substitute"""
+        deadline = time.monotonic() + URLFETCH_DEADLINE
+        with self.session.get(url, allow_redirects=True, stream=True, timeout=URLFETCH_TIMEOUT) as r:
+            ok = r.status_code == requests.codes.ok
+            # For "legacy" reasons, we don't check the content type of ok status codes
+            if not ok and get_content_type_mime_type(r) != "text/plain":
+                # The content type is not plain text, return a generic error showing the status code returned
+                return False, f"urlfetch error {r.status_code}"
+
+            body = bytearray()
+            for chunk in r.iter_content(chunk_size=8192):
+                body += chunk
+                if len(body) >= URLFETCH_MAX_BODY_SIZE:
+                    del body[URLFETCH_MAX_BODY_SIZE:]
+                    break
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(f"Response took longer than {URLFETCH_DEADLINE}s")
+
+            try:
+                text = body.decode(r.encoding or "utf-8", errors="replace")
+            except LookupError:
+                text = body.decode("utf-8", errors="replace")
+
+        return ok, text.strip().replace("\n", "").replace("\r", "")[:URLFETCH_MAX_VALUE_LENGTH]
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+from typing import Any, Iterable, Iterator, Optional
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pajbot.config as cfg
+from pajbot.managers.db import Base, DBManager
+from pajbot.models.user import User, UserBasics
+
+from sqlalchemy import bindparam, event, inspect, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+log = logging.getLogger(__name__)
+
+# User attributes whose changes are not written by the per-message session,
+# but kept in memory and written in batches by UserCache.commit.
+# Maps attribute name -> column name
+WRITE_BEHIND_ATTRIBUTES = {
+    "_login": "login",
+    "name": "name",
+    "last_seen": "last_seen",
+    "last_active": "last_active",
+    "num_lines": "num_lines",
+    "points": "points",
+    "tokens": "tokens",
+    "subscriber": "subscriber",
+    "moderator": "moderator",
+    "vip": "vip",
+    "founder": "founder",
+}
+
+# These columns are written as `column = column + delta` instead of an absolute value,
+# so changes made to the same user from other sessions in the meantime are not lost
+COUNTER_COLUMNS = {"num_lines", "points", "tokens"}
+
+# Key in Session.info of the counter attributes written as deltas by the current flush, with their values
+_COUNTERS_WRITTEN = "user_cache_counters_written"
+
+
+class _CacheEntry:
+    __slots__ = ("user", "loaded_at", "stale")
+
+    def __init__(self, user: User, loaded_at: float) -> None:
+        self.user = user
+        self.loaded_at = loaded_at
+        self.stale = False
+
+
+class UserCache:
+    """
+    Bounded LRU cache of User objects, keyed by their Twitch user ID.
+
+    Cached users are re-attached to the message's DB session instead of being selected again on every message.
+    Changes to the attributes in WRITE_BEHIND_ATTRIBUTES are collected in memory and written to the database
+    in batches by commit(), which is called from Bot.commit_all.
+
+    Users loaded from the database by any session get the changes that have not been written yet applied,
+    and changes to their counter columns are written as deltas from those values.
+    """
+
+    def __init__(self, config: cfg.Config) -> None:
+        try:
+            self.max_size = int(config["main"].get("user_cache_size", "10000"))
+        except ValueError:
+            log.exception("Bad user_cache_size in your config")
+            self.max_size = 10000
+
+        try:
+            self.ttl = int(config["main"].get("user_cache_ttl", "300"))
+        except ValueError:
+            log.exception("Bad user_cache_ttl in your config")
+            self.ttl = 300
+
+        self.lock = threading.RLock()
+        self.entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+
+        # user ID -> column name -> value (or delta, for counter columns)
+        self.pending: dict[str, dict[str, Any]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+        # Any other session writing to a cached user makes our copy outdated
+        event.listen(Session, "after_flush", self._on_after_flush)
+        event.listen(Session, "before_flush", self._on_before_flush)
+        event.listen(Session, "after_flush_postexec", self._on_after_flush_postexec)
+        event.listen(User, "load", self._on_load)
+        event.listen(User, "refresh", self._on_refresh)
+
+    @contextmanager
+    def user_scope(self, basics: UserBasics) -> Iterator[User]:
+        """
+        Yields the User for the given basics, attached to a fresh DB session.
+        Drop-in replacement for:
+        with DBManager.create_session_scope(expire_on_commit=False) as db_session:
+            user = User.from_basics(db_session, basics)
+        """
+
+        user: Optional[User] = None
+        try:
+            with DBManager.create_session_scope(expire_on_commit=False) as db_session:
+                user = self._attach(db_session, basics)
+                try:
+                    yield user
+                finally:
+                    self._stash(user)
+        except:
+            # The session has been rolled back, which expires the user object
+            if user is not None:
+                self.evict(user.id)
+            raise
+
+    def _attach(self, db_session: Session, basics: UserBasics) -> User:
+        with self.lock:
+            entry = self.entries.get(basics.id, None)
+            in_use = False
+            if entry is not None:
+                if inspect(entry.user).session_id is not None:
+                    # Currently in use by another session (e.g. on another thread), fall back to the uncached path
+                    in_use = True
+                elif entry.stale or time.monotonic() - entry.loaded_at > self.ttl:
+                    self._evict(basics.id)
+                    self.reloads += 1
+                else:
+                    self.entries.move_to_end(basics.id)
+                    self.hits += 1
+                    user = entry.user
+                    db_session.add(user)
+                    # Lazy relationships are loaded again on next access
+                    db_session.expire(user, ["_duel_stats"])
+                    user._login = basics.login
+                    user.name = basics.name
+                    return user
+            else:
+                self.misses += 1
+
+        # Loaded outside of the lock, so other threads don't wait for the database.
+        # Pending changes are applied by _on_load
+        user = User.from_basics(db_session, basics)
+        if in_use:
+            return user
+
+        with self.lock:
+            if basics.id in self.entries:
+                # Another thread cached the user in the meantime
+                return user
+
+            self.entries[basics.id] = _CacheEntry(user, time.monotonic())
+            while len(self.entries) > self.max_size:
+                self._evict(next(iter(self.entries)))
+
+        return user
+
+    def _on_load(self, user: User, context: Any) -> None:
+        self._apply_pending(user)
+
+    def _on_refresh(self, user: User, context: Any, attrs: Optional[Iterable[str]]) -> None:
+        self._apply_pending(user, attrs)
+
+    def _apply_pending(self, user: User, attrs: Optional[Iterable[str]] = None) -> None:
+        """Make a user loaded from the database reflect changes that have not been written to the database yet"""
+        with self.lock:
+            pending = self.pending.get(user.id, None)
+            if pending is None:
+                return
+
+            for attr, column in WRITE_BEHIND_ATTRIBUTES.items():
+                if column not in pending or (attrs is not None and attr not in attrs):
+                    continue
+
+                value = pending[column]
+                if column in COUNTER_COLUMNS:
+                    value = getattr(user, attr) + value
+                set_committed_value(user, attr, value)
+
+    def _on_before_flush(self, db_session: Session, flush_context: Any, instances: Any) -> None:
+        """
+        Write changes to the counter columns of users as deltas. The loaded values include pending changes
+        (see _apply_pending), so writing the absolute value would apply those twice once they are written
+        """
+        written: list[tuple[User, str, Any]] = []
+        for obj in db_session.dirty:
+            if not isinstance(obj, User):
+                continue
+
+            for attr, column in WRITE_BEHIND_ATTRIBUTES.items():
+                if column not in COUNTER_COLUMNS:
+                    continue
+
+                history = inspect(obj).attrs[attr].history
+                if not history.added or not history.deleted:
+                    continue
+
+                value = history.added[0]
+                delta = value - history.deleted[0]
+                setattr(obj, attr, getattr(User, attr) + delta)
+                written.append((obj, attr, value))
+
+        if written:
+            db_session.info.setdefault(_COUNTERS_WRITTEN, []).extend(written)
+
+    def _on_after_flush_postexec(self, db_session: Session, flush_context: Any) -> None:
+        # Keep the values instead of loading them again on next access
+        for obj, attr, value in db_session.info.pop(_COUNTERS_WRITTEN, []):
+            set_committed_value(obj, attr, value)
+
+    def _stash(self, user: User) -> None:
+        """Move the changes of the write-behind attributes from the user's SQLAlchemy history into self.pending"""
+        state = inspect(user)
+        if state.pending or state.transient:
+            # New users are written with the session that created them
+            return
+
+        with self.lock:
+            for attr, column in WRITE_BEHIND_ATTRIBUTES.items():
+                history = state.attrs[attr].history
+                if not history.has_changes():
+                    continue
+
+                new_value = getattr(user, attr)
+                pending = self.pending.setdefault(user.id, {})
+                if column in COUNTER_COLUMNS:
+                    old_value = history.deleted[0] if history.deleted else new_value
+                    pending[column] = pending.get(column, 0) + (new_value - old_value)
+                else:
+                    pending[column] = new_value
+
+                # Mark the attribute as unchanged so the session does not write it
+                set_committed_value(user, attr, new_value)
+
+    def _evict(self, user_id: str) -> None:
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+
+        self.evictions += 1
+        # Keep changes made to the detached object since it was last used
+        if inspect(entry.user).detached:
+            self._stash(entry.user)
+
+    def evict(self, user_id: str) -> None:
+        with self.lock:
+            self._evict(user_id)
+
+    def invalidate(self, user_ids: Optional[list[str]] = None) -> None:
+        """
+        Mark the given cached users (or all cached users if user_ids is None) as outdated, forcing them to be
+        loaded from the database the next time they are used.
+        Call this after updating users with raw SQL.
+        """
+        with self.lock:
+            if user_ids is None:
+                entries = list(self.entries.values())
+            else:
+                entries = [self.entries[user_id] for user_id in user_ids if user_id in self.entries]
+
+            for entry in entries:
+                entry.stale = True
+
+    def _on_after_flush(self, db_session: Session, flush_context: Any) -> None:
+        for obj in (*db_session.new, *db_session.dirty, *db_session.deleted):
+            if not isinstance(obj, User):
+                continue
+
+            entry = self.entries.get(obj.id, None)
+            if entry is not None and entry.user is not obj:
+                entry.stale = True
+
+    def commit(self) -> None:
+        with self.lock:
+            for entry in self.entries.values():
+                if inspect(entry.user).detached:
+                    self._stash(entry.user)
+
+            pending = self.pending
+            self.pending = {}
+
+        if not pending:
+            return
+
+        # Group the updates by which columns they touch, so each group can be written with a single executemany
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for user_id, values in pending.items():
+            columns = tuple(sorted(values.keys()))
+            groups.setdefault(columns, []).append({"b_id": user_id, **{f"b_{c}": values[c] for c in columns}})
+
+        table = Base.metadata.tables[User.__tablename__]
+        try:
+            with DBManager.create_session_scope() as db_session:
+                for columns, params in groups.items():
+                    stmt = (
+                        update(table)
+                        .where(table.c.id == bindparam("b_id"))
+                        .values(
+                            {
+                                c: (table.c[c] + bindparam(f"b_{c}")) if c in COUNTER_COLUMNS else bindparam(f"b_{c}")
+                                for c in columns
+                            }
+                        )
+                    )
+                    db_session.execute(stmt, params)
+        except:
+            log.exception("Failed to write cached user changes, retrying on next commit")
+            with self.lock:
+                for user_id, values in pending.items():
+                    merged = self.pending.setdefault(user_id, {})
+                    for column, value in values.items():
+                        if column in COUNTER_COLUMNS:
+                            merged[column] = merged.get(column, 0) + value
+                        else:
+                            # Values stashed in the meantime are newer
+                            merged.setdefault(column, value)
+            return
+
+        self.flushes += 1
+        self.flushed_rows += len(pending)
+        log.debug(f"Wrote changes of {len(pending)} cached users ({self.stats()})")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "pending": len(self.pending),
+        }
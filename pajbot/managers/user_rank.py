@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from typing import Any, Callable
+
+import logging
+import threading
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import InstrumentedAttribute, Session
+
+log = logging.getLogger(__name__)
+
+# How long (in seconds) a computed rank is reused
+RANK_CACHE_TTL = 30
+# Maximum number of cached ranks, expired ones are removed once this is reached
+RANK_CACHE_MAX_SIZE = 10000
+
+
+class UserRankService:
+    """
+    Answers the rank of a single user (by points, num_lines, etc.), which is one more than the number of users
+    with a higher value. That's a count(*) over the index of the column, instead of ranking every user.
+    This matches the RANK() of the user_rank materialized view, but is always up to date.
+
+    Ranks are cached by their value, so all users with e.g. 0 points share one cached rank.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RANK_CACHE_TTL,
+        max_size: int = RANK_CACHE_MAX_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (column name, value) -> (rank, expires at)
+        self.ranks: dict[tuple[str, Any], tuple[int, float]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_rank(self, db_session: Session, column: InstrumentedAttribute[Any], value: Any) -> int:
+        key = (column.key, value)
+        now = self.clock()
+        with self.lock:
+            cached = self.ranks.get(key, None)
+            if cached is not None and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        rank = (db_session.scalar(select(func.count()).where(column > value)) or 0) + 1
+
+        with self.lock:
+            if len(self.ranks) >= self.max_size:
+                self.ranks = {key: cached for key, cached in self.ranks.items() if cached[1] > now}
+                if len(self.ranks) >= self.max_size:
+                    self.ranks.clear()
+            self.ranks[key] = (rank, now + self.ttl)
+
+        return rank
@@ -1,21 +1,143 @@
-from typing import Any
+from typing import Any, Optional
 
 import json
 import logging
 import threading
+from collections import deque
 from pathlib import Path
 
 log = logging.getLogger("pajbot")
 
+# How long (in milliseconds) emitted events are collected before they are sent as one frame
+FLUSH_INTERVAL = 100
+# Number of frames that are held back for a client that can't keep up, the oldest ones are dropped first
+MAX_CLIENT_BACKLOG = 50
+
+
+def coalesce_events(events: list[tuple[str, Any]]) -> list[tuple[str, Any]]:
+    """
+    Merges events that were emitted within the same flush interval:
+    new_emotes with the same display settings are merged into the first one, and only the latest
+    emote_combo is kept (the overlay only shows the current count anyway).
+    Everything else is kept as is, in the order it was emitted.
+    """
+    last_combo_index = max((i for i, (event, _) in enumerate(events) if event == "emote_combo"), default=-1)
+
+    coalesced: list[tuple[str, Any]] = []
+    new_emotes: dict[tuple[Any, ...], dict[str, Any]] = {}
+    for i, (event, data) in enumerate(events):
+        if event == "emote_combo" and i != last_combo_index:
+            continue
+
+        if event == "new_emotes":
+            settings = tuple((key, value) for key, value in data.items() if key != "emotes")
+            merged = new_emotes.get(settings, None)
+            if merged is not None:
+                merged["emotes"] = merged["emotes"] + data["emotes"]
+                continue
+            data = new_emotes[settings] = dict(data)
+
+        coalesced.append((event, data))
+
+    return coalesced
+
+
+class WebSocketBroadcaster:
+    """
+    Collects events emitted from any thread and sends them to all clients from the reactor thread,
+    in one frame per flush interval. Each frame is serialized once and shared by all clients.
+    Clients whose transport buffer is full (i.e. paused by twisted) get their frames queued up instead,
+    up to MAX_CLIENT_BACKLOG frames.
+    """
+
+    def __init__(self, reactor: Any, clients: list[Any], flush_interval: float = FLUSH_INTERVAL) -> None:
+        self.reactor = reactor
+        self.clients = clients
+        # in seconds
+        self.flush_interval = flush_interval / 1000
+        self.lock = threading.Lock()
+        self.pending: list[tuple[str, Any]] = []
+        self.flush_scheduled = False
+        # Clients that are paused, and the frames they have yet to receive
+        self.backlogs: dict[Any, deque[bytes]] = {}
+
+        self.num_events = 0
+        self.num_frames = 0
+        self.num_dropped = 0
+
+    def emit(self, event: str, data: Any) -> None:
+        with self.lock:
+            self.pending.append((event, data))
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+
+        self.reactor.callFromThread(self.reactor.callLater, self.flush_interval, self.flush)
+
+    def flush(self) -> None:
+        with self.lock:
+            events = self.pending
+            self.pending = []
+            self.flush_scheduled = False
+
+        if not events:
+            return
+
+        self.num_events += len(events)
+        messages = [{"event": event, "data": data} for event, data in coalesce_events(events)]
+        # A single event is sent on its own, so overlays that haven't been reloaded yet still understand it
+        payload = json.dumps(messages[0] if len(messages) == 1 else messages).encode("utf8")
+        self.num_frames += 1
+
+        for client in self.clients:
+            backlog = self.backlogs.get(client, None)
+            if backlog is None:
+                client.sendMessage(payload, False)
+                continue
+
+            if len(backlog) == backlog.maxlen:
+                self.num_dropped += 1
+            backlog.append(payload)
+
+    def pause(self, client: Any) -> None:
+        if client not in self.backlogs:
+            self.backlogs[client] = deque(maxlen=MAX_CLIENT_BACKLOG)
+
+    def resume(self, client: Any) -> None:
+        backlog = self.backlogs.pop(client, None)
+        if backlog is None:
+            return
+
+        # If the transport fills up again, pause() is called from within sendMessage and the rest is queued up again
+        while backlog:
+            if client in self.backlogs:
+                self.backlogs[client].extend(backlog)
+                return
+            client.sendMessage(backlog.popleft(), False)
+
+    def remove(self, client: Any) -> None:
+        self.backlogs.pop(client, None)
+
 
 class WebSocketServer:
     clients: list[Any] = []
 
-    def __init__(self, manager, port, secure=False, key_path=None, crt_path=None, unix_socket_path=None):
+    def __init__(
+        self,
+        manager,
+        port,
+        secure=False,
+        key_path=None,
+        crt_path=None,
+        unix_socket_path=None,
+        flush_interval=FLUSH_INTERVAL,
+    ):
         self.manager = manager
         from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
         from twisted.internet import reactor, ssl
 
+        manager.broadcaster = WebSocketBroadcaster(reactor, WebSocketServer.clients, flush_interval)
+
         class MyServerProtocol(WebSocketServerProtocol):
             def onConnect(self, request):
                 # log.info(self.factory)
@@ -24,8 +146,19 @@ class WebSocketServer:
 
             def onOpen(self):
                 log.info("WebSocket connection open")
+                # Lets twisted tell us (through pauseProducing/resumeProducing) when the client can't keep up
+                self.registerProducer(self, True)
                 WebSocketServer.clients.append(self)
 
+            def pauseProducing(self):
+                manager.broadcaster.pause(self)
+
+            def resumeProducing(self):
+                manager.broadcaster.resume(self)
+
+            def stopProducing(self):
+                manager.broadcaster.remove(self)
+
             def onMessage(self, payload, isBinary):
                 if isBinary:
                     log.info(f"Binary message received: {len(payload)} bytes")
@@ -38,6 +171,7 @@ class WebSocketServer:
                     WebSocketServer.clients.remove(self)
                 except:
                     pass
+                manager.broadcaster.remove(self)
 
         factory = WebSocketServerFactory()
         factory.setProtocolOptions(autoPingInterval=15, autoPingTimeout=5)
@@ -74,6 +208,7 @@ class WebSocketManager:
     def __init__(self, bot):
         self.clients = []
         self.server = None
+        self.broadcaster: Optional[WebSocketBroadcaster] = None
         self.bot = bot
 
         if "websocket" not in bot.config:
@@ -104,21 +239,20 @@ class WebSocketManager:
                 key_path = cfg.get("key_path", "")
                 crt_path = cfg.get("crt_path", "")
                 unix_socket_path = cfg.get("unix_socket", f"/var/run/pajbot/{streamer}/websocket.sock")
+                flush_interval = int(cfg.get("flush_interval", str(FLUSH_INTERVAL)))
 
                 if ssl:
                     if key_path == "" or crt_path == "":
                         log.error("SSL enabled in config, but missing key_path or crt_path")
                         return
 
-                self.server = WebSocketServer(self, port, ssl, key_path, crt_path, unix_socket_path)
+                self.server = WebSocketServer(self, port, ssl, key_path, crt_path, unix_socket_path, flush_interval)
         except:
             log.exception("Uncaught exception in WebSocketManager")
 
     def emit(self, event: Any, data: dict[str, Any] = {}) -> None:
-        if self.server:
-            payload = json.dumps({"event": event, "data": data}).encode("utf8")
-            for client in self.server.clients:
-                client.sendMessage(payload, False)
+        if self.broadcaster:
+            self.broadcaster.emit(event, data)
 
     @staticmethod
     def on_log_message(message, isError=False, printed=False):
@@ -0,0 +1,11 @@
+def up(cursor, bot):
+    cursor.execute("""
+    CREATE TABLE user_points_ledger (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id TEXT NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+        delta BIGINT NOT NULL,
+        reason TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """)
+    cursor.execute("CREATE INDEX ON user_points_ledger(user_id, created_at)")
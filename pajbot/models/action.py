@@ -6,17 +6,20 @@ import collections
 import json
 import logging
 import sys
+import threading
 
 import irc
 import regex as re
-import requests
 
 if TYPE_CHECKING:
     from pajbot.bot import Bot
     from pajbot.models.user import User
 
+    from sqlalchemy.orm import Session
+
+from pajbot.managers.chat_queue import chat_priority_scope
+from pajbot.managers.db import DBManager
 from pajbot.managers.schedule import ScheduleManager
-from pajbot.utils import get_content_type_mime_type
 
 log = logging.getLogger(__name__)
 
@@ -110,10 +113,10 @@ class IfSubstitution:
         return self.get_false_response(extra)
 
     def get_true_response(self, extra):
-        return apply_substitutions(self.true_response, self.true_subs, self.bot, extra)
+        return self.true_template.render(self.bot, extra)
 
     def get_false_response(self, extra):
-        return apply_substitutions(self.false_response, self.false_subs, self.bot, extra)
+        return self.false_template.render(self.bot, extra)
 
     def __init__(self, key, arguments, bot):
         self.bot = bot
@@ -129,8 +132,10 @@ class IfSubstitution:
         self.true_response = arguments[0][2:-1] if arguments else "Yes"
         self.false_response = arguments[1][2:-1] if len(arguments) > 1 else "No"
 
-        self.true_subs = get_substitutions(self.true_response, bot)
-        self.false_subs = get_substitutions(self.false_response, bot)
+        self.true_template = compile_response(self.true_response, bot)
+        self.false_template = compile_response(self.false_response, bot)
+        self.true_subs = self.true_template.subs
+        self.false_subs = self.false_template.subs
 
 
 class SubstitutionFilter:
@@ -354,10 +359,70 @@ def get_substitutions(
     This means "You have $(source:points) points xD $(source:points)" only returns one Substitution.
     """
 
+    substitutions, _ = find_substitutions(string, bot, method_mapping)
+    return substitutions
+
+
+def get_method_mapping(bot: Optional[Bot]) -> tuple[dict[str, Callable[..., Any]], bool]:
+    """
+    Returns the substitution paths that are looked up on the bot, and whether all of them could be found.
+    Some of them might be missing while the bot is still being set up
+    """
+    method_mapping: dict[str, Callable[..., Any]] = {}
+    if not bot:
+        return method_mapping, True
+
+    try:
+        method_mapping["kvi"] = bot.get_kvi_value
+        method_mapping["increasekvi"] = bot.increase_kvi_value
+        method_mapping["decreasekvi"] = bot.decrease_kvi_value
+        method_mapping["tb"] = bot.get_value
+        method_mapping["lasttweet"] = bot.get_last_tweet
+        # "etm" is legacy
+        method_mapping["etm"] = bot.get_emote_epm
+        method_mapping["epm"] = bot.get_emote_epm
+        method_mapping["etmrecord"] = bot.get_emote_epm_record
+        method_mapping["epmrecord"] = bot.get_emote_epm_record
+        method_mapping["ecount"] = bot.get_emote_count
+        method_mapping["source"] = bot.get_source_value
+        method_mapping["user"] = bot.get_user_value
+        method_mapping["usersource"] = bot.get_usersource_value
+        method_mapping["time"] = bot.get_time_value
+        method_mapping["date"] = bot.get_date_value
+        method_mapping["datetimefromisoformat"] = bot.get_datetimefromisoformat_value
+        method_mapping["datetimefromtimestamp"] = bot.get_datetimefromtimestamp_value
+        method_mapping["datetime"] = bot.get_datetime_value
+        method_mapping["curdeck"] = bot.decks.action_get_curdeck
+        method_mapping["stream"] = bot.stream_manager.get_stream_value
+        method_mapping["current_stream"] = bot.stream_manager.get_current_stream_value
+        method_mapping["last_stream"] = bot.stream_manager.get_last_stream_value
+        method_mapping["args"] = bot.get_args_value
+        method_mapping["strictargs"] = bot.get_strictargs_value
+        method_mapping["command"] = bot.get_command_value
+        method_mapping["broadcaster"] = bot.get_broadcaster_value
+        method_mapping["randomchoice"] = bot.get_randomchoice_value
+    except AttributeError:
+        return method_mapping, False
+
+    return method_mapping, True
+
+
+def find_substitutions(
+    string: str, bot: Optional[Bot], method_mapping: Optional[dict[str, Callable[..., Any]]] = None
+) -> tuple[dict[str, Substitution], list[tuple[int, int, str, str]]]:
+    """
+    Like get_substitutions, but also returns (start, end, needle, path) of every substitution found in `string`,
+    in the order they appear
+    """
+
     substitutions = collections.OrderedDict()
 
-    for sub_key in Substitution.substitution_regex.finditer(string):
-        sub_string, path, argument, key, filters, if_arguments = get_substitution_arguments(sub_key)
+    matches = [
+        (sub_key.start(), sub_key.end(), get_substitution_arguments(sub_key))
+        for sub_key in Substitution.substitution_regex.finditer(string)
+    ]
+
+    for _, _, (sub_string, path, argument, key, filters, if_arguments) in matches:
 
         if sub_string in substitutions:
             # We already matched this variable
@@ -375,43 +440,9 @@ def get_substitutions(
             log.exception("BabyRage")
 
     if method_mapping is None:
-        method_mapping = {}
-        try:
-            if bot:
-                method_mapping["kvi"] = bot.get_kvi_value
-                method_mapping["increasekvi"] = bot.increase_kvi_value
-                method_mapping["decreasekvi"] = bot.decrease_kvi_value
-                method_mapping["tb"] = bot.get_value
-                method_mapping["lasttweet"] = bot.get_last_tweet
-                # "etm" is legacy
-                method_mapping["etm"] = bot.get_emote_epm
-                method_mapping["epm"] = bot.get_emote_epm
-                method_mapping["etmrecord"] = bot.get_emote_epm_record
-                method_mapping["epmrecord"] = bot.get_emote_epm_record
-                method_mapping["ecount"] = bot.get_emote_count
-                method_mapping["source"] = bot.get_source_value
-                method_mapping["user"] = bot.get_user_value
-                method_mapping["usersource"] = bot.get_usersource_value
-                method_mapping["time"] = bot.get_time_value
-                method_mapping["date"] = bot.get_date_value
-                method_mapping["datetimefromisoformat"] = bot.get_datetimefromisoformat_value
-                method_mapping["datetimefromtimestamp"] = bot.get_datetimefromtimestamp_value
-                method_mapping["datetime"] = bot.get_datetime_value
-                method_mapping["curdeck"] = bot.decks.action_get_curdeck
-                method_mapping["stream"] = bot.stream_manager.get_stream_value
-                method_mapping["current_stream"] = bot.stream_manager.get_current_stream_value
-                method_mapping["last_stream"] = bot.stream_manager.get_last_stream_value
-                method_mapping["args"] = bot.get_args_value
-                method_mapping["strictargs"] = bot.get_strictargs_value
-                method_mapping["command"] = bot.get_command_value
-                method_mapping["broadcaster"] = bot.get_broadcaster_value
-                method_mapping["randomchoice"] = bot.get_randomchoice_value
-        except AttributeError:
-            pass
-
-    for sub_key in Substitution.substitution_regex.finditer(string):
-        sub_string, path, argument, key, filters, if_arguments = get_substitution_arguments(sub_key)
+        method_mapping, _ = get_method_mapping(bot)
 
+    for _, _, (sub_string, path, argument, key, filters, if_arguments) in matches:
         if sub_string in substitutions:
             # We already matched this variable
             continue
@@ -420,7 +451,151 @@ def get_substitutions(
             sub = Substitution(method_mapping[path], needle=sub_string, key=key, argument=argument, filters=filters)
             substitutions[sub_string] = sub
 
-    return substitutions
+    return substitutions, [(start, end, arguments[0], arguments[1]) for start, end, arguments in matches]
+
+
+# Substitutions that look up users in the database
+DB_SESSION_SUBSTITUTIONS = {"user", "usersource"}
+
+
+class UserLookup:
+    """Finds users by user input in a single database session, shared by all substitutions of one response"""
+
+    def __init__(self, db_session: Session) -> None:
+        self.db_session = db_session
+        self.users: dict[str, Optional[User]] = {}
+
+    def find(self, user_input: str) -> Optional[User]:
+        from pajbot.models.user import User
+
+        if user_input not in self.users:
+            self.users[user_input] = User.find_by_user_input(self.db_session, user_input)
+
+        return self.users[user_input]
+
+
+class ResponseTemplate:
+    """
+    A response compiled into a list of segments: literal strings, substitutions and argument numbers.
+    Each substitution is evaluated once per render, in the order it first appears,
+    and the response is put together with a single join.
+    """
+
+    def __init__(
+        self, response: str, bot: Optional[Bot], method_mapping: Optional[dict[str, Callable[..., Any]]] = None
+    ) -> None:
+        self.response = response
+
+        # False if the bot was not fully set up yet, so substitutions might be missing
+        self.complete = True
+        if method_mapping is None:
+            method_mapping, self.complete = get_method_mapping(bot)
+
+        self.subs, spans = find_substitutions(response, bot, method_mapping)
+        self.argument_subs = get_argument_substitutions(response)
+        self.num_urlfetch_subs = len(get_urlfetch_substitutions(response, all=True))
+        self.uses_db_session = any(
+            path in DB_SESSION_SUBSTITUTIONS for _, _, needle, path in spans if needle in self.subs
+        )
+
+        self.segments: list[str | Substitution | int] = []
+        pos = 0
+        for start, end, needle, _ in spans:
+            sub = self.subs.get(needle, None)
+            if sub is None:
+                # Unknown substitutions are left as they are
+                continue
+
+            self._add_literal(response[pos:start])
+            self.segments.append(sub)
+            pos = end
+        self._add_literal(response[pos:])
+
+    def _add_literal(self, text: str) -> None:
+        if not text:
+            return
+
+        pos = 0
+        for sub_key in Substitution.argument_substitution_regex.finditer(text):
+            if sub_key.start() > pos:
+                self.segments.append(text[pos : sub_key.start()])
+            self.segments.append(int(sub_key.group(1)))
+            pos = sub_key.end()
+
+        if pos < len(text):
+            self.segments.append(text[pos:])
+
+    def render(self, bot: Bot, extra) -> Optional[str]:
+        """Returns the response with all substitutions applied, or None if any of them had no value"""
+        if not self.uses_db_session or "user_lookup" in extra:
+            return self.render_segments(bot, extra)
+
+        with DBManager.create_session_scope() as db_session:
+            extra["user_lookup"] = UserLookup(db_session)
+            try:
+                return self.render_segments(bot, extra)
+            finally:
+                del extra["user_lookup"]
+
+    def render_segments(self, bot: Bot, extra) -> Optional[str]:
+        values: dict[str, str] = {}
+        for needle, sub in self.subs.items():
+            value = get_substitution_value(sub, bot, extra)
+            if value is _UNKNOWN_PARAM:
+                continue
+            if value is None:
+                return None
+            values[needle] = str(value)
+
+        message = extra.get("message", None)
+        parts: list[str] = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif isinstance(segment, int):
+                parts.append(get_argument_value(message, segment))
+            else:
+                parts.append(values.get(segment.needle, segment.needle))
+
+        return "".join(parts)
+
+
+class ResponseTemplateCache:
+    """
+    The templates compiled for a bot, by response. Kept on the bot, since the templates refer to its methods.
+    Templates compiled before the bot was fully set up are not kept.
+    """
+
+    def __init__(self, max_size: int = 4096) -> None:
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.templates: collections.OrderedDict[str, ResponseTemplate] = collections.OrderedDict()
+
+    def get(self, response: str, bot: Bot) -> ResponseTemplate:
+        with self.lock:
+            template = self.templates.get(response, None)
+            if template is not None:
+                self.templates.move_to_end(response)
+                return template
+
+        template = ResponseTemplate(response, bot)
+        if not template.complete:
+            return template
+
+        with self.lock:
+            self.templates[response] = template
+            while len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+
+        return template
+
+
+def compile_response(response: str, bot: Optional[Bot]) -> ResponseTemplate:
+    """Compiles the response, or returns the template compiled earlier for the same response"""
+    if bot is None:
+        return ResponseTemplate(response, bot)
+
+    return bot.response_templates.get(response, bot)
 
 
 def get_urlfetch_substitutions(string, all=False):
@@ -468,34 +643,29 @@ class MessageAction(BaseAction):
     def __init__(self, response: str, bot: Optional[Bot]):
         self.response = response
 
+        self.template: Optional[ResponseTemplate] = None
         self.argument_subs: list[Substitution] = []
         self.subs: dict[str, Substitution] = {}
         self.num_urlfetch_subs = 0
 
         if bot:
-            self.argument_subs = get_argument_substitutions(self.response)
-            self.subs = get_substitutions(self.response, bot)
-            self.num_urlfetch_subs = len(get_urlfetch_substitutions(self.response, all=True))
+            self.template = compile_response(self.response, bot)
+            self.argument_subs = self.template.argument_subs
+            self.subs = self.template.subs
+            self.num_urlfetch_subs = self.template.num_urlfetch_subs
 
     def get_action_response(self) -> Optional[str]:
         return self.response
 
     def get_response(self, bot: Bot, extra) -> Optional[str]:
-        resp = self.response
-
-        resp = apply_substitutions(resp, self.subs, bot, extra)
+        if self.template is None:
+            resp: Optional[str] = self.response
+        else:
+            resp = self.template.render(bot, extra)
 
         if resp is None:
             return None
 
-        for sub in self.argument_subs:
-            needle = sub.needle
-            # To be placed in argument_subs, it must have been made through the get_argument_substitutions function
-            # This function always fills in an integer value for the argument parameter
-            value = get_argument_value(extra["message"], sub.argument)
-            resp = resp.replace(needle, value)
-            log.debug(f"Replacing {needle} with {value}")
-
         if "command" in extra and extra["command"].run_through_banphrases is True and "source" in extra:
             if not is_message_good(bot, resp, extra):
                 return None
@@ -510,40 +680,33 @@ class MessageAction(BaseAction):
         raise NotImplementedError("Please implement the run method.")
 
 
-def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwargs={}):
+def urlfetch_msg(method, message, num_urlfetch_subs, bot, extra={}, args=[], kwargs={}, priority=None):
+    """Fetches all URLs of the message in parallel on the bot's URLFetcher,
+    and sends the message from the fetcher's thread pool once they are done.
+    priority is the chat priority of the thread the message was created on, see chat_priority_scope"""
     urlfetch_subs = get_urlfetch_substitutions(message)
 
     if len(urlfetch_subs) > num_urlfetch_subs:
         log.error(f"HIJACK ATTEMPT {message}")
         return False
 
-    for needle, url in urlfetch_subs.items():
-        headers = {
-            "Accept": "text/plain",
-            "Accept-Language": "en-US, en;q=0.9, *;q=0.5",
-            "User-Agent": bot.user_agent,
-        }
-        r = requests.get(url, allow_redirects=True, headers=headers)
-        if r.status_code == requests.codes.ok:
-            # For "legacy" reasons, we don't check the content type of ok status codes
-            value = r.text.strip().replace("\n", "").replace("\r", "")[:400]
-        else:
-            # An error code was returned, ensure the response is plain text
-            if get_content_type_mime_type(r) != "text/plain":
-                # The content type is not plain text, return a generic error showing the status code returned
-                value = f"urlfetch error {r.status_code}"
-            else:
-                value = r.text.strip().replace("\n", "").replace("\r", "")[:400]
+    def send(values: dict[str, str]) -> None:
+        resp = message
+        for needle, url in urlfetch_subs.items():
+            resp = resp.replace(needle, values[url])
 
-        message = message.replace(needle, value)
+        if "command" in extra and extra["command"].run_through_banphrases is True and "source" in extra:
+            if not is_message_good(bot, resp, extra):
+                return
 
-    if "command" in extra and extra["command"].run_through_banphrases is True and "source" in extra:
-        if not is_message_good(bot, message, extra):
-            return None
+        if priority is None:
+            method(*args, resp, **kwargs)
+            return
 
-    args.append(message)
+        with chat_priority_scope(bot, priority):
+            method(*args, resp, **kwargs)
 
-    method(*args, **kwargs)
+    bot.urlfetcher.fetch_all(list(urlfetch_subs.values()), send)
 
 
 class SayAction(MessageAction):
@@ -567,6 +730,7 @@ class SayAction(MessageAction):
                 "kwargs": {},
                 "method": bot.say,
                 "bot": bot,
+                "priority": bot.get_chat_priority(),
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -595,6 +759,7 @@ class MeAction(MessageAction):
                 "kwargs": {},
                 "method": bot.me,
                 "bot": bot,
+                "priority": bot.get_chat_priority(),
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -623,6 +788,7 @@ class WhisperAction(MessageAction):
                 "kwargs": {},
                 "method": bot.whisper,
                 "bot": bot,
+                "priority": bot.get_chat_priority(),
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -651,6 +817,7 @@ class AnnounceAction(MessageAction):
                 "kwargs": {},
                 "method": bot.announce,
                 "bot": bot,
+                "priority": bot.get_chat_priority(),
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -680,6 +847,7 @@ class ReplyAction(MessageAction):
                     "kwargs": {"channel": event.target},
                     "method": bot.reply,
                     "bot": bot,
+                    "priority": bot.get_chat_priority(),
                     "extra": extra,
                     "message": resp,
                     "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -697,6 +865,7 @@ class ReplyAction(MessageAction):
                 "kwargs": {},
                 "method": bot.whisper,
                 "bot": bot,
+                "priority": bot.get_chat_priority(),
                 "extra": extra,
                 "message": resp,
                 "num_urlfetch_subs": self.num_urlfetch_subs,
@@ -704,26 +873,37 @@ class ReplyAction(MessageAction):
         )
 
 
+# Returned by get_substitution_value for substitutions that have neither a key nor an argument
+_UNKNOWN_PARAM = object()
+
+
+def get_substitution_value(sub: Substitution, bot: Bot, extra) -> Any:
+    if sub.key and sub.argument:
+        param = sub.key
+        extra["argument"] = get_argument_value(extra["message"], sub.argument)
+    elif sub.key:
+        param = sub.key
+    elif sub.argument:
+        param = get_argument_value(extra["message"], sub.argument)
+    else:
+        log.error("Unknown param for response.")
+        return _UNKNOWN_PARAM
+    # The dictionary of substitutions here will always come from get_substitutions, which means it will always have a callback to call
+    assert sub.cb is not None
+    value: Any = sub.cb(param, extra)
+    try:
+        for f in sub.filters:
+            value = bot.apply_filter(value, f)
+    except:
+        log.exception("Exception caught in filter application")
+    return value
+
+
 def apply_substitutions(text, substitutions: dict[Any, Substitution], bot: Bot, extra):
     for needle, sub in substitutions.items():
-        if sub.key and sub.argument:
-            param = sub.key
-            extra["argument"] = get_argument_value(extra["message"], sub.argument)
-        elif sub.key:
-            param = sub.key
-        elif sub.argument:
-            param = get_argument_value(extra["message"], sub.argument)
-        else:
-            log.error("Unknown param for response.")
+        value = get_substitution_value(sub, bot, extra)
+        if value is _UNKNOWN_PARAM:
             continue
-        # The dictionary of substitutions here will always come from get_substitutions, which means it will always have a callback to call
-        assert sub.cb is not None
-        value: Any = sub.cb(param, extra)
-        try:
-            for f in sub.filters:
-                value = bot.apply_filter(value, f)
-        except:
-            log.exception("Exception caught in filter application")
         if value is None:
             return None
         text = text.replace(needle, str(value))
@@ -12,14 +12,15 @@ Banphrases must update their operator properly when the operator is changed
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Literal, Optional, Union
+from typing import TYPE_CHECKING, Iterator, Literal, Optional, Union
 
 import argparse
 import logging
+import threading
 
 from pajbot.managers.db import Base, DBManager
 from pajbot.models.user import User
-from pajbot.utils import find
+from pajbot.utils import AhoCorasick, find
 
 import regex as re
 from sqlalchemy import Boolean, ForeignKey, Integer, Text, event
@@ -31,6 +32,18 @@ if TYPE_CHECKING:
 
 log = logging.getLogger("pajbot")
 
+# Operators that compare the message to the phrase as plain text
+PLAIN_TEXT_OPERATORS = ("contains", "startswith", "endswith", "exact")
+
+
+def normalize_message(message: str, case_sensitive: bool, remove_accents: bool) -> str:
+    if case_sensitive is False:
+        message = message.lower()
+    if remove_accents:
+        message = unidecode(message).strip()
+
+    return message
+
 
 class Banphrase(Base):
     __tablename__ = "banphrase"
@@ -82,12 +95,7 @@ class Banphrase(Base):
         self.refresh_operator()
 
     def format_message(self, message):
-        if self.case_sensitive is False:
-            message = message.lower()
-        if self.remove_accents:
-            message = unidecode(message).strip()
-
-        return message
+        return normalize_message(message, self.case_sensitive, self.remove_accents)
 
     def get_phrase(self):
         if self.case_sensitive is False:
@@ -227,11 +235,153 @@ class BanphraseData(Base):
         self.edited_by = options.get("edited_by", self.edited_by)
 
 
+class _BanphraseVariant:
+    """
+    Matcher for all enabled banphrases that share the same message normalization,
+    i.e. the same case_sensitive and remove_accents options.
+    Banphrases are passed along with their position in the enabled banphrase list.
+    """
+
+    def __init__(self, banphrases: list[tuple[int, Banphrase]]) -> None:
+        self.phrases: AhoCorasick[tuple[int, Banphrase]] = AhoCorasick()
+        self.regexes: list[tuple[int, Banphrase, re.Pattern[str]]] = []
+        # Banphrases that can't be part of the automaton (i.e. empty phrases), checked one by one
+        self.standalone: list[tuple[int, Banphrase]] = []
+
+        for order, banphrase in banphrases:
+            if banphrase.operator in PLAIN_TEXT_OPERATORS:
+                phrase = banphrase.get_phrase()
+                if phrase:
+                    self.phrases.add(phrase, (order, banphrase))
+                else:
+                    self.standalone.append((order, banphrase))
+            elif banphrase.operator == "regex":
+                # Invalid regexes never match
+                if banphrase.compiled_regex is not None:
+                    self.regexes.append((order, banphrase, banphrase.compiled_regex))
+            else:
+                log.warning("Banphrase %s is missing a predicate", banphrase.id)
+
+        self.phrases.build()
+
+    def matches(self, message: str, normalized_message: str) -> Iterator[tuple[int, Banphrase]]:
+        """Yields every banphrase matching the message. The same banphrase may be yielded more than once"""
+        length = len(normalized_message)
+        for start, end, (order, banphrase) in self.phrases.iter_matches(normalized_message):
+            operator = banphrase.operator
+            if (
+                operator == "contains"
+                or (operator == "startswith" and start == 0)
+                or (operator == "endswith" and end == length)
+                or (operator == "exact" and start == 0 and end == length)
+            ):
+                yield order, banphrase
+
+        for order, banphrase, regex in self.regexes:
+            if regex.search(normalized_message):
+                yield order, banphrase
+
+        for order, banphrase in self.standalone:
+            if banphrase.match(message, None):
+                yield order, banphrase
+
+
+class BanphraseMatcher:
+    """
+    Checks a message against all enabled banphrases at once.
+    The message is normalized only once per (case_sensitive, remove_accents) combination in use,
+    and plain text banphrases are found in a single pass using an Aho-Corasick automaton.
+
+    Adding, updating or removing a banphrase only rebuilds the matcher of the affected normalization.
+    """
+
+    def __init__(self, banphrases: Optional[list[Banphrase]] = None) -> None:
+        self.lock = threading.Lock()
+        # Banphrase -> (position in the enabled banphrase list, variant key)
+        self.banphrases: dict[Banphrase, tuple[int, tuple[bool, bool]]] = {}
+        self.variants: dict[tuple[bool, bool], _BanphraseVariant] = {}
+        self.dirty_variants: set[tuple[bool, bool]] = set()
+        self.next_order = 0
+
+        for banphrase in banphrases or []:
+            self.update(banphrase)
+
+    @staticmethod
+    def _variant_key(banphrase: Banphrase) -> tuple[bool, bool]:
+        return (bool(banphrase.case_sensitive), bool(banphrase.remove_accents))
+
+    def update(self, banphrase: Banphrase) -> None:
+        """Add the given banphrase, or refresh it after it has been edited"""
+        if banphrase.enabled is not True:
+            self.remove(banphrase)
+            return
+
+        key = self._variant_key(banphrase)
+        with self.lock:
+            existing = self.banphrases.get(banphrase, None)
+            if existing is None:
+                order = self.next_order
+                self.next_order += 1
+            else:
+                order, old_key = existing
+                self.dirty_variants.add(old_key)
+
+            self.banphrases[banphrase] = (order, key)
+            self.dirty_variants.add(key)
+
+    def remove(self, banphrase: Banphrase) -> None:
+        with self.lock:
+            existing = self.banphrases.pop(banphrase, None)
+            if existing is not None:
+                self.dirty_variants.add(existing[1])
+
+    def _get_variants(self) -> dict[tuple[bool, bool], _BanphraseVariant]:
+        if not self.dirty_variants:
+            return self.variants
+
+        with self.lock:
+            variants = dict(self.variants)
+            for key in self.dirty_variants:
+                members = sorted(
+                    ((order, banphrase) for banphrase, (order, k) in self.banphrases.items() if k == key),
+                    key=lambda member: member[0],
+                )
+                if members:
+                    variants[key] = _BanphraseVariant(members)
+                else:
+                    variants.pop(key, None)
+
+            self.variants = variants
+            self.dirty_variants = set()
+
+            return variants
+
+    def check(self, message: str, user: Optional[User]) -> Optional[Banphrase]:
+        matches: dict[int, Banphrase] = {}
+        for (case_sensitive, remove_accents), variant in self._get_variants().items():
+            normalized_message = normalize_message(message, case_sensitive, remove_accents)
+            for order, banphrase in variant.matches(message, normalized_message):
+                if user and banphrase.sub_immunity is True and user.subscriber is True:
+                    continue
+                matches[order] = banphrase
+
+        # Same precedence as checking the enabled banphrases one by one:
+        # the first match wins, unless a later match has a harsher punishment
+        matched_banphrase = None
+        for order in sorted(matches):
+            banphrase = matches[order]
+            if matched_banphrase is None or banphrase.greater_than(matched_banphrase):
+                matched_banphrase = banphrase
+
+        return matched_banphrase
+
+
 class BanphraseManager:
     def __init__(self, bot: Optional[Bot]) -> None:
         self.bot = bot
         self.banphrases: list[Banphrase] = []
         self.enabled_banphrases: list[Banphrase] = []
+        self.matcher = BanphraseMatcher()
         self.db_session = DBManager.create_session(expire_on_commit=False)
 
         if self.bot:
@@ -268,6 +418,9 @@ class BanphraseManager:
             if banphrase.enabled is False:
                 self.enabled_banphrases.remove(banphrase)
 
+        if updated_banphrase:
+            self.matcher.update(updated_banphrase)
+
     def on_banphrase_remove(self, data) -> None:
         try:
             banphrase_id = int(data["id"])
@@ -286,11 +439,14 @@ class BanphraseManager:
             if removed_banphrase in self.banphrases:
                 self.banphrases.remove(removed_banphrase)
 
+            self.matcher.remove(removed_banphrase)
+
     def load(self) -> BanphraseManager:
         self.banphrases = self.db_session.query(Banphrase).all()
         for banphrase in self.banphrases:
             self.db_session.expunge(banphrase)
         self.enabled_banphrases = [banphrase for banphrase in self.banphrases if banphrase.enabled is True]
+        self.matcher = BanphraseMatcher(self.enabled_banphrases)
         return self
 
     def commit(self) -> None:
@@ -311,6 +467,7 @@ class BanphraseManager:
 
         self.banphrases.append(banphrase)
         self.enabled_banphrases.append(banphrase)
+        self.matcher.update(banphrase)
 
         return banphrase, True
 
@@ -318,6 +475,7 @@ class BanphraseManager:
         self.banphrases.remove(banphrase)
         if banphrase in self.enabled_banphrases:
             self.enabled_banphrases.remove(banphrase)
+        self.matcher.remove(banphrase)
 
         self.db_session.expunge(banphrase.data)
         self.db_session.delete(banphrase)
@@ -354,18 +512,7 @@ class BanphraseManager:
             self.bot.timeout(user, timeout_length, reason=reason)
 
     def check_message(self, message: str, user: Optional[User]) -> Union[Banphrase, Literal[False]]:
-        matched_banphrase = None
-        for banphrase in self.enabled_banphrases:
-            if banphrase.match(message, user):
-                if not matched_banphrase:
-                    matched_banphrase = banphrase
-                    continue
-
-                if banphrase.greater_than(matched_banphrase):
-                    matched_banphrase = banphrase
-                    continue
-
-        return matched_banphrase or False
+        return self.matcher.check(message, user) or False
 
     def find_match(self, message: str, banphrase_id: Optional[str] = None) -> Optional[Banphrase]:
         match = None
@@ -21,10 +21,13 @@ import re
 
 import pajbot.utils
 from pajbot.exc import FailedCommand
+from pajbot.managers.chat_queue import chat_priority_scope
+from pajbot.managers.cooldown import CooldownStore
 from pajbot.managers.db import Base
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.action import ActionParser, BaseAction, MessageAction, MultiAction, RawFuncAction, Substitution
 from pajbot.models.user import User
+from pajbot.tmi import ChatPriority
 
 from sqlalchemy import Boolean, ForeignKey, Integer, Text
 from sqlalchemy.orm import Mapped, mapped_column, reconstructor, relationship
@@ -235,6 +238,9 @@ class Command(Base):
     BYPASS_SUB_ONLY_LEVEL = 500
     BYPASS_MOD_ONLY_LEVEL = 500
 
+    # Key of the cooldown shared by all users in Command.cooldowns. User IDs are never empty
+    GLOBAL_COOLDOWN_KEY = ""
+
     DEFAULT_CD_ALL = 5
     DEFAULT_CD_USER = 15
     DEFAULT_LEVEL = 100
@@ -261,14 +267,13 @@ class Command(Base):
         self.run_through_banphrases = False
         self.use_global_cd = False
 
-        self.last_run: int | float = 0
-        self.last_run_by_user: dict[str, datetime.datetime] = {}
-
         self.run_in_thread = False
         self.notify_on_error = False
 
         self.set(**options)
 
+        self.cooldowns = self._create_cooldown_store()
+
     def set(self, **options: Any) -> None:
         self.level = options.get("level", self.level)
         action_dict = options.get("action", None)
@@ -302,10 +307,13 @@ class Command(Base):
     def __str__(self):
         return f"Command(!{self.command})"
 
+    def _create_cooldown_store(self) -> CooldownStore:
+        # Only commands from the database have an ID that stays the same across restarts
+        return CooldownStore(f"command:{self.id}" if self.id is not None else None)
+
     @reconstructor
     def init_on_load(self) -> None:
-        self.last_run = 0
-        self.last_run_by_user = {}
+        self.cooldowns = self._create_cooldown_store()
         self.extra_args = {"command": self}
         self.action = ActionParser.parse(self.action_json, command=self.command)
         self.run_in_thread = False
@@ -406,24 +414,18 @@ class Command(Base):
         if not self.can_run_command(source, whisper):
             return False
 
-        cd_modifier = 0.2 if source.level >= 500 or source.moderator is True else 1.0
+        if source.level < Command.BYPASS_DELAY_LEVEL:
+            cd_modifier = 0.2 if source.level >= 500 or source.moderator is True else 1.0
 
-        cur_time = pajbot.utils.now().timestamp()
-        time_since_last_run = (cur_time - self.last_run) / cd_modifier
+            time_since_last_run = self.cooldowns.time_since(Command.GLOBAL_COOLDOWN_KEY)
+            if time_since_last_run is not None and time_since_last_run / cd_modifier < self.delay_all:
+                log.debug(f"Command was run {time_since_last_run:.2f} seconds ago, waiting...")
+                return False
 
-        if time_since_last_run < self.delay_all and source.level < Command.BYPASS_DELAY_LEVEL:
-            log.debug(f"Command was run {time_since_last_run:.2f} seconds ago, waiting...")
-            return False
-
-        last_run_by_user_f: int | float = 0
-        last_run_by_user_dt = self.last_run_by_user.get(source.id)
-        if last_run_by_user_dt is not None:
-            last_run_by_user_f = last_run_by_user_dt.timestamp()
-        time_since_last_run_user = (cur_time - last_run_by_user_f) / cd_modifier
-
-        if time_since_last_run_user < self.delay_user and source.level < Command.BYPASS_DELAY_LEVEL:
-            log.debug(f"{source} ran command {time_since_last_run_user:.2f} seconds ago, waiting...")
-            return False
+            time_since_last_run_user = self.cooldowns.time_since(source.id)
+            if time_since_last_run_user is not None and time_since_last_run_user / cd_modifier < self.delay_user:
+                log.debug(f"{source} ran command {time_since_last_run_user:.2f} seconds ago, waiting...")
+                return False
 
         if self.cost > 0 and not source.can_afford(self.cost):
             if self.notify_on_error:
@@ -467,9 +469,9 @@ class Command(Base):
         # Pre-requisite
         assert self.action is not None
 
-        cur_time = pajbot.utils.now()
-        cur_time_ts = cur_time.timestamp()
-        with source.spend_currency_context(self.cost, self.tokens_cost):
+        # Responses to moderator commands skip ahead of other chat messages
+        priority = ChatPriority.MODERATION if self.level >= 500 or self.mod_only else ChatPriority.COMMAND
+        with source.spend_currency_context(self.cost, self.tokens_cost), chat_priority_scope(bot, priority):
             ret = self.action.run(bot, source, message, event, args)
             if ret is False:
                 raise FailedCommand("return currency")
@@ -479,9 +481,8 @@ class Command(Base):
                 self.data.num_uses += 1
                 self.data.last_date_used = pajbot.utils.now()
 
-            # TODO: Will this be an issue?
-            self.last_run = cur_time_ts
-            self.last_run_by_user[source.id] = cur_time
+            self.cooldowns.start(Command.GLOBAL_COOLDOWN_KEY, self.delay_all)
+            self.cooldowns.start(source.id, self.delay_user)
 
     def jsonify(self) -> dict[str, Any]:
         payload: dict[str, Any] = {
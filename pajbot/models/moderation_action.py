@@ -46,15 +46,51 @@ def _combine_reasons(a: Optional[str], b: Optional[str]) -> Optional[str]:
     return f"{a} + {b}"
 
 
+def merge_moderation_actions(first: ModerationAction, second: ModerationAction) -> Optional[ModerationAction]:
+    """Returns a single action that has the same effect as executing first and then second,
+    or None if the two can not be merged (e.g. a ban followed by an unban)"""
+
+    if isinstance(first, Ban):
+        if isinstance(second, Ban):
+            return Ban(reason=_combine_reasons(first.reason, second.reason))
+        if isinstance(second, Timeout):
+            # Timing out a banned user does nothing
+            return first
+        return None
+
+    if isinstance(first, Timeout):
+        if isinstance(second, Ban):
+            return second
+        if isinstance(second, Timeout):
+            return Timeout(
+                duration=max(first.duration, second.duration),
+                reason=_combine_reasons(first.reason, second.reason),
+            )
+        return None
+
+    # first is an unban or an untimeout
+    if isinstance(second, Unban) or isinstance(second, Untimeout):
+        # An unban also lifts timeouts
+        return Unban() if isinstance(first, Unban) or isinstance(second, Unban) else Untimeout()
+    return None
+
+
 class ModerationActions:
     # Maps login -> action to execute
     actions: dict[str, ModerationAction]
 
+    # Maps login -> user ID, for the users whose ID is already known
+    user_ids: dict[str, str]
+
     def __init__(self) -> None:
         super().__init__()
         self.actions = {}
+        self.user_ids = {}
+
+    def add(self, login: str, action: ModerationAction, user_id: Optional[str] = None) -> None:
+        if user_id is not None:
+            self.user_ids[login] = user_id
 
-    def add(self, login: str, action: ModerationAction) -> None:
         if login not in self.actions:
             self.actions[login] = action
             return
@@ -108,14 +144,7 @@ class ModerationActions:
 
     def execute(self, bot) -> None:
         for login, action in self.actions.items():
-            if isinstance(action, Ban):
-                bot.ban_login(login, action.reason)
-            if isinstance(action, Timeout):
-                bot.timeout_login(login, action.duration, action.reason)
-            if isinstance(action, Unban):
-                bot.unban_login(login)
-            if isinstance(action, Untimeout):
-                bot.untimeout_login(login)
+            bot.moderation_dispatcher.submit(login, action, self.user_ids.get(login, None))
 
 
 @contextmanager
@@ -12,9 +12,11 @@ from typing import TYPE_CHECKING, Any, Optional, TypedDict
 import json
 import logging
 
+from pajbot.managers.chat_queue import chat_priority_scope
 from pajbot.managers.db import Base, DBManager
 from pajbot.models.action import ActionParser, BaseAction
 from pajbot.models.user import User
+from pajbot.tmi import ChatPriority
 from pajbot.utils import find
 
 from sqlalchemy import Boolean, Integer, Text, event
@@ -76,7 +78,8 @@ class Timer(Base):
             return
 
         dummy_user = User()
-        self.action.run(bot, dummy_user, "")
+        with chat_priority_scope(bot, ChatPriority.ANNOUNCEMENT):
+            self.action.run(bot, dummy_user, "")
 
 
 @event.listens_for(Timer, "load")
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Iterator, Optional
+from typing import TYPE_CHECKING, Any, ClassVar, Iterator, Optional
 
 import datetime
 import logging
@@ -9,13 +9,14 @@ from datetime import timedelta
 
 from pajbot import utils
 from pajbot.exc import FailedCommand
-from pajbot.managers.db import Base
+from pajbot.managers.db import Base, DBManager
 from pajbot.managers.redis import RedisManager
+from pajbot.managers.user_rank import UserRankService
 from pajbot.models.duel import UserDuelStats
 
 from redis import Redis
 from sqlalchemy import BigInteger, Integer, Interval, Text, and_, or_
-from sqlalchemy.orm import Mapped, Session, foreign, mapped_column, relationship
+from sqlalchemy.orm import InstrumentedAttribute, Mapped, Session, mapped_column, relationship
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.sql import functions
 from sqlalchemy.sql.expression import select
@@ -34,6 +35,11 @@ log = logging.getLogger(__name__)
 
 
 class UserRank(Base):
+    """
+    Ranks of all users, refreshed by UserRanksRefreshManager (see rank_refresh_mode), for bulk queries.
+    The ranks of a single user are counted on demand, see User.points_rank
+    """
+
     __tablename__ = "user_rank"
 
     user_id: Mapped[str] = mapped_column(Text, primary_key=True)
@@ -134,7 +140,8 @@ class User(Base):
     vip: Mapped[bool]
     founder: Mapped[bool]
 
-    _rank = relationship(UserRank, primaryjoin=foreign(id) == UserRank.user_id, lazy="select", viewonly=True)
+    # Shared by all users, see points_rank and num_lines_rank
+    rank_service: ClassVar[UserRankService] = UserRankService()
 
     def __init__(self) -> None:
         self.level = 100
@@ -182,21 +189,19 @@ class User(Base):
 
     @property
     def points_rank(self) -> int:
-        if self._rank:
-            return self._rank.points_rank
-        else:
-            # user is relatively new, and they are not inside the user_rank materialized view yet.
-            # on next refresh, they will be included.
-            return 420
+        return self._get_rank(User.points, self.points)
 
     @property
     def num_lines_rank(self) -> int:
-        if self._rank:
-            return self._rank.num_lines_rank
-        else:
-            # user is relatively new, and they are not inside the user_rank materialized view yet.
-            # on next refresh, they will be included.
-            return 1337
+        return self._get_rank(User.num_lines, self.num_lines)
+
+    def _get_rank(self, column: InstrumentedAttribute[int], value: int) -> int:
+        db_session = Session.object_session(self)
+        if db_session is not None:
+            return User.rank_service.get_rank(db_session, column, value)
+
+        with DBManager.create_session_scope() as db_session:
+            return User.rank_service.get_rank(db_session, column, value)
 
     @property
     def minutes_in_chat_online(self) -> int:
@@ -58,7 +58,8 @@ class AdminCommandsModule(BaseModule):
                 bot.whisper(source, "This user does not exist FailFish")
                 return False
 
-            user.points += num_points
+            # In case admins edit their own points
+            bot.points_ledger.apply(db_session, {user.id: num_points}, "admin", users=[source])
 
             if num_points >= 0:
                 bot.whisper(source, f"Successfully gave {user} {num_points} points.")
@@ -195,8 +196,8 @@ class AdminCommandsModule(BaseModule):
                 bot.say(f"Unable to disable module {module_id}, maybe it's not enabled?")
                 return
 
-            # Rebuild command cache
-            bot.commands.rebuild()
+            # Update command cache
+            bot.commands.update_layers([f"module:{module_id}"])
 
             with DBManager.create_session_scope() as db_session:
                 db_module = db_session.query(Module).filter_by(id=module_id).one()
@@ -224,8 +225,8 @@ class AdminCommandsModule(BaseModule):
                 bot.say(f"Unable to enable module {module_id}, maybe it's already enabled?")
                 return
 
-            # Rebuild command cache
-            bot.commands.rebuild()
+            # Update command cache
+            bot.commands.update_layers([f"module:{module_id}"])
 
             with DBManager.create_session_scope() as db_session:
                 db_module = db_session.query(Module).filter_by(id=module_id).one()
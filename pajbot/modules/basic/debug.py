@@ -1,7 +1,9 @@
 import collections
 import logging
 
+from pajbot.apiwrappers.response_cache import APIResponseCache
 from pajbot.managers.db import DBManager
+from pajbot.managers.handler import HandlerManager
 from pajbot.models.command import Command, CommandExample
 from pajbot.models.user import User
 from pajbot.modules import BaseModule, ModuleType
@@ -84,6 +86,83 @@ class DebugModule(BaseModule):
 
             bot.whisper(source, ", ".join([f"{key}={value}" for (key, value) in data.items()]))
 
+    @staticmethod
+    def debug_user_cache(bot, source, **rest):
+        data = bot.user_cache.stats()
+
+        bot.whisper(source, ", ".join([f"{key}={value}" for (key, value) in data.items()]))
+
+    @staticmethod
+    def debug_moderation(bot, source, **rest):
+        data = bot.moderation_dispatcher.stats()
+
+        bot.whisper(source, ", ".join([f"{key}={value}" for (key, value) in data.items()]))
+
+    @staticmethod
+    def debug_chat(bot, source, **rest):
+        data = bot.chat_queue.stats()
+
+        bot.whisper(source, ", ".join([f"{key}={value}" for (key, value) in data.items()]))
+
+    @staticmethod
+    def debug_handlers(bot, source, **rest):
+        data = HandlerManager.get_stats()[:5]
+        if not data:
+            bot.whisper(source, "No event handlers have been called yet")
+            return
+
+        bot.whisper(
+            source,
+            ", ".join(
+                [
+                    f"{stats.event}:{stats.name} calls={stats.calls} total={stats.total_time * 1000:.0f}ms max={stats.max_time * 1000:.1f}ms"
+                    for stats in data
+                ]
+            ),
+        )
+
+    @staticmethod
+    def debug_apicache(bot, source, **rest):
+        data = list(APIResponseCache.stats.get().items())[:5]
+        if not data:
+            bot.whisper(source, "The API response cache has not been used yet")
+            return
+
+        bot.whisper(
+            source,
+            f"size={len(APIResponseCache.l1)}, "
+            + ", ".join(
+                [
+                    f"{prefix} " + " ".join([f"{key}={value}" for (key, value) in counters.items()])
+                    for (prefix, counters) in data
+                ]
+            ),
+        )
+
+    @staticmethod
+    def debug_websocket(bot, source, **rest):
+        broadcaster = bot.websocket_manager.broadcaster
+        if broadcaster is None:
+            bot.whisper(source, "The websocket server is not running")
+            return
+
+        bot.whisper(
+            source,
+            f"clients={len(broadcaster.clients)}, paused={len(broadcaster.backlogs)}, events={broadcaster.num_events}, "
+            f"frames={broadcaster.num_frames}, dropped={broadcaster.num_dropped}",
+        )
+
+    @staticmethod
+    def debug_linkchecker(bot, source, **rest):
+        module = bot.module_manager["linkchecker"]
+        if module is None:
+            bot.whisper(source, "The link checker module is not enabled")
+            return
+
+        data = module.cache.stats()
+
+        bot.whisper(source, ", ".join([f"{key}={value}" for (key, value) in data.items()]))
+
     def load_commands(self, **options):
         self.commands["debug"] = Command.multiaction_command(
             level=100,
@@ -119,5 +198,103 @@ class DebugModule(BaseModule):
                         ).parse()
                     ],
                 ),
+                "usercache": Command.raw_command(
+                    self.debug_user_cache,
+                    level=250,
+                    description="Show statistics of the in-memory user cache",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show user cache statistics",
+                            chat="user:!debug usercache\n"
+                            "bot>user: size=2315, hits=184022, misses=2315, reloads=140, evictions=140, flushes=61, flushed_rows=9120, pending=173",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "moderation": Command.raw_command(
+                    self.debug_moderation,
+                    level=250,
+                    description="Show statistics of the background moderation queue",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show moderation queue statistics",
+                            chat="user:!debug moderation\n"
+                            "bot>user: queued=0, in_flight=1, submitted=532, merged=41, deduplicated=12, dropped=0, executed=479, failed=0, avg_latency=0.184, max_latency=2.51",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "chat": Command.raw_command(
+                    self.debug_chat,
+                    level=250,
+                    description="Show statistics of the outgoing chat message queue",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show chat queue statistics",
+                            chat="user:!debug chat\n"
+                            "bot>user: queued_moderation=0, queued_command=2, queued_announcement=14, submitted=3120, coalesced=37, dropped=0, sent=3067, failed=0, avg_latency=0.412, max_latency=29.7",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "handlers": Command.raw_command(
+                    self.debug_handlers,
+                    level=250,
+                    description="Show the event handlers that took the most time",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show event handler statistics",
+                            chat="user:!debug handlers\n"
+                            "bot>user: on_message:LinkCheckerModule.on_message calls=48210 total=9120ms max=41.3ms, on_pubmsg:Bot.on_pubmsg calls=48213 total=5310ms max=12.0ms",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "apicache": Command.raw_command(
+                    self.debug_apicache,
+                    level=250,
+                    description="Show hit/miss statistics of the API response cache",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show API response cache statistics",
+                            chat="user:!debug apicache\n"
+                            "bot>user: size=2817, api:twitch:helix:user:by-login l1_hits=10421 stale_hits=210 redis_hits=380 misses=96",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "websocket": Command.raw_command(
+                    self.debug_websocket,
+                    level=250,
+                    description="Show how many events were sent to the websocket clients",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show websocket statistics",
+                            chat="user:!debug websocket\n"
+                            "bot>user: clients=2, paused=0, events=48211, frames=6120, dropped=0",
+                            description="",
+                        ).parse()
+                    ],
+                ),
+                "linkchecker": Command.raw_command(
+                    self.debug_linkchecker,
+                    level=250,
+                    description="Show how often link checker verdicts were found in its cache",
+                    examples=[
+                        CommandExample(
+                            None,
+                            "Show link checker cache statistics",
+                            chat="user:!debug linkchecker\n"
+                            "bot>user: size=412, local_hits=2310, redis_hits=87, misses=530, hit_ratio=0.819",
+                            description="",
+                        ).parse()
+                    ],
+                ),
             },
         )
@@ -4,13 +4,12 @@ import logging
 from datetime import timedelta
 
 from pajbot.managers.db import DBManager
+from pajbot.managers.leaderboard import CHATTERS_REFRESH_LEADERBOARDS
 from pajbot.managers.schedule import ScheduleManager
 from pajbot.models.command import Command, CommandExample
 from pajbot.modules import BaseModule, ModuleSetting
 from pajbot.utils import time_method
 
-from sqlalchemy import text
-
 log = logging.getLogger(__name__)
 
 
@@ -95,30 +94,33 @@ class ChattersRefreshModule(BaseModule):
             add_points_pleb = 0
             add_points_sub = 0
 
-        update_values = [
+        DBManager.bulk_sync(
+            "chatters",
+            [("id", "TEXT NOT NULL"), ("login", "TEXT NOT NULL"), ("name", "TEXT NOT NULL")],
+            ((basics.id, basics.login, basics.name) for basics in chatters),
+            """
+INSERT INTO "user"(id, login, name, points, time_in_chat_online, time_in_chat_offline, last_seen)
+    SELECT DISTINCT ON (id)
+        id, login, name, %(add_points_pleb)s, %(add_time_in_chat_online)s, %(add_time_in_chat_offline)s, now()
+    FROM chatters
+ON CONFLICT (id) DO UPDATE SET
+    points = "user".points + CASE WHEN "user".subscriber THEN %(add_points_sub)s ELSE %(add_points_pleb)s END,
+    time_in_chat_online = "user".time_in_chat_online + %(add_time_in_chat_online)s,
+    time_in_chat_offline = "user".time_in_chat_offline + %(add_time_in_chat_offline)s,
+    last_seen = now()""",
             {
-                **basics.jsonify(),
                 "add_points_pleb": add_points_pleb,
                 "add_points_sub": add_points_sub,
                 "add_time_in_chat_online": add_time_in_chat_online,
                 "add_time_in_chat_offline": add_time_in_chat_offline,
-            }
-            for basics in chatters
-        ]
+            },
+        )
 
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(
-                text("""
-INSERT INTO "user"(id, login, name, points, time_in_chat_online, time_in_chat_offline, last_seen)
-    VALUES (:id, :login, :name, :add_points_pleb, :add_time_in_chat_online, :add_time_in_chat_offline, now())
-ON CONFLICT (id) DO UPDATE SET
-    points = "user".points + CASE WHEN "user".subscriber THEN :add_points_sub ELSE :add_points_pleb END,
-    time_in_chat_online = "user".time_in_chat_online + :add_time_in_chat_online,
-    time_in_chat_offline = "user".time_in_chat_offline + :add_time_in_chat_offline,
-    last_seen = now()
-            """),
-                update_values,
-            )
+        # Cached users don't know about the changes made above
+        self.bot.user_cache.invalidate()
+
+        if not only_last_seen:
+            self.bot.leaderboards.refresh(CHATTERS_REFRESH_LEADERBOARDS)
 
         log.info(f"Successfully updated {len(chatters)} chatters")
 
@@ -328,19 +328,19 @@ class DuelModule(BaseModule):
 
                 return
 
-            source.points -= duel_price
-            requestor.points -= duel_price
             winning_pot = int(duel_price * (1.0 - self.settings["duel_tax"] / 100))
             participants = [source, requestor]
             winner = random.choice(participants)
             participants.remove(winner)
             loser = participants.pop()
-            winner.points += duel_price
-            winner.points += winning_pot
+            # Both participants pay duel_price, and the winner gets it back along with the winning pot
+            # source is attached to the session of the message, so it's passed to have its points updated too
+            bot.points_ledger.apply(db_session, {winner.id: winning_pot, loser.id: -duel_price}, "duel", users=[source])
 
             # Persist duel statistics
             winner.duel_stats.won(winning_pot)
             loser.duel_stats.lost(duel_price)
+            bot.leaderboards.update_duel_stats([winner, loser], db_session)
 
             arguments = {
                 "winner": winner.name,
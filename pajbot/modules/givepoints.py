@@ -101,8 +101,10 @@ class GivePointsModule(BaseModule):
                 bot.whisper(source, "Your target must be a subscriber.")
                 return False
 
-            source.points -= num_points
-            target.points += num_points
+            # source is attached to the session of the message, so it's passed to have its points updated too
+            bot.points_ledger.apply(
+                db_session, [(source.id, -num_points), (target.id, num_points)], "givepoints", users=[source]
+            )
 
             bot.whisper(source, f"Successfully gave away {num_points} points to {target}")
 
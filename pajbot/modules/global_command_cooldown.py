@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING, Optional
 
 import logging
 
-from pajbot import utils
+from pajbot.managers.cooldown import CooldownStore
 from pajbot.modules import BaseModule, ModuleSetting
 
 if TYPE_CHECKING:
@@ -43,7 +43,7 @@ class GlobalCommandCooldown(BaseModule):
     def __init__(self, bot: Optional[Bot]) -> None:
         super().__init__(bot)
 
-        self.last_run: float = 0
+        self.cooldowns = CooldownStore("global_command_cooldown")
 
     def run_command(self) -> bool:
         """
@@ -61,12 +61,10 @@ class GlobalCommandCooldown(BaseModule):
         if cooldown == 0:
             return True
 
-        cur_time = utils.now().timestamp()
-        if self.last_run != 0:
-            time_since_last_run: float = cur_time - self.last_run
-            if time_since_last_run < cooldown:
-                return False
+        time_since_last_run = self.cooldowns.time_since("global")
+        if time_since_last_run is not None and time_since_last_run < cooldown:
+            return False
 
-        self.last_run = cur_time
+        self.cooldowns.start("global", cooldown)
 
         return True
@@ -1,23 +1,32 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Literal, Optional, Union
+from typing import TYPE_CHECKING, Any, Generic, Iterator, Literal, Optional, TypeVar, Union
 
 import argparse
+import codecs
 import logging
+import re
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
 
 import pajbot.managers
 import pajbot.models
 import pajbot.utils
-from pajbot.apiwrappers.safebrowsing import SafeBrowsingAPI
+from pajbot.apiwrappers.safebrowsing import SafeBrowsingAPI, SafeBrowsingBatcher
 from pajbot.managers.adminlog import AdminLogManager
 from pajbot.managers.db import Base, DBManager
 from pajbot.managers.handler import HandlerManager
+from pajbot.managers.redis import RedisManager
 from pajbot.models.command import Command, CommandExample
 from pajbot.modules import BaseModule, ModuleSetting
+from pajbot.streamhelper import StreamHelper
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from sqlalchemy import Integer
 from sqlalchemy.orm import Mapped, Session, mapped_column
 from urlextract import URLExtract
@@ -27,6 +36,17 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+# Number of URLs analyzed at the same time
+ANALYSIS_WORKERS = 4
+# Number of requests made to the links found on analyzed pages at the same time, shared by all analyses
+SUBLINK_WORKERS = 16
+# URLs posted while this many analyses are queued or running are not analyzed
+MAX_PENDING_ANALYSES = 100
+# Only this many links found on a page are checked
+MAX_SUBLINKS = 200
+# Time (in seconds) after which the links found on a page that have not been checked yet are skipped
+ANALYSIS_DEADLINE = 15
+
 extractor = URLExtract()
 extractor.update_when_older(14)
 
@@ -88,22 +108,143 @@ class Url:
         self.parsed = urllib.parse.urlparse(url)
 
 
-class LinkCheckerCache:
+class LinkExtractor(HTMLParser):
+    """Collects the absolute URLs of all <a> tags of a page. Can be fed the page piece by piece"""
+
     def __init__(self) -> None:
-        self.cache: dict[str, bool] = {}
-        return
+        super().__init__(convert_charrefs=True)
+        self.urls: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if tag != "a":
+            return
+
+        for name, url in attrs:
+            if name != "href" or url is None:
+                continue
+
+            if url.startswith("//"):
+                self.urls.append("http:" + url)
+            elif url.startswith("http://") or url.startswith("https://"):
+                self.urls.append(url)
 
-    def __getitem__(self, url: str) -> bool:
-        return self.cache[url.strip("/").lower()]
 
-    def __setitem__(self, url: str, safe: bool) -> None:
-        self.cache[url.strip("/").lower()] = safe
+class LinkCheckerCache:
+    """
+    Remembers for a while whether URLs were found to be safe (True) or bad (False).
+
+    Verdicts are kept in a size-capped in-process TTL+LRU map, and written to redis with the same expiry
+    so they survive restarts and are shared with other processes.
+    """
 
-    def __contains__(self, url: str) -> bool:
-        return url.strip("/").lower() in self.cache
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # normalized url -> (safe, expires at (monotonic))
+        self.entries: OrderedDict[str, tuple[bool, float]] = OrderedDict()
 
-    def __delitem__(self, url: str) -> None:
-        del self.cache[url.strip("/").lower()]
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        return url.strip("/").lower()
+
+    @staticmethod
+    def _redis_key(key: str) -> str:
+        return f"{StreamHelper.get_streamer()}:linkchecker:verdict:{key}"
+
+    def get(self, url: str) -> Optional[bool]:
+        """Returns the cached verdict for the given URL, or None if there is none"""
+        key = self.normalize(url)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                safe, expires_at = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.local_hits += 1
+                    return safe
+                del self.entries[key]
+
+        try:
+            redis = RedisManager.get()
+            redis_key = self._redis_key(key)
+            with redis.pipeline() as pipeline:
+                pipeline.get(redis_key)
+                pipeline.pttl(redis_key)
+                value, ttl_ms = pipeline.execute()
+        except:
+            log.exception("Failed to get link checker verdict from redis")
+            value = None
+
+        if value is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        safe = value == "1"
+        with self.lock:
+            self.redis_hits += 1
+            if ttl_ms > 0:
+                self._set_local(key, safe, now + ttl_ms / 1000)
+        return safe
+
+    def _set_local(self, key: str, safe: bool, expires_at: float) -> None:
+        self.entries[key] = (safe, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def set(self, url: str, safe: bool, ttl: int) -> None:
+        """Remembers the verdict for the given URL for ttl seconds"""
+        key = self.normalize(url)
+        with self.lock:
+            self._set_local(key, safe, time.monotonic() + ttl)
+
+        try:
+            RedisManager.get().setex(self._redis_key(key), ttl, "1" if safe else "0")
+        except:
+            log.exception("Failed to write link checker verdict to redis")
+
+    @staticmethod
+    def _is_on_domain(key: str, domain: str) -> bool:
+        netloc = urllib.parse.urlparse(key if "//" in key else "http://" + key).netloc
+        return is_subdomain(netloc[4:] if netloc.startswith("www.") else netloc, domain)
+
+    def evict_domain(self, domain: str) -> None:
+        """Forgets the verdicts of all URLs on the given domain and its subdomains"""
+        with self.lock:
+            for key in [key for key in self.entries if self._is_on_domain(key, domain)]:
+                del self.entries[key]
+
+        try:
+            redis = RedisManager.get()
+            pattern = self._redis_key("*" + re.sub(r"([*?\[\]\\])", r"\\\1", domain) + "*")
+            prefix_length = len(self._redis_key(""))
+            keys = [
+                key
+                for key in redis.scan_iter(match=pattern, count=1000)
+                if self._is_on_domain(key[prefix_length:], domain)
+            ]
+            if keys:
+                redis.delete(*keys)
+        except:
+            log.exception("Failed to remove link checker verdicts from redis")
+
+    def stats(self) -> dict[str, Union[int, float]]:
+        with self.lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.local_hits + self.redis_hits) / lookups, 3) if lookups > 0 else 0.0,
+            }
 
 
 class LinkCheckerLink:
@@ -153,6 +294,132 @@ class WhitelistedLink(LinkCheckerLink, Base):
         self.path = path
 
 
+LinkT = TypeVar("LinkT", bound=LinkCheckerLink)
+
+
+class _PathNode(Generic[LinkT]):
+    __slots__ = ("children", "links")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _PathNode[LinkT]] = {}
+        # Links whose path ends at this node. Replaced instead of modified, so lookups need no lock
+        self.links: tuple[LinkT, ...] = ()
+
+
+class _DomainNode(Generic[LinkT]):
+    __slots__ = ("children", "paths")
+
+    def __init__(self) -> None:
+        self.children: dict[str, _DomainNode[LinkT]] = {}
+        # Path trie of the links whose domain ends at this node
+        self.paths: Optional[_PathNode[LinkT]] = None
+
+
+class LinkTrie(Generic[LinkT]):
+    """
+    Index of blacklisted or whitelisted links.
+    Domains are stored by their labels in reverse order (e.g. se -> pajlada -> www) and each domain
+    has a trie of its path segments, so finding all links matching a URL takes time proportional
+    to the length of the URL instead of the number of links.
+
+    matches(domain, path) yields the same links as checking link.is_subdomain(domain) and link.is_subpath(path)
+    on every link.
+    """
+
+    def __init__(self) -> None:
+        self.root: _DomainNode[LinkT] = _DomainNode()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def _domain_labels(domain: str) -> list[str]:
+        if domain.startswith("www."):
+            domain = domain[4:]
+        return domain.split(".")[::-1]
+
+    @staticmethod
+    def _path_segments(path: str) -> list[str]:
+        # "/a/" matches the same paths as "/a"
+        if path.endswith("/"):
+            path = path[:-1]
+        return path.split("/")
+
+    def _find_path_node(self, link: LinkT, create: bool) -> Optional[_PathNode[LinkT]]:
+        domain_node = self.root
+        for label in self._domain_labels(link.domain):
+            next_domain_node = domain_node.children.get(label, None)
+            if next_domain_node is None:
+                if not create:
+                    return None
+                next_domain_node = domain_node.children[label] = _DomainNode()
+            domain_node = next_domain_node
+
+        if domain_node.paths is None:
+            if not create:
+                return None
+            domain_node.paths = _PathNode()
+
+        path_node = domain_node.paths
+        for segment in self._path_segments(link.path):
+            next_path_node = path_node.children.get(segment, None)
+            if next_path_node is None:
+                if not create:
+                    return None
+                next_path_node = path_node.children[segment] = _PathNode()
+            path_node = next_path_node
+
+        return path_node
+
+    def add(self, link: LinkT) -> None:
+        if link.domain is None or link.path is None:
+            # Never matches anything, see LinkCheckerLink.is_subdomain and LinkCheckerLink.is_subpath
+            return
+
+        with self.lock:
+            path_node = self._find_path_node(link, create=True)
+            assert path_node is not None
+            path_node.links = path_node.links + (link,)
+            self.size += 1
+
+    def remove(self, link: LinkT) -> None:
+        if link.domain is None or link.path is None:
+            return
+
+        with self.lock:
+            path_node = self._find_path_node(link, create=False)
+            if path_node is None or link not in path_node.links:
+                return
+
+            path_node.links = tuple(other for other in path_node.links if other is not link)
+            self.size -= 1
+
+    def matches(self, domain: str, path: str) -> Iterator[LinkT]:
+        """Yields all links that domain is a subdomain of, and path is a subpath of"""
+        segments = path.split("/")
+
+        domain_node = self.root
+        for label in reversed(domain.split(".")):
+            next_domain_node = domain_node.children.get(label, None)
+            if next_domain_node is None:
+                return
+            domain_node = next_domain_node
+
+            path_node = domain_node.paths
+            if path_node is None:
+                continue
+
+            yield from path_node.links
+            for segment in segments:
+                next_path_node = path_node.children.get(segment, None)
+                if next_path_node is None:
+                    break
+                path_node = next_path_node
+                yield from path_node.links
+
+
 class LinkCheckerModule(BaseModule):
     ID = __name__.split(".")[-1]
     NAME = "Link Checker"
@@ -223,16 +490,34 @@ class LinkCheckerModule(BaseModule):
             required=True,
             default=False,
         ),
+        ModuleSetting(
+            key="safe_cache_ttl",
+            label="Remember links that were checked and found safe for this many seconds",
+            type="number",
+            required=True,
+            placeholder="",
+            default=600,
+            constraints={"min_value": 1, "max_value": 604800},
+        ),
+        ModuleSetting(
+            key="bad_cache_ttl",
+            label="Remember links that were checked and found bad for this many seconds",
+            type="number",
+            required=True,
+            placeholder="",
+            default=3600,
+            constraints={"min_value": 1, "max_value": 604800},
+        ),
     ]
 
     def __init__(self, bot: Bot) -> None:
         super().__init__(bot)
         self.db_session: Optional[Session] = None
 
-        self.blacklisted_links: list[BlacklistedLink] = []
-        self.whitelisted_links: list[WhitelistedLink] = []
+        self.blacklisted_links: LinkTrie[BlacklistedLink] = LinkTrie()
+        self.whitelisted_links: LinkTrie[WhitelistedLink] = LinkTrie()
 
-        self.cache = LinkCheckerCache()  # cache[url] = True means url is safe, False means the link is bad
+        self.cache = LinkCheckerCache()
 
         self.safe_browsing_api: Optional[SafeBrowsingAPI] = None
 
@@ -242,6 +527,26 @@ class LinkCheckerModule(BaseModule):
             # so they're not displayed openly
             self.safe_browsing_api = SafeBrowsingAPI(bot.config["main"]["safebrowsingapi"])
 
+        self.safe_browsing: Optional[SafeBrowsingBatcher] = None
+        if self.safe_browsing_api is not None:
+            self.safe_browsing = SafeBrowsingBatcher(self.safe_browsing_api)
+
+        # Keep-alive connections for checking links, shared by the analysis threads
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=ANALYSIS_WORKERS + SUBLINK_WORKERS)
+        self.http_session.mount("http://", adapter)
+        self.http_session.mount("https://", adapter)
+        if bot:
+            self.http_session.headers["User-Agent"] = bot.user_agent
+
+        # Created when the module is enabled, and shut down when it's disabled
+        self.analysis_executor: Optional[ThreadPoolExecutor] = None
+        self.sublink_executor: Optional[ThreadPoolExecutor] = None
+
+        # normalized url -> actions to take if the URL turns out to be bad, for the analyses that are queued or running
+        self.pending_analyses: dict[str, list[Any]] = {}
+        self.pending_analyses_lock = threading.Lock()
+
     def enable(self, bot: Optional[Bot]) -> None:
         if not bot:
             return
@@ -249,18 +554,23 @@ class LinkCheckerModule(BaseModule):
         HandlerManager.add_handler("on_message", self.on_message, priority=150, run_if_propagation_stopped=True)
         HandlerManager.add_handler("on_commit", self.on_commit)
 
+        if self.analysis_executor is None:
+            self.analysis_executor = ThreadPoolExecutor(ANALYSIS_WORKERS, thread_name_prefix="LinkChecker")
+        if self.sublink_executor is None:
+            self.sublink_executor = ThreadPoolExecutor(SUBLINK_WORKERS, thread_name_prefix="LinkCheckerSublinks")
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
         self.db_session = DBManager.create_session()
-        self.blacklisted_links = []
+        self.blacklisted_links = LinkTrie()
         for blacklisted_link in self.db_session.query(BlacklistedLink):
-            self.blacklisted_links.append(blacklisted_link)
+            self.blacklisted_links.add(blacklisted_link)
 
-        self.whitelisted_links = []
+        self.whitelisted_links = LinkTrie()
         for link in self.db_session.query(WhitelistedLink):
-            self.whitelisted_links.append(link)
+            self.whitelisted_links.add(link)
 
     def disable(self, bot):
         if not bot:
@@ -269,12 +579,21 @@ class LinkCheckerModule(BaseModule):
         pajbot.managers.handler.HandlerManager.remove_handler("on_message", self.on_message)
         pajbot.managers.handler.HandlerManager.remove_handler("on_commit", self.on_commit)
 
+        # Analyses that have not started yet are dropped, running ones finish on their own
+        for executor in (self.analysis_executor, self.sublink_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self.analysis_executor = None
+        self.sublink_executor = None
+        with self.pending_analyses_lock:
+            self.pending_analyses.clear()
+
         if self.db_session is not None:
             self.db_session.commit()
             self.db_session.close()
             self.db_session = None
-            self.blacklisted_links = []
-            self.whitelisted_links = []
+            self.blacklisted_links = LinkTrie()
+            self.whitelisted_links = LinkTrie()
 
     def reload(self):
         log.info(f"Loaded {len(self.blacklisted_links)} bad links and {len(self.whitelisted_links)} good links")
@@ -340,22 +659,14 @@ class LinkCheckerModule(BaseModule):
             # First we perform a basic check
             if self.simple_check(url, action) == self.RET_FURTHER_ANALYSIS:
                 # If the basic check returns no relevant data, we queue up a proper check on the URL
-                self.bot.action_queue.submit(self.check_url, url, action)
+                self.queue_analysis(url, action)
 
     def on_commit(self, **rest):
         if self.db_session is not None:
             self.db_session.commit()
 
-    def delete_from_cache(self, url):
-        if url in self.cache:
-            del self.cache[url]
-
     def cache_url(self, url, safe):
-        if url in self.cache and self.cache[url] == safe:
-            return
-
-        self.cache[url] = safe
-        self.bot.execute_delayed(20, self.delete_from_cache, url)
+        self.cache.set(url, safe, self.settings["safe_cache_ttl"] if safe else self.settings["bad_cache_ttl"])
 
     def counteract_bad_url(self, url, action=None, want_to_cache=True, want_to_blacklist=False):
         log.debug(f"LinkChecker: BAD URL FOUND {url.url}")
@@ -389,7 +700,7 @@ class LinkCheckerModule(BaseModule):
 
         link = BlacklistedLink(domain, path, level)
         self.db_session.add(link)
-        self.blacklisted_links.append(link)
+        self.blacklisted_links.add(link)
         self.db_session.commit()
 
     def whitelist_url(self, url, parsed_url=None):
@@ -412,7 +723,7 @@ class LinkCheckerModule(BaseModule):
 
         link = WhitelistedLink(domain, path)
         self.db_session.add(link)
-        self.whitelisted_links.append(link)
+        self.whitelisted_links.add(link)
         self.db_session.commit()
 
     def is_blacklisted(self, url, parsed_url=None, sublink=False):
@@ -427,15 +738,13 @@ class LinkCheckerModule(BaseModule):
         if len(domain_split) < 2:
             return False
 
-        for link in self.blacklisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    if not sublink:
-                        return True
+        for link in self.blacklisted_links.matches(domain, path):
+            if not sublink:
+                return True
 
-                    # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
-                    if link.level >= 1:
-                        return True
+            # if it's a sublink, but the blacklisting level is 0, we don't consider it blacklisted
+            if link.level >= 1:
+                return True
 
         return False
 
@@ -451,12 +760,7 @@ class LinkCheckerModule(BaseModule):
         if len(domain_split) < 2:
             return False
 
-        for link in self.whitelisted_links:
-            if link.is_subdomain(domain):
-                if link.is_subpath(path):
-                    return True
-
-        return False
+        return next(self.whitelisted_links.matches(domain, path), None) is not None
 
     RET_BAD_LINK = -1
     RET_FURTHER_ANALYSIS = 0
@@ -470,19 +774,20 @@ class LinkCheckerModule(BaseModule):
         -1 = Link is bad
         0 = Link needs further analysis
         """
-        if url.url in self.cache:
-            if not self.cache[url.url]:  # link is bad
-                self.counteract_bad_url(url, action, False, False)
-                return self.RET_BAD_LINK
-
-            return self.RET_GOOD_LINK
-
+        # The lists are checked before the cache, so changes to them apply to links that have been cached already
         if self.is_blacklisted(url.url, url.parsed, sublink):
             self.counteract_bad_url(url, action, want_to_blacklist=False)
             return self.RET_BAD_LINK
 
         if self.is_whitelisted(url.url, url.parsed):
-            self.cache_url(url.url, True)
+            return self.RET_GOOD_LINK
+
+        safe = self.cache.get(url.url)
+        if safe is not None:
+            if not safe:  # link is bad
+                self.counteract_bad_url(url, action, False, False)
+                return self.RET_BAD_LINK
+
             return self.RET_GOOD_LINK
 
         return self.RET_FURTHER_ANALYSIS
@@ -495,6 +800,57 @@ class LinkCheckerModule(BaseModule):
 
         return self.basic_check(url, action)
 
+    def queue_analysis(self, url: str, action) -> None:
+        """Queues a full analysis of the URL. The same URL is only analyzed once at a time,
+        if it is posted again while it's being analyzed, action is added to the actions of that analysis"""
+        executor = self.analysis_executor
+        if executor is None:
+            return
+
+        key = LinkCheckerCache.normalize(url)
+        with self.pending_analyses_lock:
+            actions = self.pending_analyses.get(key, None)
+            if actions is not None:
+                actions.append(action)
+                return
+
+            if len(self.pending_analyses) >= MAX_PENDING_ANALYSES:
+                log.warning(f"LinkChecker: Too many links waiting to be analyzed, skipping {url}")
+                return
+
+            self.pending_analyses[key] = [action]
+
+        try:
+            executor.submit(self._run_analysis, url, key)
+        except RuntimeError:
+            # The module was disabled in the meantime
+            with self.pending_analyses_lock:
+                self.pending_analyses.pop(key, None)
+
+    def _run_analysis(self, url: str, key: str) -> None:
+        num_actions_run = 0
+
+        def action():
+            """Runs the actions of everyone who posted the URL so far"""
+            nonlocal num_actions_run
+            with self.pending_analyses_lock:
+                actions = self.pending_analyses.get(key, [])[num_actions_run:]
+                num_actions_run += len(actions)
+
+            for action in actions:
+                action()
+
+        try:
+            self.check_url(url, action)
+        finally:
+            with self.pending_analyses_lock:
+                late_actions = self.pending_analyses.pop(key, [])[num_actions_run:]
+
+            if num_actions_run > 0:
+                # The URL was found to be bad, so it's bad for those who posted it since, too
+                for late_action in late_actions:
+                    late_action()
+
     def check_url(self, url, action):
         url = Url(url)
         if len(url.parsed.netloc.split(".")) < 2:
@@ -506,22 +862,53 @@ class LinkCheckerModule(BaseModule):
         except:
             log.exception("LinkChecker unhandled exception while _check_url")
 
-    def _bs_get_site_links(self, html) -> list[str]:
-        # Checks the HTML content of the site and parses out any links
-        urls: list[str] = []
+    def _is_url_bad(self, url: str) -> bool:
+        if self.safe_browsing is None:
+            return False
 
-        soup = BeautifulSoup(html, "html.parser")
+        return url in self.safe_browsing.get_bad_urls([url])
 
-        for link in soup.find_all("a"):  # get a list of links to external sites
-            url = link.get("href")
-            if url is None:
-                continue
-            if url.startswith("//"):
-                urls.append("http:" + url)
-            elif url.startswith("http://") or url.startswith("https://"):
-                urls.append(url)
+    def _get_site_links(self, url: Url, maximum_size: int, timeout: tuple[float, float], receive_timeout: float):
+        """Downloads the page at the URL and returns the links on it, or None if the page is too big or too slow"""
+        with self.http_session.get(url=url.url, stream=True, timeout=timeout) as response:
+            content_length = response.headers.get("Content-Length")
+            if content_length and int(content_length) > maximum_size:
+                log.error("This file is too big!")
+                return None
 
-        return urls
+            try:
+                decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            except LookupError:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+            # The page is parsed while it is being downloaded, the decoder keeps incomplete characters between chunks
+            extractor = LinkExtractor()
+            size = 0
+            start = time.monotonic()
+
+            for chunk in response.iter_content(16 * 1024):
+                if time.monotonic() - start > receive_timeout:
+                    log.error("The site took too long to load")
+                    return None
+
+                size += len(chunk)
+                if size > maximum_size:
+                    log.error("This file is too big! (fake header)")
+                    return None
+
+                extractor.feed(decoder.decode(chunk))
+
+            extractor.feed(decoder.decode(b"", final=True))
+            extractor.close()
+            return extractor.urls
+
+    def _resolve_redirects(self, url: Url, timeout: float) -> Optional[Url]:
+        try:
+            r = self.http_session.head(url.url, allow_redirects=True, timeout=timeout)
+        except:
+            return None
+
+        return Url(r.url)
 
     def _check_url(self, url, action):
         # XXX: The basic check is currently performed twice on links found in messages. Solve
@@ -531,12 +918,11 @@ class LinkCheckerModule(BaseModule):
         elif res == self.RET_BAD_LINK:
             return
 
+        deadline = time.monotonic() + ANALYSIS_DEADLINE
         connection_timeout = 2
         read_timeout = 1
         try:
-            r = requests.head(
-                url.url, allow_redirects=True, timeout=connection_timeout, headers={"User-Agent": self.bot.user_agent}
-            )
+            r = self.http_session.head(url.url, allow_redirects=True, timeout=connection_timeout)
         except:
             self.cache_url(url.url, True)
             return
@@ -556,7 +942,7 @@ class LinkCheckerModule(BaseModule):
             elif res == self.RET_BAD_LINK:
                 return
 
-        if self.safe_browsing_api and self.safe_browsing_api.is_url_bad(redirected_url.url):  # harmful url detected
+        if self._is_url_bad(redirected_url.url):  # harmful url detected
             log.debug("Google Safe Browsing API lists URL")
             self.counteract_bad_url(url, action, want_to_blacklist=False)
             self.counteract_bad_url(redirected_url, want_to_blacklist=False)
@@ -567,34 +953,8 @@ class LinkCheckerModule(BaseModule):
         maximum_size = 1024 * 1024 * 10  # 10 MB
         receive_timeout = 3
 
-        html = ""
         try:
-            response = requests.get(
-                url=url.url,
-                stream=True,
-                timeout=(connection_timeout, read_timeout),
-                headers={"User-Agent": self.bot.user_agent},
-            )
-
-            content_length = response.headers.get("Content-Length")
-            if content_length and int(response.headers.get("Content-Length")) > maximum_size:
-                log.error("This file is too big!")
-                return
-
-            size = 0
-            start = pajbot.utils.now().timestamp()
-
-            for chunk in response.iter_content(1024):
-                if pajbot.utils.now().timestamp() - start > receive_timeout:
-                    log.error("The site took too long to load")
-                    return
-
-                size += len(chunk)
-                if size > maximum_size:
-                    log.error("This file is too big! (fake header)")
-                    return
-                html += str(chunk)
-
+            urls = self._get_site_links(url, maximum_size, (connection_timeout, read_timeout), receive_timeout)
         except requests.exceptions.ConnectTimeout:
             log.warning(f"Connection timed out while checking {url.url}")
             self.cache_url(url.url, True)
@@ -607,59 +967,77 @@ class LinkCheckerModule(BaseModule):
             log.exception("Unhandled exception")
             return
 
+        if urls is None:
+            return
+
         original_url = url
         original_redirected_url = redirected_url
-        urls = []
 
-        try:
-            urls = self._bs_get_site_links(html)
-        except:
-            log.exception("Something went wrong parsing links")
+        def counteract_bad_sublink(*sublinks: Url) -> None:
+            for sublink in sublinks:
+                self.counteract_bad_url(sublink)
+            self.counteract_bad_url(original_url, action, want_to_blacklist=False)
+            self.counteract_bad_url(original_redirected_url, want_to_blacklist=False)
 
-        for url in urls:  # check if the site links to anything dangerous
-            url = Url(url)
+        # check if the site links to anything dangerous
+        sublinks: list[Url] = []
+        for sublink_url in dict.fromkeys(urls):
+            sublink = Url(sublink_url)
 
-            if is_subdomain(url.parsed.netloc, original_url.parsed.netloc):
+            if is_subdomain(sublink.parsed.netloc, original_url.parsed.netloc):
                 # log.debug('Skipping because internal link')
                 continue
 
-            res = self.basic_check(url, action, sublink=True)
+            res = self.basic_check(sublink, None, sublink=True)
             if res == self.RET_BAD_LINK:
-                self.counteract_bad_url(url)
-                self.counteract_bad_url(original_url, want_to_blacklist=False)
-                self.counteract_bad_url(original_redirected_url, want_to_blacklist=False)
+                counteract_bad_sublink(sublink)
                 return
             elif res == self.RET_GOOD_LINK:
                 continue
 
-            try:
-                r = requests.head(
-                    url.url,
-                    allow_redirects=True,
-                    timeout=connection_timeout,
-                    headers={"User-Agent": self.bot.user_agent},
-                )
-            except:
+            sublinks.append(sublink)
+            if len(sublinks) >= MAX_SUBLINKS:
+                break
+
+        sublink_executor = self.sublink_executor
+        if sublink_executor is None:
+            # The module has been disabled in the meantime
+            return
+
+        # Follow the redirects of all remaining links at once
+        futures = [
+            sublink_executor.submit(self._resolve_redirects, sublink, connection_timeout) for sublink in sublinks
+        ]
+        wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+
+        resolved_sublinks: list[tuple[Url, Url]] = []
+        for sublink, future in zip(sublinks, futures):
+            if not future.done():
+                # Ran out of time, skip this and the remaining links
+                future.cancel()
                 continue
 
-            redirected_url = Url(r.url)
-            if not is_same_url(url, redirected_url):
-                res = self.basic_check(redirected_url, action, sublink=True)
+            redirected_url = future.result()
+            if redirected_url is None:
+                continue
+
+            if not is_same_url(sublink, redirected_url):
+                res = self.basic_check(redirected_url, None, sublink=True)
                 if res == self.RET_BAD_LINK:
-                    self.counteract_bad_url(url)
-                    self.counteract_bad_url(original_url, want_to_blacklist=False)
-                    self.counteract_bad_url(original_redirected_url, want_to_blacklist=False)
+                    counteract_bad_sublink(sublink)
                     return
                 elif res == self.RET_GOOD_LINK:
                     continue
 
-            if self.safe_browsing_api and self.safe_browsing_api.is_url_bad(redirected_url.url):  # harmful url detected
-                log.debug(f"Evil sublink {url} by google API")
-                self.counteract_bad_url(original_url, action)
-                self.counteract_bad_url(original_redirected_url)
-                self.counteract_bad_url(url)
-                self.counteract_bad_url(redirected_url)
-                return
+            resolved_sublinks.append((sublink, redirected_url))
+
+        if self.safe_browsing is not None and resolved_sublinks:
+            bad_urls = self.safe_browsing.get_bad_urls([redirected_url.url for _, redirected_url in resolved_sublinks])
+            for sublink, redirected_url in resolved_sublinks:
+                if redirected_url.url in bad_urls:  # harmful url detected
+                    log.debug(f"Evil sublink {sublink.url} by google API")
+                    counteract_bad_sublink(sublink, redirected_url)
+                    return
 
         # if we got here, the site is clean for our standards
         self.cache_url(original_url.url, True)
@@ -831,6 +1209,8 @@ class LinkCheckerModule(BaseModule):
             self.blacklisted_links.remove(link)
             self.db_session.delete(link)
             self.db_session.commit()
+            # Verdicts that were cached because of this link are not right anymore
+            self.cache.evict_domain(link.domain)
         else:
             bot.whisper(source, "No link with the given id found")
             return False
@@ -860,6 +1240,8 @@ class LinkCheckerModule(BaseModule):
             self.whitelisted_links.remove(link)
             self.db_session.delete(link)
             self.db_session.commit()
+            # Verdicts that were cached because of this link are not right anymore
+            self.cache.evict_domain(link.domain)
         else:
             bot.whisper(source, "No link with the given id found")
             return False
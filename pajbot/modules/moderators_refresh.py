@@ -13,7 +13,6 @@ from pajbot.modules.base import BaseModule, ModuleType
 from pajbot.utils import time_method
 
 from requests import HTTPError
-from sqlalchemy import text
 
 if TYPE_CHECKING:
     from pajbot.bot import Bot
@@ -76,27 +75,16 @@ class ModeratorsRefreshModule(BaseModule):
 
             return
 
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(text("""
-CREATE TEMPORARY TABLE moderators(
-    id TEXT PRIMARY KEY NOT NULL,
-    login TEXT NOT NULL,
-    name TEXT NOT NULL
-)
-ON COMMIT DROP"""))
-
-            db_session.execute(
-                text("INSERT INTO moderators(id, login, name) VALUES (:id, :login, :name)"),
-                [basics.jsonify() for basics in moderators],
-            )
-
-            # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
-            # to the data we tried to insert but failed (so excluded.login would be equal to :login
-            # if we only had one value for :login)
-            db_session.execute(text("""
+        # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
+        # to the row we tried to insert but failed (so excluded.login is the login from the temporary table)
+        DBManager.bulk_sync(
+            "moderators",
+            [("id", "TEXT NOT NULL"), ("login", "TEXT NOT NULL"), ("name", "TEXT NOT NULL")],
+            ((basics.id, basics.login, basics.name) for basics in moderators),
+            """
 WITH updated_users AS (
     INSERT INTO "user"(id, login, name, moderator)
-        SELECT id, login, name, TRUE FROM moderators
+        SELECT DISTINCT ON (id) id, login, name, TRUE FROM moderators
     ON CONFLICT (id) DO UPDATE SET
         login = excluded.login,
         name = excluded.name,
@@ -108,7 +96,11 @@ SET
     moderator = FALSE
 WHERE
     id NOT IN (SELECT * FROM updated_users) AND
-    moderator IS TRUE"""))
+    moderator IS TRUE""",
+        )
+
+        # Cached users don't know about the changes made above
+        self.bot.user_cache.invalidate()
 
         log.info(f"Successfully updated {len(moderators)} moderators")
 
@@ -8,6 +8,7 @@ import re
 from argparse import ArgumentParser
 
 from pajbot.managers.adminlog import AdminLogManager
+from pajbot.managers.cooldown import CooldownStore
 from pajbot.managers.db import DBManager
 from pajbot.models.command import Command
 from pajbot.models.playsound import Playsound
@@ -121,9 +122,8 @@ class PlaysoundModule(BaseModule):
         if bot:
             bot.socket_manager.add_handler("playsound.play", self.on_web_playsound)
 
-        self.sample_cooldown: set[str] = set()
-        self.user_cooldown: set[str] = set()
-        self.global_cooldown = False
+        # Keys are "user:<user id>", "sample:<playsound name>" and "global"
+        self.cooldowns = CooldownStore("playsound")
 
     # when a "Test on stream" is triggered via the Web UI.
     def on_web_playsound(self, data: dict[str, Any]) -> None:
@@ -150,9 +150,6 @@ class PlaysoundModule(BaseModule):
             log.debug(f"Playsound module is emitting payload: {json.dumps(payload)}")
             self.bot.websocket_manager.emit("play_sound", payload)
 
-    def reset_global_cd(self) -> None:
-        self.global_cooldown = False
-
     def play_sound(self, bot: Bot, source: User, message: str, **rest) -> bool:
         if not message:
             return False
@@ -169,7 +166,7 @@ class PlaysoundModule(BaseModule):
                 )
                 return False
 
-            if self.global_cooldown and source.level < Command.BYPASS_DELAY_LEVEL:
+            if self.cooldowns.is_active("global") and source.level < Command.BYPASS_DELAY_LEVEL:
                 if self.settings["global_cd_whisper"]:
                     bot.whisper(
                         source,
@@ -177,7 +174,7 @@ class PlaysoundModule(BaseModule):
                     )
                 return False
 
-            if source.id in self.user_cooldown and source.level < Command.BYPASS_DELAY_LEVEL:
+            if self.cooldowns.is_active(f"user:{source.id}") and source.level < Command.BYPASS_DELAY_LEVEL:
                 if self.settings["user_cd_whisper"]:
                     bot.whisper(
                         source,
@@ -189,7 +186,7 @@ class PlaysoundModule(BaseModule):
             if cooldown is None:
                 cooldown = self.settings["default_sample_cd"]
 
-            if playsound_name in self.sample_cooldown and source.level < Command.BYPASS_DELAY_LEVEL:
+            if self.cooldowns.is_active(f"sample:{playsound_name}") and source.level < Command.BYPASS_DELAY_LEVEL:
                 bot.whisper(
                     source,
                     f"The playsound {playsound.name} was played too recently. Please wait until its cooldown of {cooldown} seconds has run out.",
@@ -214,12 +211,9 @@ class PlaysoundModule(BaseModule):
             if self.settings["confirmation_whisper"]:
                 bot.whisper(source, f"Successfully played the sound {playsound_name} on stream!")
 
-            self.global_cooldown = True
-            self.user_cooldown.add(source.id)
-            self.sample_cooldown.add(playsound.name)
-            bot.execute_delayed(cooldown, self.sample_cooldown.remove, playsound.name)
-            bot.execute_delayed(self.settings["user_cd"], self.user_cooldown.remove, source.id)
-            bot.execute_delayed(self.settings["global_cd"], self.reset_global_cd)
+            self.cooldowns.start("global", self.settings["global_cd"])
+            self.cooldowns.start(f"user:{source.id}", self.settings["user_cd"])
+            self.cooldowns.start(f"sample:{playsound.name}", cooldown)
 
             return True
 
@@ -3,6 +3,7 @@ from typing import Any
 import logging
 import random
 
+from pajbot.managers.db import DBManager
 from pajbot.models.command import Command, CommandExample
 from pajbot.modules.base import BaseModule
 
@@ -155,7 +156,8 @@ class PointLotteryModule(BaseModule):
         )
         bot.me(f"The lottery has finished! {winner} won {self.lottery_points} points! PogChamp")
 
-        winner.points += self.lottery_points
+        with DBManager.create_session_scope() as db_session:
+            bot.points_ledger.apply(db_session, {winner.id: self.lottery_points}, "pointlottery")
 
         self.lottery_users = []
 
@@ -337,7 +337,7 @@ class RaffleModule(BaseModule):
 
             self.bot.me(f"The raffle has finished! {winner} {format_win(self.raffle_points)} points! PogChamp")
 
-            winner.points += self.raffle_points
+            self.bot.points_ledger.apply(db_session, {winner.id: self.raffle_points}, "raffle")
 
             HandlerManager.trigger("on_raffle_win", winner=winner, points=self.raffle_points)
 
@@ -447,6 +447,9 @@ class RaffleModule(BaseModule):
         with DBManager.create_session_scope() as db_session:
             winners = db_session.query(User).filter(User.id.in_(winner_ids)).all()
 
+            # All winners are paid out with a single statement
+            self.bot.points_ledger.credit(db_session, [winner.id for winner in winners], points_per_user, "multiraffle")
+
             # reset
             self.raffle_users = set()
 
@@ -459,7 +462,6 @@ class RaffleModule(BaseModule):
 
             winners_arr = []
             for winner in winners:
-                winner.points += points_per_user
                 winners_arr.append(winner)
 
                 winners_str = generate_winner_list(winners_arr)
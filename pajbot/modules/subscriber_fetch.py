@@ -10,7 +10,6 @@ from pajbot.modules import BaseModule
 from pajbot.utils import time_method
 
 from requests import HTTPError
-from sqlalchemy import text
 
 log = logging.getLogger(__name__)
 
@@ -63,32 +62,16 @@ class SubscriberFetchModule(BaseModule):
         sub_count = max(0, len(subscribers) - 1)
         self.bot.kvi["active_subs"].set(sub_count)
 
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(text("""
-CREATE TEMPORARY TABLE subscribers(
-    id TEXT PRIMARY KEY NOT NULL,
-    login TEXT NOT NULL,
-    name TEXT NOT NULL
-)
-ON COMMIT DROP"""))
-
-            if len(subscribers) > 0:
-                # The precondition check is to prevent an exception,
-                # if len(subscribers) was 0, then we would try to execute this SQL without any values,
-                # which would then fail.
-                # len(subscribers) can be 0 if the broadcaster does not have a subscription program.
-                db_session.execute(
-                    text("INSERT INTO subscribers(id, login, name) VALUES (:id, :login, :name)"),
-                    [basics.jsonify() for basics in subscribers],
-                )
-
-            # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
-            # to the data we tried to insert but failed (so excluded.login would be equal to :login
-            # if we only had one value for :login)
-            db_session.execute(text("""
+        # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
+        # to the row we tried to insert but failed (so excluded.login is the login from the temporary table)
+        DBManager.bulk_sync(
+            "subscribers",
+            [("id", "TEXT NOT NULL"), ("login", "TEXT NOT NULL"), ("name", "TEXT NOT NULL")],
+            ((basics.id, basics.login, basics.name) for basics in subscribers),
+            """
 WITH updated_users AS (
     INSERT INTO "user"(id, login, name, subscriber)
-        SELECT id, login, name, TRUE FROM subscribers
+        SELECT DISTINCT ON (id) id, login, name, TRUE FROM subscribers
     ON CONFLICT (id) DO UPDATE SET
         login = excluded.login,
         name = excluded.name,
@@ -100,7 +83,11 @@ SET
     subscriber = FALSE
 WHERE
     id NOT IN (SELECT * FROM updated_users) AND
-    subscriber IS TRUE"""))
+    subscriber IS TRUE""",
+        )
+
+        # Cached users don't know about the changes made above
+        self.bot.user_cache.invalidate()
 
         log.info(f"Successfully updated {len(subscribers)} subscribers")
 
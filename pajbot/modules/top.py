@@ -1,9 +1,8 @@
 import logging
 
-from pajbot.managers.db import DBManager
+from pajbot.managers.emote import EcountManager
 from pajbot.managers.redis import RedisManager
 from pajbot.models.command import Command
-from pajbot.models.user import User
 from pajbot.modules import BaseModule, ModuleSetting
 from pajbot.streamhelper import StreamHelper
 from pajbot.utils import time_since
@@ -74,37 +73,29 @@ class TopModule(BaseModule):
 
     def top_chatters(self, bot, **rest):
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in db_session.query(User).order_by(User.num_lines.desc()).limit(self.settings["num_top"]):
-                data.append(f"{user} ({user.num_lines})")
+        for user, _ in bot.leaderboards.get("num_lines", self.settings["num_top"]):
+            data.append(f"{user} ({user.num_lines})")
 
         bot.say(f"Top {self.settings['num_top']} chatters: {', '.join(data)}")
 
     def top_watchers(self, bot, **rest):
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in (
-                db_session.query(User).order_by(User.time_in_chat_online.desc()).limit(self.settings["num_top"])
-            ):
-                data.append(f"{user} ({time_since(user.time_in_chat_online.total_seconds(), 0, time_format='short')})")
+        for user, _ in bot.leaderboards.get("time_in_chat_online", self.settings["num_top"]):
+            data.append(f"{user} ({time_since(user.time_in_chat_online.total_seconds(), 0, time_format='short')})")
 
         bot.say(f"Top {self.settings['num_top']} watchers: {', '.join(data)}")
 
     def top_offline(self, bot, **rest):
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in (
-                db_session.query(User).order_by(User.time_in_chat_offline.desc()).limit(self.settings["num_top"])
-            ):
-                data.append(f"{user} ({time_since(user.time_in_chat_offline.total_seconds(), 0, time_format='short')})")
+        for user, _ in bot.leaderboards.get("time_in_chat_offline", self.settings["num_top"]):
+            data.append(f"{user} ({time_since(user.time_in_chat_offline.total_seconds(), 0, time_format='short')})")
 
         bot.say(f"Top {self.settings['num_top']} offline chatters: {', '.join(data)}")
 
     def top_points(self, bot, **rest):
         data = []
-        with DBManager.create_session_scope() as db_session:
-            for user in db_session.query(User).order_by(User.points.desc()).limit(self.settings["num_top"]):
-                data.append(f"{user} ({user.points})")
+        for user, _ in bot.leaderboards.get("points", self.settings["num_top"]):
+            data.append(f"{user} ({user.points})")
 
         bot.say(f"Top {self.settings['num_top']} banks: {', '.join(data)}")
 
@@ -113,14 +104,9 @@ class TopModule(BaseModule):
         streamer = StreamHelper.get_streamer()
         num_emotes = self.settings["num_top_emotes"]
 
-        top_emotes = {
-            emote: emote_count
-            for emote, emote_count in sorted(
-                redis.zscan_iter(f"{streamer}:emotes:count"), key=lambda e_ecount_pair: e_ecount_pair[1], reverse=True
-            )[:num_emotes]
-        }
+        top_emotes = redis.zrevrange(EcountManager.get_count_key(streamer), 0, num_emotes - 1, withscores=True)
         if top_emotes:
-            top_list_str = ", ".join(f"{emote} ({emote_count:,.0f})" for emote, emote_count in top_emotes.items())
+            top_list_str = ", ".join(f"{emote} ({emote_count:,.0f})" for emote, emote_count in top_emotes)
             bot.say(f"Top {num_emotes} emotes: {top_list_str}")
         else:
             bot.say("No emote data available")
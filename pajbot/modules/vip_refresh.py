@@ -8,7 +8,6 @@ from pajbot.modules import BaseModule, ModuleType
 from pajbot.utils import time_method
 
 from requests import HTTPError
-from sqlalchemy import text
 
 log = logging.getLogger(__name__)
 
@@ -63,28 +62,16 @@ class VIPRefreshModule(BaseModule):
                 log.error(f"Failed to update VIPs: {e} - {e.response.text}")
                 return
 
-        with DBManager.create_session_scope() as db_session:
-            db_session.execute(text("""
-CREATE TEMPORARY TABLE vips(
-    id TEXT PRIMARY KEY NOT NULL,
-    login TEXT NOT NULL,
-    name TEXT NOT NULL
-)
-ON COMMIT DROP"""))
-
-            if len(vips) > 0:
-                db_session.execute(
-                    text("INSERT INTO vips(id, login, name) VALUES (:id, :login, :name)"),
-                    [basics.jsonify() for basics in vips],
-                )
-
-            # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
-            # to the data we tried to insert but failed (so excluded.login would be equal to :login
-            # if we only had one value for :login)
-            db_session.execute(text("""
+        # hint to understand this query: "excluded" is a PostgreSQL keyword that referers
+        # to the row we tried to insert but failed (so excluded.login is the login from the temporary table)
+        DBManager.bulk_sync(
+            "vips",
+            [("id", "TEXT NOT NULL"), ("login", "TEXT NOT NULL"), ("name", "TEXT NOT NULL")],
+            ((basics.id, basics.login, basics.name) for basics in vips),
+            """
 WITH updated_users AS (
     INSERT INTO "user"(id, login, name, vip)
-        SELECT id, login, name, TRUE FROM vips
+        SELECT DISTINCT ON (id) id, login, name, TRUE FROM vips
     ON CONFLICT (id) DO UPDATE SET
         login = excluded.login,
         name = excluded.name,
@@ -96,7 +83,11 @@ SET
     vip = FALSE
 WHERE
     id NOT IN (SELECT * FROM updated_users) AND
-    vip IS TRUE"""))
+    vip IS TRUE""",
+        )
+
+        # Cached users don't know about the changes made above
+        self.bot.user_cache.invalidate()
 
         log.info(f"Successfully updated {len(vips)} VIPs")
 
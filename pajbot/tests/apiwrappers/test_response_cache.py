@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def mget(self, keys):
+        self.commands.append(lambda: self.redis.mget(keys))
+
+    def setex(self, key, expiry, value):
+        self.commands.append(lambda: self.redis.setex(key, expiry, value))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [command() for command in self.commands]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key, None)
+
+    def mget(self, keys):
+        self.gets += 1
+        return [self.data.get(key, None) for key in keys]
+
+    def setex(self, key, expiry, value):
+        self.data[key] = value
+
+
+@pytest.fixture
+def cache():
+    from pajbot.apiwrappers.response_cache import APIResponseCache, CacheStats, L1Cache
+
+    clock = FakeClock()
+    redis = FakeRedis()
+    return APIResponseCache(redis, l1=L1Cache(max_size=3, clock=clock), stats=CacheStats()), redis, clock
+
+
+def test_l1_in_front_of_redis(cache) -> None:
+    cache, redis, clock = cache
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return {"id": "123"}
+
+    assert cache.cache_fetch_fn("user:by-login:pajlada", fetch, expiry=300) == {"id": "123"}
+    assert cache.cache_fetch_fn("user:by-login:pajlada", fetch, expiry=300) == {"id": "123"}
+    assert len(fetches) == 1
+    assert redis.gets == 1
+
+    # Every caller gets its own copy
+    assert cache.cache_fetch_fn("user:by-login:pajlada", fetch) is not cache.cache_fetch_fn(
+        "user:by-login:pajlada", fetch
+    )
+
+    # Another process (or the L1 running out) still finds it in redis
+    cache.l1.clear()
+    assert cache.cache_fetch_fn("user:by-login:pajlada", fetch, expiry=300) == {"id": "123"}
+    assert len(fetches) == 1
+    assert redis.gets == 2
+
+    assert cache.stats.get() == {"user:by-login": {"l1_hits": 3, "stale_hits": 0, "redis_hits": 1, "misses": 1}}
+
+
+def test_l1_size_limit(cache) -> None:
+    cache, redis, clock = cache
+    for i in range(5):
+        cache.cache_fetch_fn(f"key:{i}", lambda: i)
+
+    assert len(cache.l1) == 3
+    assert cache.l1.get("key:0") is None
+    assert cache.l1.get("key:4") is not None
+
+
+def test_negative_results_are_cached_shorter(cache) -> None:
+    from pajbot.apiwrappers.response_cache import NEGATIVE_EXPIRY
+
+    cache, redis, clock = cache
+    expiries = {}
+    redis.setex = lambda key, expiry, value: expiries.update({key: expiry})
+
+    assert cache.cache_fetch_fn("user:by-login:random", lambda: None, expiry=3600) is None
+    assert cache.cache_fetch_fn("user:by-login:random", lambda: 1 / 0, expiry=3600) is None
+    assert expiries == {"user:by-login:random": NEGATIVE_EXPIRY}
+
+
+def test_stale_while_revalidate(cache) -> None:
+    from pajbot.apiwrappers.response_cache import L1_TTL
+
+    cache, redis, clock = cache
+    refreshed = threading.Event()
+    values = iter(["old", "new"])
+
+    def fetch():
+        value = next(values)
+        if value == "new":
+            refreshed.set()
+        return value
+
+    assert cache.cache_fetch_fn("stream:by-id:1", fetch, expiry=300) == "old"
+
+    # Stale: the old value is returned right away, while it is refreshed in the background.
+    # It's removed from redis, so the refresh has to fetch it again
+    clock.time += L1_TTL + 1
+    redis.data.clear()
+    assert cache.cache_fetch_fn("stream:by-id:1", fetch, expiry=300) == "old"
+    assert refreshed.wait(5)
+    for _ in range(100):
+        if "stream:by-id:1" not in cache.refreshing:
+            break
+        time.sleep(0.01)
+
+    assert cache.cache_fetch_fn("stream:by-id:1", fetch, expiry=300) == "new"
+    assert cache.stats.get()["stream:by-id"] == {"l1_hits": 1, "stale_hits": 1, "redis_hits": 0, "misses": 2}
+
+
+def test_bulk_fetch(cache) -> None:
+    cache, redis, clock = cache
+    fetched = []
+
+    def fetch(logins):
+        fetched.extend(logins)
+        return [None if login == "missing" else login.upper() for login in logins]
+
+    assert cache.cache_bulk_fetch_fn(["a", "b"], lambda login: f"user:{login}", fetch) == ["A", "B"]
+    assert cache.cache_bulk_fetch_fn(["b", "missing", "a"], lambda login: f"user:{login}", fetch) == [
+        "B",
+        None,
+        "A",
+    ]
+    assert fetched == ["a", "b", "missing"]
+
+
+def test_bulk_fetch_interleaved(cache) -> None:
+    from pajbot.apiwrappers.response_cache import BULK_READ_CHUNK_SIZE
+
+    cache, redis, clock = cache
+    user_ids = [str(i) for i in range(BULK_READ_CHUNK_SIZE * 2 + 500)]
+    for user_id in user_ids[::3]:
+        redis.data[f"user:{user_id}"] = f'"cached-{user_id}"'
+
+    fetched = []
+
+    def fetch(user_ids):
+        fetched.extend(user_ids)
+        return [f"fetched-{user_id}" for user_id in user_ids]
+
+    redis.round_trips = 0
+    results = cache.cache_bulk_fetch_fn(user_ids, lambda user_id: f"user:{user_id}", fetch)
+
+    assert results == [
+        f"cached-{user_id}" if i % 3 == 0 else f"fetched-{user_id}" for i, user_id in enumerate(user_ids)
+    ]
+    assert fetched == [user_id for i, user_id in enumerate(user_ids) if i % 3 != 0]
+    # One round trip to read, one to write
+    assert redis.round_trips == 2
+    assert all(redis.data[f"user:{user_id}"] == f'"fetched-{user_id}"' for user_id in fetched)
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from pajbot.apiwrappers.authentication.client_credentials import ClientCredentials
+from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
+
+import pytest
+from requests import HTTPError
+
+
+class FakeHelix:
+    """Serves /users like Helix does. Responses can be delayed, and failures can be queued up"""
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        # (status code, extra headers) to respond with instead of the real response, oldest first
+        self.failures = []
+        self.rate_limit_remaining = 800
+        self.in_flight = 0
+        self.max_in_flight = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self):
+                url = urlparse(self.path)
+                with fake.lock:
+                    fake.requests.append((self.command, url.path, self.headers.get("Client-ID")))
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    failure = fake.failures.pop(0) if fake.failures else None
+
+                time.sleep(fake.delay)
+
+                headers = {
+                    "Ratelimit-Limit": "800",
+                    "Ratelimit-Remaining": str(fake.rate_limit_remaining),
+                    "Ratelimit-Reset": str(int(time.time()) + 60),
+                }
+                if failure is not None:
+                    status_code, extra_headers = failure
+                    headers.update(extra_headers)
+                    body = {"error": "nope", "status": status_code}
+                else:
+                    status_code = 200
+                    query = parse_qs(url.query)
+                    body = {
+                        "data": [
+                            {"id": f"id-{login}", "login": login, "display_name": login.upper()}
+                            for login in query.get("login", [])
+                            if login != "missing"
+                        ]
+                    }
+
+                data = json.dumps(body).encode()
+                self.send_response(status_code)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+                with fake.lock:
+                    fake.in_flight -= 1
+
+            do_GET = handle_request
+            do_POST = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/helix"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def helix():
+    fake = FakeHelix()
+    patcher = patch("pajbot.apiwrappers.twitch.helix.HELIX_RETRY_BACKOFF", 0.01)
+    patcher.start()
+    api = TwitchHelixAPI(
+        redis=None, app_token_manager=ClientCredentials("client-id", "secret", "uri"), base_url=fake.url
+    )
+    yield fake, api
+    api.executor.shutdown()
+    fake.stop()
+    patcher.stop()
+
+
+def test_identical_gets_are_coalesced(helix) -> None:
+    fake, api = helix
+    fake.delay = 0.2
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(api._fetch_user_data_by_login("pajlada"))) for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fake.requests) == 1
+    assert fake.requests[0] == ("GET", "/helix/users", "client-id")
+    assert results == [{"id": "id-pajlada", "login": "pajlada", "display_name": "PAJLADA"}] * 10
+
+    # Not in flight anymore, so fetched again
+    api._fetch_user_data_by_login("pajlada")
+    assert len(fake.requests) == 2
+
+
+def test_bulk_fetch_is_concurrent(helix) -> None:
+    fake, api = helix
+    fake.delay = 0.1
+
+    logins = [f"user{i}" for i in range(450)] + ["missing"]
+    user_data = api._bulk_fetch_user_data("login", logins)
+
+    assert len(fake.requests) == 5
+    assert fake.max_in_flight > 1
+    assert [entry["login"] if entry is not None else None for entry in user_data] == logins[:-1] + [None]
+
+
+def test_server_errors_are_retried(helix) -> None:
+    fake, api = helix
+    fake.failures = [(503, {}), (500, {})]
+
+    assert api._fetch_user_data_by_login("pajlada") is not None
+    assert len(fake.requests) == 3
+
+    # POSTs might have been executed, they are not retried
+    fake.failures = [(503, {})]
+    with pytest.raises(HTTPError):
+        api.post("/users")
+    assert len(fake.requests) == 4
+
+    fake.failures = [(503, {})] * 4
+    with pytest.raises(HTTPError):
+        api._fetch_user_data_by_login("pajlada")
+    assert len(fake.requests) == 8
+
+
+def test_rate_limit(helix) -> None:
+    fake, api = helix
+
+    # Rate limited: the retry waits for the reset
+    fake.failures = [(429, {"Ratelimit-Remaining": "0", "Ratelimit-Reset": str(time.time() + 0.5)})]
+    start = time.monotonic()
+    assert api._fetch_user_data_by_login("pajlada") is not None
+    assert time.monotonic() - start >= 0.4
+    assert len(fake.requests) == 2
+
+    # Nearly exhausted: requests wait for the bucket to reset before they are sent
+    api.rate_limiter.max_wait = 0.3
+    fake.rate_limit_remaining = 2
+    api._fetch_user_data_by_login("pajlada")
+    start = time.monotonic()
+    api._fetch_user_data_by_login("pajlada")
+    assert time.monotonic() - start >= 0.3
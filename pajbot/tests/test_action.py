@@ -79,3 +79,81 @@ def test_substitutions(input_message: str, expected_substitutions: dict[str, Sub
     from pajbot.models.action import get_substitutions
 
     assert get_substitutions(input_message, None, method_mapping=method_mapping) == expected_substitutions
+
+
+class FakeBot:
+    @staticmethod
+    def apply_filter(value, f):
+        if f.name == "upper":
+            return value.upper()
+        return value
+
+
+def get_response_template_cases() -> list[tuple[str, str, Optional[str]]]:
+    return [
+        ("foo", "a b", "foo"),
+        ("foo $(1) bar $(2) $(1)", "a b", "foo a bar b a"),
+        ("$(foo:xd) $(foo:xd)$(1)", "a b", "bar bara"),
+        ("$(foo:xd|upper) $(unknown:xd) $(3)", "a b", "BAR $(unknown:xd) "),
+        ("$(nothing:xd) foo", "a b", None),
+        ("$(count:x) $(count:x) $(count:y)", "a b", "1 1 2"),
+    ]
+
+
+@pytest.mark.parametrize("response,message,expected", get_response_template_cases())
+def test_response_template(response: str, message: str, expected: Optional[str]) -> None:
+    from pajbot.models.action import ResponseTemplate
+
+    counter = []
+
+    def count(key, extra):
+        counter.append(key)
+        return len(counter)
+
+    mapping = {"foo": lambda key, extra: "bar", "nothing": lambda key, extra: None, "count": count}
+
+    template = ResponseTemplate(response, None, method_mapping=mapping)
+    assert not template.uses_db_session
+    assert template.render(FakeBot(), {"message": message}) == expected  # type: ignore[arg-type]
+
+
+def test_response_template_uses_db_session() -> None:
+    from pajbot.models.action import ResponseTemplate
+
+    mapping = {"user": lambda key, extra: None, "source": lambda key, extra: None}
+
+    assert ResponseTemplate("$(user;1:points)", None, method_mapping=mapping).uses_db_session
+    assert not ResponseTemplate("$(source:points)", None, method_mapping=mapping).uses_db_session
+
+
+def test_response_templates_are_cached_once_the_bot_is_set_up() -> None:
+    from unittest.mock import MagicMock
+
+    from pajbot.models.action import ResponseTemplateCache, compile_response
+
+    class SettingUpBot:
+        def __init__(self) -> None:
+            self.response_templates = ResponseTemplateCache(max_size=2)
+            self.set_up = False
+
+        def __getattr__(self, name: str):
+            if name == "stream_manager" and not self.set_up:
+                raise AttributeError(name)
+            return MagicMock()
+
+    bot = SettingUpBot()
+
+    # Compiled before the stream manager exists, so $(stream:...) is left as it is
+    template = compile_response("$(source:name) is live since $(stream:uptime)", bot)  # type: ignore[arg-type]
+    assert not template.complete
+    assert len(template.subs) == 1
+    assert bot.response_templates.templates == {}
+
+    bot.set_up = True
+    template = compile_response("$(source:name) is live since $(stream:uptime)", bot)  # type: ignore[arg-type]
+    assert len(template.subs) == 2
+    assert compile_response("$(source:name) is live since $(stream:uptime)", bot) is template  # type: ignore[arg-type]
+
+    compile_response("a", bot)  # type: ignore[arg-type]
+    compile_response("b", bot)  # type: ignore[arg-type]
+    assert list(bot.response_templates.templates) == ["a", "b"]
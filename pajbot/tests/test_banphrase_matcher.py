@@ -0,0 +1,133 @@
+from typing import Any, Optional
+
+import pytest
+
+
+def make_banphrase(id: int, phrase: str, **options: Any):
+    from pajbot.models.banphrase import Banphrase
+
+    banphrase = Banphrase(phrase=phrase, **options)
+    banphrase.id = id
+    return banphrase
+
+
+def banphrases():
+    return [
+        make_banphrase(1, "forsen"),
+        make_banphrase(2, "Kappa", case_sensitive=True),
+        make_banphrase(3, "xd", operator="startswith"),
+        make_banphrase(4, "lul", operator="endswith", length=600),
+        make_banphrase(5, "exact match", operator="exact"),
+        make_banphrase(6, "cafe", remove_accents=True),
+        make_banphrase(7, r"b[a4]d\s+w[o0]rd", operator="regex"),
+        make_banphrase(8, r"(\w)\1{9}", operator="regex", permanent=True),
+        make_banphrase(9, "(", operator="regex"),
+        make_banphrase(10, "disabled", enabled=False),
+        make_banphrase(11, "forsen", length=1000),
+        make_banphrase(12, "(?i)CaSe", operator="regex", case_sensitive=True),
+    ]
+
+
+def check_linear(banphrases, message: str, user=None) -> Optional[int]:
+    """The matching algorithm BanphraseManager.check_message used before BanphraseMatcher"""
+    matched_banphrase = None
+    for banphrase in banphrases:
+        if banphrase.enabled is not True:
+            continue
+
+        if banphrase.match(message, user):
+            if not matched_banphrase:
+                matched_banphrase = banphrase
+                continue
+
+            if banphrase.greater_than(matched_banphrase):
+                matched_banphrase = banphrase
+
+    return matched_banphrase.id if matched_banphrase is not None else None
+
+
+def messages() -> list[str]:
+    return [
+        "",
+        "hello",
+        "FORSEN",
+        "kappa",
+        "Kappa",
+        "xD hello",
+        "hello xD",
+        "hello LUL",
+        "LUL hello",
+        "exact match",
+        "exact match!",
+        "EXACT MATCH",
+        "cafe",
+        "café",
+        "CAFÉ au lait",
+        "bad word",
+        "B4D   W0RD",
+        "aaaaaaaaaaaa",
+        "aaaa",
+        "disabled",
+        "case",
+        "xd forsen lul",
+        "forsen bad word lul",
+    ]
+
+
+@pytest.mark.parametrize("message", messages())
+def test_matcher_same_as_linear(message: str) -> None:
+    from pajbot.models.banphrase import BanphraseMatcher
+
+    bps = banphrases()
+    matcher = BanphraseMatcher([bp for bp in bps if bp.enabled])
+
+    res = matcher.check(message, None)
+
+    assert (res.id if res is not None else None) == check_linear(bps, message)
+
+
+def test_matcher_update_and_remove() -> None:
+    from pajbot.models.banphrase import BanphraseMatcher
+
+    bps = banphrases()
+    matcher = BanphraseMatcher([bp for bp in bps if bp.enabled])
+
+    # Turn the "forsen" banphrase into an exact banphrase
+    bps[0].set(operator="exact")
+    bps[10].set(enabled=False)
+    matcher.update(bps[0])
+    matcher.update(bps[10])
+    assert matcher.check("forsen xd", None) is None
+    res = matcher.check("forsen", None)
+    assert res is not None and res.id == 1
+
+    matcher.remove(bps[0])
+    assert matcher.check("forsen", None) is None
+
+
+def test_sub_immunity() -> None:
+    from pajbot.models.banphrase import BanphraseMatcher
+    from pajbot.models.user import User
+
+    sub = User()
+    sub.subscriber = True
+
+    banphrase = make_banphrase(1, "forsen", sub_immunity=True)
+    matcher = BanphraseMatcher([banphrase])
+
+    assert matcher.check("forsen", sub) is None
+    res = matcher.check("forsen", None)
+    assert res is not None and res.id == 1
+
+
+def test_aho_corasick() -> None:
+    from pajbot.utils import AhoCorasick
+
+    matcher: AhoCorasick[str] = AhoCorasick()
+    for word in ["he", "she", "his", "hers"]:
+        matcher.add(word, word)
+
+    assert sorted(matcher.iter_matches("ushers")) == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+    matcher.add("us", "us")
+    assert sorted(matcher.iter_matches("ushers")) == [(0, 2, "us"), (1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from unittest.mock import patch
+
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+
+    def copy_expert(self, sql, file):
+        self.statements.append((sql, None))
+        self.copied.append(file.read())
+
+
+def test_bulk_sync():
+    from pajbot.managers.db import DBManager
+
+    cursor = FakeCursor()
+
+    @contextmanager
+    def create_dbapi_cursor_scope():
+        yield cursor
+
+    rows = [(str(i), f"user{i}", f"User{i}") for i in range(25)] + [
+        ("25", "weird", "tab\there\\new\nline"),
+        ("26", "x", None),
+    ]
+    with patch.object(DBManager, "create_dbapi_cursor_scope", create_dbapi_cursor_scope):
+        num_rows = DBManager.bulk_sync(
+            "chatters",
+            [("id", "TEXT NOT NULL"), ("login", "TEXT NOT NULL"), ("name", "TEXT")],
+            iter(rows),
+            "INSERT INTO ... %(add_points)s",
+            {"add_points": 10},
+            chunk_size=10,
+        )
+
+    assert num_rows == 27
+    assert cursor.statements[0] == (
+        "CREATE TEMPORARY TABLE chatters(id TEXT NOT NULL, login TEXT NOT NULL, name TEXT) ON COMMIT DROP",
+        None,
+    )
+    assert cursor.statements[1][0] == "COPY chatters(id, login, name) FROM STDIN"
+    assert len(cursor.copied) == 3
+    assert cursor.copied[0].startswith("0\tuser0\tUser0\n1\tuser1\tUser1\n")
+    assert cursor.copied[2].endswith("25\tweird\ttab\\there\\\\new\\nline\n26\tx\t\\N\n")
+    assert cursor.statements[-1] == ("INSERT INTO ... %(add_points)s", {"add_points": 10})
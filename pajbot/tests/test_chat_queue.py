@@ -0,0 +1,93 @@
+import threading
+
+
+class FakeIRC:
+    def __init__(self):
+        self.sent = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def privmsg(self, channel, message):
+        self.started.set()
+        self.release.wait(5)
+        self.sent.append((channel, message))
+        return True
+
+    def send_raw(self, message):
+        self.sent.append(("raw", message))
+        return True
+
+
+class FakeBot:
+    def __init__(self):
+        from pajbot.tmi import ChatOutputMode
+
+        self.chat_output_mode = ChatOutputMode.IRC
+        self.irc = FakeIRC()
+        self.thread_locals = threading.local()
+
+
+def test_lanes_and_coalescing():
+    from pajbot.managers.chat_queue import ChatQueue
+    from pajbot.tmi import ChatPriority, TMIRateLimits
+
+    bot = FakeBot()
+    queue = ChatQueue(bot, TMIRateLimits.BASE)
+
+    # Keeps the worker busy while the rest is queued
+    queue.submit("#channel", "first")
+    assert bot.irc.started.wait(5)
+
+    assert queue.submit("#channel", "timer", ChatPriority.ANNOUNCEMENT)
+    assert queue.submit("#channel", "command", ChatPriority.COMMAND)
+    assert not queue.submit("#channel", "command", ChatPriority.COMMAND)
+    assert queue.submit("#otherchannel", "command", ChatPriority.COMMAND)
+    assert queue.submit("#channel", "ban reply", ChatPriority.MODERATION)
+    assert queue.submit("#channel", "reply", ChatPriority.COMMAND, reply_parent_message_id="abc")
+
+    bot.irc.release.set()
+    queue.stop()
+
+    assert bot.irc.sent == [
+        ("#channel", "first"),
+        ("#channel", "ban reply"),
+        ("#channel", "command"),
+        ("#otherchannel", "command"),
+        ("raw", "@reply-parent-msg-id=abc PRIVMSG #channel :reply"),
+        ("#channel", "timer"),
+    ]
+
+    stats = queue.stats()
+    assert stats["submitted"] == 7
+    assert stats["coalesced"] == 1
+    assert stats["sent"] == 6
+    assert stats["queued_announcement"] == 0
+
+
+def test_rate_limit():
+    from pajbot.managers.chat_queue import ChatQueue
+    from pajbot.tmi import TMIRateLimits
+
+    bot = FakeBot()
+    bot.irc.release.set()
+    queue = ChatQueue(bot, TMIRateLimits(privmsg_per_30=3, whispers_per_second=2, whispers_per_minute=90))
+
+    for i in range(5):
+        queue.submit("#channel", f"message {i}")
+
+    queue.stop(timeout=0.5)
+
+    # The rest has to wait for the bucket to refill
+    assert len(bot.irc.sent) == 3
+
+
+def test_chat_priority_scope():
+    from pajbot.managers.chat_queue import chat_priority_scope
+    from pajbot.tmi import ChatPriority
+
+    bot = FakeBot()
+    with chat_priority_scope(bot, ChatPriority.ANNOUNCEMENT):
+        with chat_priority_scope(bot, ChatPriority.MODERATION):
+            assert bot.thread_locals.chat_priority == ChatPriority.MODERATION
+        assert bot.thread_locals.chat_priority == ChatPriority.ANNOUNCEMENT
+    assert bot.thread_locals.chat_priority is None
@@ -0,0 +1,170 @@
+import os
+import random
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+
+class FakeModule:
+    def __init__(self, module_id, commands):
+        self.ID = module_id
+        self.commands = commands
+
+
+class FakeModuleManager:
+    def __init__(self):
+        self.modules = []
+
+
+def raw_command(name):
+    from pajbot.models.command import Command
+
+    return Command.raw_command(lambda **rest: True, command=name)
+
+
+def multi_command(name, subcommands):
+    from pajbot.models.command import Command
+
+    return Command.multiaction_command(
+        command=name, commands={subcommand: raw_command(subcommand) for subcommand in subcommands}
+    )
+
+
+@pytest.fixture
+def command_manager():
+    from pajbot.managers.command import CommandManager
+
+    with patch("pajbot.managers.db.DBManager.create_session", return_value=MagicMock()):
+        manager = CommandManager(module_manager=FakeModuleManager())  # type: ignore[arg-type]
+    manager.internal_commands = {
+        "add": multi_command("add", ["command", "alias"]),
+        "edit": multi_command("edit", ["command"]),
+        "quit": raw_command("quit"),
+    }
+    manager.internal_commands["1quit"] = manager.internal_commands["quit"]
+    yield manager
+    manager.db_session = MagicMock()
+
+
+def snapshot(manager):
+    return {
+        alias: (command, sorted(command.action.commands) if command.action.type == "multi" else None)
+        for alias, command in manager.data.items()
+    }
+
+
+def assert_same_as_rebuild(manager):
+    updated = snapshot(manager)
+    manager.rebuild()
+    assert updated == snapshot(manager)
+
+
+def test_update_db_command(command_manager) -> None:
+    command_manager.db_commands = {"ping": raw_command("ping"), "quit": raw_command("quit")}
+    command_manager.rebuild()
+    assert command_manager["quit"] is command_manager.db_commands["quit"]
+
+    ping = raw_command("ping|pong")
+    command_manager.db_commands["ping"] = ping
+    command_manager.db_commands["pong"] = ping
+    del command_manager.db_commands["quit"]
+    command_manager.update_layers(["db"])
+
+    assert command_manager["pong"] is ping
+    assert command_manager["quit"] is command_manager.internal_commands["quit"]
+    assert_same_as_rebuild(command_manager)
+
+
+def test_update_modules(command_manager) -> None:
+    command_manager.rebuild()
+    modules = command_manager.module_manager.modules
+
+    # Enabling a module merges its subcommands into the internal multi-action command
+    modules.append(
+        FakeModule("playsound", {"add": multi_command("add", ["playsound"]), "playsound": raw_command("ps")})
+    )
+    command_manager.update_layers(["module:playsound"])
+    assert sorted(command_manager["add"].action.commands) == ["alias", "command", "playsound"]
+    assert_same_as_rebuild(command_manager)
+
+    modules.append(FakeModule("deck", {"add": multi_command("add", ["deck"]), "edit": multi_command("edit", ["deck"])}))
+    command_manager.update_layers()
+    assert sorted(command_manager["add"].action.commands) == ["alias", "command", "deck", "playsound"]
+    assert sorted(command_manager["edit"].action.commands) == ["command", "deck"]
+    assert_same_as_rebuild(command_manager)
+
+    # Disabling it undoes the merge
+    del modules[0]
+    command_manager.update_layers(["module:playsound"])
+    assert sorted(command_manager["add"].action.commands) == ["alias", "command", "deck"]
+    assert "playsound" not in command_manager
+    assert_same_as_rebuild(command_manager)
+
+
+def test_random_updates_same_as_rebuild(command_manager) -> None:
+    rng = random.Random(1337)
+    modules = command_manager.module_manager.modules
+    command_manager.rebuild()
+
+    for i in range(200):
+        op = rng.randrange(3)
+        if op == 0:
+            alias = f"cmd{rng.randrange(20)}"
+            if alias in command_manager.db_commands and rng.random() < 0.5:
+                del command_manager.db_commands[alias]
+            else:
+                command_manager.db_commands[alias] = raw_command(alias)
+            command_manager.update_layers(["db"])
+        elif op == 1:
+            module_id = f"module{rng.randrange(5)}"
+            module = next((module for module in modules if module.ID == module_id), None)
+            if module is not None:
+                modules.remove(module)
+            else:
+                commands = {f"cmd{rng.randrange(20)}": raw_command(f"m{i}"), "add": multi_command("add", [f"m{i}"])}
+                modules.append(FakeModule(module_id, commands))
+            command_manager.update_layers([f"module:{module_id}"])
+        else:
+            command_manager.update_layers()
+
+        assert_same_as_rebuild(command_manager)
+
+
+@pytest.mark.skipif("PAJBOT_BENCHMARK" not in os.environ, reason="set PAJBOT_BENCHMARK=1 to run benchmarks")
+def test_update_benchmark(command_manager) -> None:
+    """Micro-benchmark of applying a single command edit with a full rebuild and with an update. Run with pytest -s"""
+    modules = command_manager.module_manager.modules
+    for i in range(40):
+        modules.append(FakeModule(f"module{i}", {f"module{i}": raw_command(f"module{i}")}))
+
+    results = []
+    for num_commands in [100, 1000, 2000, 5000]:
+        command_manager.db_commands = {f"cmd{i}": raw_command(f"cmd{i}") for i in range(num_commands)}
+        command_manager.rebuild()
+
+        iterations = 20
+        start = time.perf_counter()
+        for i in range(iterations):
+            command_manager.db_commands["cmd0"] = raw_command("cmd0")
+            command_manager.rebuild()
+        rebuild_duration = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            command_manager.db_commands["cmd0"] = raw_command("cmd0")
+            command_manager.update_layers(["db"])
+        update_duration = (time.perf_counter() - start) / iterations
+
+        results.append((num_commands, rebuild_duration, update_duration))
+
+    print(
+        "commands: "
+        + ", ".join(
+            f"{num_commands}: rebuild {rebuild * 1000:.2f}ms update {update * 1000:.2f}ms"
+            for num_commands, rebuild, update in results
+        )
+    )
+
+    num_commands, rebuild_duration, update_duration = results[-1]
+    assert update_duration < rebuild_duration
@@ -0,0 +1,155 @@
+import threading
+import time
+from unittest.mock import patch
+
+
+class FakeLock:
+    def __init__(self, lock, blocking_timeout):
+        self.lock = lock
+        self.blocking_timeout = blocking_timeout
+
+    def acquire(self):
+        return self.lock.acquire(timeout=self.blocking_timeout)
+
+    def release(self):
+        self.lock.release()
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).update(mapping))
+
+    def expire(self, key, time):
+        pass
+
+    def execute(self):
+        with self.redis.lock_:
+            for command in self.commands:
+                command()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.locks = {}
+        self.lock_ = threading.Lock()
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def hget(self, key, field):
+        with self.lock_:
+            return self.hashes.get(key, {}).get(field, None)
+
+    def hmget(self, key, fields):
+        with self.lock_:
+            return [self.hashes.get(key, {}).get(field, None) for field in fields]
+
+    def lock(self, name, timeout, blocking_timeout):
+        with self.lock_:
+            return FakeLock(self.locks.setdefault(name, threading.Lock()), blocking_timeout)
+
+
+def test_publish_versions_snapshot():
+    from pajbot.managers.command_snapshot import get_command_snapshot, publish_command_snapshot
+
+    redis = FakeRedis()
+    version = publish_command_snapshot(redis, "streamer", [{"id": 1}])
+    assert publish_command_snapshot(redis, "streamer", [{"id": 1}]) == version
+    assert publish_command_snapshot(redis, "other_streamer", [{"id": 1}]) == version
+
+    with patch("pajbot.managers.command_snapshot.build_command_list") as build_command_list:
+        snapshot = get_command_snapshot(redis, "streamer")
+        assert snapshot.version == version
+        assert snapshot.commands == [{"id": 1}]
+
+        new_version = publish_command_snapshot(redis, "streamer", [{"id": 1}, {"id": 2}])
+        assert new_version != version
+        assert get_command_snapshot(redis, "streamer").version == new_version
+
+        build_command_list.assert_not_called()
+
+
+def test_missing_snapshot_is_built_once():
+    from pajbot.managers.command_snapshot import get_command_snapshot
+
+    redis = FakeRedis()
+    num_builds = 0
+
+    def build_command_list():
+        nonlocal num_builds
+        num_builds += 1
+        time.sleep(0.1)
+        return [{"id": 1}]
+
+    snapshots = []
+    with patch("pajbot.managers.command_snapshot.build_command_list", build_command_list):
+        threads = [
+            threading.Thread(target=lambda: snapshots.append(get_command_snapshot(redis, "streamer"))) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert num_builds == 1
+    assert len(snapshots) == 8
+    assert len({snapshot.version for snapshot in snapshots}) == 1
+    assert all(snapshot.commands == [{"id": 1}] for snapshot in snapshots)
+
+
+def test_publisher_uses_the_bots_commands():
+    from pajbot.managers.command_snapshot import CommandSnapshotPublisher, get_command_snapshot
+
+    class FakeWebCommand:
+        def __init__(self, id, main_alias):
+            self.id = id
+            self.main_alias = main_alias
+
+        def jsonify(self):
+            return {"id": self.id, "main_alias": self.main_alias}
+
+    class FakeCommandManager:
+        def __init__(self):
+            self.commands = [FakeWebCommand(2, "b"), FakeWebCommand(None, "a")]
+
+        def parse_for_web(self):
+            return list(self.commands)
+
+    redis = FakeRedis()
+    command_manager = FakeCommandManager()
+    publisher = CommandSnapshotPublisher(redis, "streamer")
+    with (
+        patch("pajbot.managers.command_snapshot.ScheduleManager") as schedule_manager,
+        patch("pajbot.managers.command_snapshot.build_command_list") as build_command_list,
+    ):
+        # Changes before the bot is set up are published once it is
+        publisher.schedule()
+        publisher.publish()
+        assert publisher.version is None
+
+        publisher.start(command_manager)  # type: ignore[arg-type]
+        schedule_manager.execute_every.assert_called_once()
+        publisher.publish()
+        assert get_command_snapshot(redis, "streamer").commands == [
+            {"id": None, "main_alias": "a"},
+            {"id": 2, "main_alias": "b"},
+        ]
+
+        command_manager.commands.append(FakeWebCommand(3, "c"))
+        version = publisher.version
+        publisher.publish()
+        assert publisher.version != version
+        assert len(get_command_snapshot(redis, "streamer").commands) == 3
+
+        build_command_list.assert_not_called()
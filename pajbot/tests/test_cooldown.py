@@ -0,0 +1,115 @@
+from unittest.mock import patch
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cooldowns_run_out():
+    from pajbot.managers.cooldown import CooldownStore
+
+    clock = FakeClock()
+    cooldowns = CooldownStore(clock=clock)
+
+    cooldowns.start("a", 10)
+    cooldowns.start("b", 30)
+    cooldowns.start("c", 0)
+    assert len(cooldowns) == 2
+
+    clock.now += 5
+    assert cooldowns.time_since("a") == 5
+    assert cooldowns.remaining("a") == 5
+    assert cooldowns.is_active("b")
+    assert cooldowns.time_since("c") is None
+
+    clock.now += 5
+    assert cooldowns.time_since("a") is None
+    assert not cooldowns.is_active("a")
+    assert len(cooldowns) == 1
+
+    # Restarting a cooldown replaces it, the old expiry is ignored
+    cooldowns.start("b", 30)
+    clock.now += 25
+    assert cooldowns.time_since("b") == 25
+
+    clock.now += 5
+    assert len(cooldowns) == 0
+    assert cooldowns.expiry_heap == []
+
+
+def test_memory_is_bounded_by_active_cooldowns():
+    from pajbot.managers.cooldown import CooldownStore
+
+    clock = FakeClock()
+    cooldowns = CooldownStore(clock=clock)
+
+    for i in range(10000):
+        cooldowns.start(str(i), 15)
+        clock.now += 0.01
+
+    # Only the last 15 seconds worth of cooldowns are kept
+    assert 1490 <= len(cooldowns) <= 1510
+    assert len(cooldowns.expiry_heap) <= 1510
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def scan_iter(self, match, count):
+        self.round_trips += 1
+        return [key for key in self.data if key.startswith(match[:-1])]
+
+    def mget(self, keys):
+        self.round_trips += 1
+        return [self.data.get(key, None) for key in keys]
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+
+def test_replication():
+    import weakref
+
+    from pajbot.managers.cooldown import CooldownStore
+
+    redis = FakeRedis()
+    with (
+        patch("pajbot.managers.redis.RedisManager.get", return_value=redis),
+        patch.object(CooldownStore, "redis_prefix", "streamer:cooldowns"),
+        patch.object(CooldownStore, "replicated", {}),
+        patch.object(CooldownStore, "stores", weakref.WeakValueDictionary()),
+    ):
+        first = CooldownStore("command:1")
+        first.start("123", 60)
+        CooldownStore("command:2").start("123", 30)
+        assert sorted(redis.data.keys()) == ["streamer:cooldowns:command:1:123", "streamer:cooldowns:command:2:123"]
+
+        # Stores without a namespace are never replicated
+        CooldownStore().start("456", 60)
+        assert len(redis.data) == 2
+
+        # e.g. another bot, or the same bot after a restart: all cooldowns are read at once
+        CooldownStore.stores.clear()
+        CooldownStore.enable_replication("streamer")
+        assert redis.round_trips == 2
+        restarted = CooldownStore("command:1")
+        assert restarted.is_active("123")
+        assert 59 < restarted.remaining("123") <= 60
+        assert not restarted.is_active("456")
+        assert list(CooldownStore.replicated.keys()) == ["command:2"]
+
+        # Checking cooldowns never waits for redis
+        assert redis.round_trips == 2
+
+        # A reloaded command keeps the cooldowns of the store it replaces
+        restarted.start("789", 10)
+        reloaded = CooldownStore("command:1")
+        assert reloaded.is_active("123")
+        assert reloaded.is_active("789")
+        assert redis.round_trips == 2
@@ -0,0 +1,30 @@
+import pytest
+
+MESSAGES = [
+    "",
+    "hello there forsen",
+    "hello 😀",
+    "😀😃 two",
+    "flag 🇸🇪 and family 👨‍👩‍👧‍👦",
+    "keycap 1️⃣ and 123",
+    "© 2020",
+    "☺ unqualified",
+]
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_contains_same_as_substring_search(message: str) -> None:
+    from pajbot.emoji import ALL_EMOJI, EMOJI_MATCHER
+
+    assert EMOJI_MATCHER.contains(message) == any(emoji in message for emoji in ALL_EMOJI)
+
+
+def test_longest_match_spans() -> None:
+    from pajbot.emoji import EMOJI_MATCHER
+
+    message = "flag 🇸🇪 and family 👨‍👩‍👧‍👦 😀😃"
+    spans = EMOJI_MATCHER.spans(message)
+
+    assert [message[start:end] for start, end in spans] == ["🇸🇪", "👨‍👩‍👧‍👦", "😀", "😃"]
+    assert EMOJI_MATCHER.count(message) == 4
+    assert EMOJI_MATCHER.count("no emoji 123") == 0
@@ -0,0 +1,199 @@
+from typing import Optional
+
+import os
+import time
+from unittest.mock import Mock, patch
+
+from pajbot.models.emote import Emote, EmoteInstance
+from pajbot.utils import iterate_split_with_index
+
+import pytest
+
+
+def make_emote(code: str, provider: str) -> Emote:
+    return Emote(code=code, provider=provider, id=f"{provider}-{code}", urls={}, max_width=28, max_height=28)
+
+
+@pytest.fixture
+def emote_manager():
+    from pajbot.managers.emote import EmoteManager
+    from pajbot.managers.redis import RedisManager
+    from pajbot.managers.schedule import ScheduleManager
+
+    with patch.object(RedisManager, "get"), patch.object(ScheduleManager, "execute_every"):
+        manager = EmoteManager(Mock(), Mock())
+
+    manager.ffz_emote_manager.channel_emotes = [make_emote("LULW", "ffz"), make_emote("forsenE", "ffz")]
+    manager.bttv_emote_manager.channel_emotes = [make_emote("forsenE", "bttv"), make_emote("forsenPls", "bttv")]
+    manager.seventv_emote_manager.channel_emotes = [make_emote("forsenPls", "7tv"), make_emote("WineTime", "7tv")]
+    manager.ffz_emote_manager.global_emotes = [make_emote("WineTime", "ffz"), make_emote("monkaS", "ffz")]
+    manager.bttv_emote_manager.global_emotes = [make_emote("monkaS", "bttv"), make_emote("OMEGALUL", "bttv")]
+    manager.seventv_emote_manager.global_emotes = [
+        make_emote("OMEGALUL", "7tv"),
+        make_emote("EZ", "7tv"),
+        *[make_emote(f"filler{i}", "7tv") for i in range(2000)],
+    ]
+    return manager
+
+
+def match_word_to_emote_linear(manager, word: str) -> Optional[Emote]:
+    """EmoteManager.match_word_to_emote before the merged lookup table"""
+    for emote_manager in (manager.ffz_emote_manager, manager.bttv_emote_manager, manager.seventv_emote_manager):
+        emote = emote_manager.match_channel_emote(word)
+        if emote is not None:
+            return emote
+
+    for emote_manager in (manager.ffz_emote_manager, manager.bttv_emote_manager, manager.seventv_emote_manager):
+        emote = emote_manager.match_global_emote(word)
+        if emote is not None:
+            return emote
+
+    return None
+
+
+def parse_all_emotes_linear(manager, message: str, twitch_emotes_tag: str = "") -> list[EmoteInstance]:
+    """EmoteManager.parse_all_emotes before the merged lookup table and parse cache"""
+    instances = manager.parse_twitch_emotes_tag(twitch_emotes_tag, message)
+    twitch_emote_start_indices = {instance.start for instance in instances}
+
+    for current_word_index, word in iterate_split_with_index(message.split(" ")):
+        if current_word_index in twitch_emote_start_indices:
+            continue
+
+        emote = match_word_to_emote_linear(manager, word)
+        if emote is not None:
+            instances.append(EmoteInstance(start=current_word_index, end=current_word_index + len(word), emote=emote))
+
+    instances.sort(key=lambda instance: instance.start)
+    return instances
+
+
+MESSAGES = [
+    ("forsenE forsenPls WineTime monkaS OMEGALUL EZ LULW Kappa", "25:51-55"),
+    ("just a normal message without any emotes in it at all", ""),
+    ("Kappa Kappa Kappa", "25:0-4,6-10,12-16"),
+    ("", ""),
+]
+
+
+def test_lookup_table_precedence(emote_manager) -> None:
+    for word in ["LULW", "forsenE", "forsenPls", "WineTime", "monkaS", "OMEGALUL", "EZ", "Kappa"]:
+        assert emote_manager.match_word_to_emote(word) == match_word_to_emote_linear(emote_manager, word)
+
+    assert emote_manager.match_word_to_emote("forsenE").provider == "ffz"
+    assert emote_manager.match_word_to_emote("OMEGALUL").provider == "bttv"
+
+
+@pytest.mark.parametrize("message,tag", MESSAGES)
+def test_parse_all_emotes_same_as_linear(emote_manager, message: str, tag: str) -> None:
+    expected = parse_all_emotes_linear(emote_manager, message, tag)
+
+    # The second call is answered from the parse cache
+    for _ in range(2):
+        instances, counts = emote_manager.parse_all_emotes(message, tag)
+        assert instances == expected
+        assert sum(count.count for count in counts.values()) == len(expected)
+
+
+def test_parse_cache_follows_emote_updates(emote_manager) -> None:
+    instances, _ = emote_manager.parse_all_emotes("monkaS pajaH")
+    assert [i.emote.code for i in instances] == ["monkaS"]
+
+    emote_manager.bttv_emote_manager.channel_emotes = [make_emote("pajaH", "bttv")]
+
+    instances, _ = emote_manager.parse_all_emotes("monkaS pajaH")
+    assert [i.emote.code for i in instances] == ["monkaS", "pajaH"]
+
+
+def test_parse_cache_is_hit(emote_manager) -> None:
+    from pajbot.managers.emote import PARSE_CACHE_SIZE
+
+    with patch.object(emote_manager, "_parse_all_emotes", wraps=emote_manager._parse_all_emotes) as parse:
+        # The same messages over and over, like copypasta
+        for _ in range(100):
+            for message, tag in MESSAGES:
+                emote_manager.parse_all_emotes(message, tag)
+        assert parse.call_count == len(MESSAGES)
+
+        # Emote updates make the cached results outdated
+        emote_manager.rebuild_lookup_table()
+        emote_manager.parse_all_emotes(*MESSAGES[0])
+        assert parse.call_count == len(MESSAGES) + 1
+
+        for i in range(PARSE_CACHE_SIZE + 10):
+            emote_manager.parse_all_emotes(f"forsenE {i}")
+        assert len(emote_manager.parse_cache) == PARSE_CACHE_SIZE
+
+
+@pytest.mark.skipif("PAJBOT_BENCHMARK" not in os.environ, reason="set PAJBOT_BENCHMARK=1 to run benchmarks")
+def test_parse_throughput(emote_manager) -> None:
+    """Micro-benchmark of parse_all_emotes before and after the merged lookup table. Run with pytest -s for output"""
+    iterations = 2000
+    messages = [(f"{message} {i}", tag) for i in range(iterations) for message, tag in MESSAGES[:2]]
+
+    start = time.perf_counter()
+    for message, tag in messages:
+        parse_all_emotes_linear(emote_manager, message, tag)
+    linear_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for message, tag in messages:
+        emote_manager.parse_all_emotes(message, tag)
+    merged_duration = time.perf_counter() - start
+
+    # The same messages over and over, like copypasta
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for message, tag in MESSAGES[:2]:
+            emote_manager.parse_all_emotes(message, tag)
+    cached_duration = time.perf_counter() - start
+
+    print(
+        f"parse_all_emotes: linear {len(messages) / linear_duration:.0f} msg/s, "
+        f"merged {len(messages) / merged_duration:.0f} msg/s, cached {len(messages) / cached_duration:.0f} msg/s"
+    )
+    assert cached_duration < linear_duration
+
+
+def test_ecount_buckets() -> None:
+    import datetime
+
+    from pajbot.managers.emote import EcountManager
+    from pajbot.models.emote import EmoteInstanceCount
+
+    kappa = make_emote("Kappa", "twitch")
+    emote_counts = {"Kappa": EmoteInstanceCount(count=3, emote=kappa, emote_instances=[])}
+    today = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+    with (
+        patch("pajbot.managers.emote.StreamHelper.get_streamer", return_value="streamer"),
+        patch("pajbot.managers.emote.utils.now", return_value=today),
+    ):
+        ecount_manager = EcountManager()
+        ecount_manager.handle_emotes(emote_counts)
+        pipeline = Mock()
+        ecount_manager.flush(pipeline, 123)
+        pipeline.zincrby.assert_called_once_with("streamer:emotes:count", 3, "Kappa")
+        pipeline.expire.assert_not_called()
+
+        ecount_manager = EcountManager(bucketed=True)
+        ecount_manager.handle_emotes(emote_counts)
+        ecount_manager.handle_emotes(emote_counts)
+        pipeline = Mock()
+        ecount_manager.flush(pipeline, 123)
+        assert {call.args for call in pipeline.zincrby.call_args_list} == {
+            ("streamer:emotes:count", 6, "Kappa"),
+            ("streamer:emotes:count:day:2024-01-02", 6, "Kappa"),
+            ("streamer:emotes:count:stream:123", 6, "Kappa"),
+        }
+        assert {call.args[0] for call in pipeline.expire.call_args_list} == {
+            "streamer:emotes:count:day:2024-01-02",
+            "streamer:emotes:count:stream:123",
+        }
+
+        # Offline, and nothing to flush
+        ecount_manager.handle_emotes(emote_counts)
+        pipeline = Mock()
+        ecount_manager.flush(pipeline)
+        ecount_manager.flush(pipeline)
+        assert pipeline.zincrby.call_count == 2
@@ -0,0 +1,119 @@
+def test_handlers_run_in_priority_order():
+    from pajbot.managers.handler import HandlerManager
+
+    HandlerManager.init_handlers()
+    HandlerManager.create_handler("on_test")
+
+    calls = []
+
+    def low(**rest):
+        calls.append("low")
+
+    def high(**rest):
+        calls.append("high")
+
+    def high_second(**rest):
+        calls.append("high_second")
+
+    HandlerManager.add_handler("on_test", low, priority=0)
+    HandlerManager.add_handler("on_test", high, priority=100)
+    HandlerManager.add_handler("on_test", high_second, priority=100)
+
+    assert HandlerManager.trigger("on_test")
+    assert calls == ["high", "high_second", "low"]
+
+    # The list of handlers is shared with add_handler and remove_handler, only the plan is sorted
+    assert [handler for handler, _, _ in HandlerManager.handlers["on_test"]] == [low, high, high_second]
+
+
+def test_plan_is_rebuilt_when_handlers_change():
+    from pajbot.managers.handler import HandlerManager
+
+    HandlerManager.init_handlers()
+    HandlerManager.create_handler("on_test")
+
+    calls = []
+
+    def first(**rest):
+        calls.append("first")
+
+    def second(**rest):
+        calls.append("second")
+
+    HandlerManager.add_handler("on_test", first)
+    HandlerManager.trigger("on_test")
+    plan = HandlerManager.plans["on_test"]
+
+    # Triggering again reuses the compiled plan
+    HandlerManager.trigger("on_test")
+    assert HandlerManager.plans["on_test"] is plan
+
+    HandlerManager.add_handler("on_test", second, priority=10)
+    HandlerManager.trigger("on_test")
+    assert calls == ["first", "first", "second", "first"]
+
+    HandlerManager.remove_handler("on_test", second)
+    HandlerManager.trigger("on_test")
+    assert calls == ["first", "first", "second", "first", "first"]
+
+
+def test_propagation():
+    from pajbot.managers.handler import HandlerManager
+
+    HandlerManager.init_handlers()
+    HandlerManager.create_handler("on_test")
+
+    calls = []
+
+    def stop(**rest):
+        calls.append("stop")
+        return False
+
+    def skipped(**rest):
+        calls.append("skipped")
+
+    def always(**rest):
+        calls.append("always")
+
+    def broken(**rest):
+        raise ValueError("xd")
+
+    HandlerManager.add_handler("on_test", broken, priority=200)
+    HandlerManager.add_handler("on_test", stop, priority=100)
+    HandlerManager.add_handler("on_test", skipped, priority=50)
+    HandlerManager.add_handler("on_test", always, priority=0, run_if_propagation_stopped=True)
+
+    HandlerManager.trigger("on_test")
+    assert calls == ["stop", "always"]
+
+    HandlerManager.trigger("on_test", stop_on_false=False)
+    assert calls == ["stop", "always", "stop", "skipped", "always"]
+
+
+def test_stats():
+    from pajbot.managers.handler import HandlerManager
+
+    HandlerManager.init_handlers()
+    HandlerManager.create_handler("on_test")
+
+    def handler(**rest):
+        pass
+
+    def unused(**rest):
+        pass
+
+    HandlerManager.add_handler("on_test", handler)
+    for _ in range(3):
+        HandlerManager.trigger("on_test")
+    HandlerManager.create_handler("on_unused")
+    HandlerManager.add_handler("on_unused", unused)
+
+    stats = HandlerManager.get_stats()
+    assert len(stats) == 1
+    assert stats[0].event == "on_test"
+    assert stats[0].calls == 3
+    assert stats[0].max_time <= stats[0].total_time
+    assert stats[0].jsonify()["handler"] == "test_stats.<locals>.handler"
+
+    HandlerManager.remove_handler("on_test", handler)
+    assert HandlerManager.get_stats() == []
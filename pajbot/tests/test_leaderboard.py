@@ -0,0 +1,285 @@
+import datetime
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append(lambda: getattr(self.redis, name)(*args, **kwargs))
+
+        return command
+
+    def execute(self):
+        self.redis.round_trips += 1
+        return [command() for command in self.commands]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def expire(self, key, seconds):
+        pass
+
+    def zadd(self, key, mapping, xx=False):
+        scores = self.data.setdefault(key, {})
+        for member, score in mapping.items():
+            if not xx or member in scores:
+                scores[member] = float(score)
+        if not scores:
+            del self.data[key]
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.data.get(key, {}).pop(member, None)
+
+    def zscore(self, key, member):
+        return self.data.get(key, {}).get(member, None)
+
+    def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    def _sorted(self, key):
+        return sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    @staticmethod
+    def _slice(entries, start, end, withscores):
+        entries = entries[start : end + 1 if end != -1 else None]
+        return entries if withscores else [member for member, _ in entries]
+
+    def zrange(self, key, start, end, withscores=False):
+        return self._slice(self._sorted(key), start, end, withscores)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        return self._slice(self._sorted(key)[::-1], start, end, withscores)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        entries = self.data.setdefault(key, {})
+        if field is not None:
+            entries[field] = value
+        entries.update(mapping or {})
+
+    def hmget(self, key, fields):
+        return [self.data.get(key, {}).get(field, None) for field in fields]
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+
+class FakeQuery:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def limit(self, limit):
+        return FakeQuery(self.entries[:limit])
+
+    def filter(self, clause):
+        user_ids = clause.right.value
+        return FakeQuery([entry for entry in self.entries if entry.id in user_ids])
+
+    def all(self):
+        return self.entries
+
+
+def make_user(user_id, **kwargs):
+    from pajbot.models.user import User
+
+    user = User()
+    user.id = user_id
+    user.login = f"user{user_id}"
+    user.name = f"User{user_id}"
+    user.level = 100
+    for field in ["subscriber", "moderator", "vip", "founder"]:
+        setattr(user, field, False)
+    for field, value in kwargs.items():
+        setattr(user, field, value)
+    return user
+
+
+def make_manager(monkeypatch, entries):
+    from pajbot.managers.leaderboard import LEADERBOARDS, LeaderboardManager
+
+    refreshes = []
+
+    def refresh(self, names=None):
+        for name in names:
+            refreshes.append(name)
+            self._refresh(None, LEADERBOARDS[name])
+
+    for name, leaderboard in LEADERBOARDS.items():
+        monkeypatch.setattr(leaderboard, "query", lambda db_session, name=name: FakeQuery(entries.get(name, [])))
+    monkeypatch.setattr(LeaderboardManager, "refresh", refresh)
+
+    redis = FakeRedis()
+    return LeaderboardManager(redis, "streamer"), redis, refreshes
+
+
+def test_read_is_computed_once(monkeypatch) -> None:
+    users = [make_user("1", points=500), make_user("2", points=300), make_user("3", points=300)]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"points": users})
+
+    rankings = leaderboards.get("points", 30)
+    assert [(user.login, user.points, rank) for user, rank in rankings] == [
+        ("user1", 500, 1),
+        ("user3", 300, 2),
+        ("user2", 300, 2),
+    ]
+    assert rankings[0][0].name == "User1"
+
+    # The second read only uses redis
+    assert len(leaderboards.get("points", 1)) == 1
+    assert refreshes == ["points"]
+
+    # Empty leaderboards are not computed again on every read either
+    assert leaderboards.get("num_lines", 5) == []
+    assert leaderboards.get("num_lines", 5) == []
+    assert refreshes == ["points", "num_lines"]
+
+
+def test_time_in_chat(monkeypatch) -> None:
+    users = [make_user("1", time_in_chat_online=datetime.timedelta(hours=2))]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"time_in_chat_online": users})
+
+    [(user, rank)] = leaderboards.get("time_in_chat_online", 5)
+    assert user.time_in_chat_online == datetime.timedelta(hours=2)
+
+
+def patch_db_users(monkeypatch, users):
+    from contextlib import contextmanager
+
+    class FakeSession:
+        def query(self, model):
+            return FakeQuery(users)
+
+    @contextmanager
+    def create_session_scope(**options):
+        yield FakeSession()
+
+    monkeypatch.setattr("pajbot.managers.leaderboard.DBManager.create_session_scope", create_session_scope)
+
+
+def test_update_points(monkeypatch) -> None:
+    users = [make_user("1", points=500), make_user("2", points=300)]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"points": users})
+    patch_db_users(monkeypatch, [make_user("3", points=0)])
+
+    # Leaderboards that were not computed yet are left alone
+    leaderboards.update_points({"2": 1000, "3": 2000})
+    assert not redis.exists(leaderboards.get_entries_key("points"))
+
+    leaderboards.get("points", 5)
+    leaderboards.update_points({"2": 1000, "3": 2000})
+    assert [(user.id, user.name, user.points) for user, _ in leaderboards.get("points", 5)] == [
+        ("3", "User3", 2000),
+        ("2", "User2", 1000),
+        ("1", "User1", 500),
+    ]
+
+
+def test_update_points_full_leaderboard(monkeypatch) -> None:
+    from pajbot.managers.leaderboard import LEADERBOARD_SIZE
+
+    users = [make_user(str(i), points=(i + 1) * 10) for i in range(LEADERBOARD_SIZE)]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"points": users[::-1]})
+    patch_db_users(monkeypatch, [make_user("poor"), make_user("rich")])
+    leaderboards.get("points", 1)
+
+    # Only users with more points than the last entry make it onto the leaderboard
+    leaderboards.update_points({"poor": 10, "rich": 15})
+    last = [(user.id, user.points) for user, _ in leaderboards.get("points", LEADERBOARD_SIZE)[-2:]]
+    assert last == [("1", 20), ("rich", 15)]
+    assert len(redis.data[leaderboards.get_key("points")]) == LEADERBOARD_SIZE
+    assert set(redis.data[leaderboards.get_entries_key("points")]) == set(redis.data[leaderboards.get_key("points")])
+
+    # Users on the leaderboard move as long as they stay ahead of the last entry
+    leaderboards.update_points({"50": 2000, "rich": 25})
+    assert refreshes == ["points"]
+    assert leaderboards.get("points", 1)[0][0].id == "50"
+
+    # Someone who is not on the leaderboard might take their place otherwise, so it's computed again
+    leaderboards.update_points({"rich": 0})
+    assert not redis.exists(leaderboards.get_key("points"))
+    leaderboards.get("points", 1)
+    assert refreshes == ["points", "points"]
+
+
+def make_stats(user_id, won, lost):
+    from pajbot.models.duel import UserDuelStats
+
+    user = make_user(user_id)
+    stats = UserDuelStats()
+    stats.user_id = user_id
+    stats.duels_won = won
+    stats.duels_total = won + lost
+    stats.points_won = won * 10
+    stats.points_lost = lost * 10
+    user._duel_stats = stats
+    return user
+
+
+def test_update_duel_stats(monkeypatch) -> None:
+    from pajbot.managers.leaderboard import LEADERBOARD_SIZE
+
+    users = [make_stats(str(i), i, 1) for i in range(LEADERBOARD_SIZE)]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"duel_won": [user.duel_stats for user in users[::-1]]})
+    leaderboards.get("duel_won", 1)
+
+    winner, loser = make_stats("winner", 1000, 0), make_stats("loser", 0, 10)
+    leaderboards.update_duel_stats([winner, loser])
+
+    top = leaderboards.get("duel_won", 2)
+    assert [(stats.user.login, stats.duels_won, rank) for stats, rank in top] == [
+        ("userwinner", 1000, 1),
+        (f"user{LEADERBOARD_SIZE - 1}", LEADERBOARD_SIZE - 1, 2),
+    ]
+    assert len(redis.data[leaderboards.get_key("duel_won")]) == LEADERBOARD_SIZE
+    assert set(redis.data[leaderboards.get_entries_key("duel_won")]) == set(
+        redis.data[leaderboards.get_key("duel_won")]
+    )
+
+    # Leaderboards that were not computed yet are left alone
+    assert not redis.exists(leaderboards.get_key("duel_winrate"))
+
+
+def test_update_duel_stats_after_commit(monkeypatch) -> None:
+    from sqlalchemy.orm import Session
+
+    users = [make_stats("1", 10, 0), make_stats("2", 5, 0)]
+    leaderboards, redis, refreshes = make_manager(monkeypatch, {"duel_won": [user.duel_stats for user in users]})
+    leaderboards.get("duel_won", 1)
+
+    winner = make_stats("3", 20, 0)
+    with Session() as db_session:
+        leaderboards.update_duel_stats([winner], db_session)
+        db_session.rollback()
+    assert [stats.user.id for stats, _ in leaderboards.get("duel_won", 5)] == ["1", "2"]
+
+    with Session() as db_session:
+        leaderboards.update_duel_stats([winner], db_session)
+        assert [stats.user.id for stats, _ in leaderboards.get("duel_won", 5)] == ["1", "2"]
+        db_session.commit()
+    assert [stats.user.id for stats, _ in leaderboards.get("duel_won", 5)] == ["3", "1", "2"]
+
+    # The leaderboard has every entry, so losing the last spot is fine
+    leaderboards.update_duel_stats([make_stats("2", 1, 0)])
+    assert [(stats.user.id, stats.duels_won) for stats, _ in leaderboards.get("duel_won", 5)] == [
+        ("3", 20),
+        ("1", 10),
+        ("2", 1),
+    ]
+    assert refreshes == ["duel_won"]
@@ -0,0 +1,115 @@
+import codecs
+import threading
+
+
+def test_link_extractor_across_chunks() -> None:
+    from pajbot.modules.linkchecker import LinkExtractor
+
+    page = (
+        '<html><body>ä <a href="https://pajlada.se/ö">x</a><a href="//forsen.tv">y</a><a href="/relative">z</a></body>'
+    )
+    data = page.encode("utf-8")
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    extractor = LinkExtractor()
+    # Split inside tags and inside multi-byte characters
+    for i in range(0, len(data), 7):
+        extractor.feed(decoder.decode(data[i : i + 7]))
+    extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+
+    assert extractor.urls == ["https://pajlada.se/ö", "http://forsen.tv"]
+
+
+def test_safe_browsing_batcher_combines_lookups() -> None:
+    from pajbot.apiwrappers.safebrowsing import SafeBrowsingBatcher
+
+    class FakeAPI:
+        def __init__(self) -> None:
+            self.calls: list[list[str]] = []
+
+        def get_bad_urls(self, urls: list[str]) -> set[str]:
+            self.calls.append(sorted(urls))
+            return {url for url in urls if "bad" in url}
+
+    api = FakeAPI()
+    batcher = SafeBrowsingBatcher(api, max_delay=0.2)  # type: ignore[arg-type]
+    results: dict[str, set[str]] = {}
+
+    def lookup(name: str, urls: list[str]) -> None:
+        results[name] = batcher.get_bad_urls(urls)
+
+    threads = [
+        threading.Thread(target=lookup, args=("a", ["http://bad.com", "http://good.com"])),
+        threading.Thread(target=lookup, args=("b", ["http://good.com/2", "http://bad.com/2"])),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert api.calls == [["http://bad.com", "http://bad.com/2", "http://good.com", "http://good.com/2"]]
+    assert results == {"a": {"http://bad.com"}, "b": {"http://bad.com/2"}}
+
+
+def test_cache_evict_domain() -> None:
+    import fnmatch
+    from unittest.mock import patch
+
+    from pajbot.modules.linkchecker import LinkCheckerCache
+
+    class FakeRedis:
+        def __init__(self) -> None:
+            self.data: dict[str, str] = {}
+
+        def setex(self, key: str, ttl: int, value: str) -> None:
+            self.data[key] = value
+
+        def scan_iter(self, match: str, count: int) -> list[str]:
+            return [key for key in self.data if fnmatch.fnmatchcase(key, match)]
+
+        def delete(self, *keys: str) -> None:
+            for key in keys:
+                del self.data[key]
+
+    redis = FakeRedis()
+    with (
+        patch("pajbot.modules.linkchecker.RedisManager.get", return_value=redis),
+        patch("pajbot.modules.linkchecker.StreamHelper.get_streamer", return_value="streamer"),
+    ):
+        cache = LinkCheckerCache()
+        for url in ["http://bad.com/a", "https://www.bad.com", "http://sub.bad.com/b", "http://notbad.com"]:
+            cache.set(url, False, 3600)
+
+        cache.evict_domain("bad.com")
+
+        assert list(cache.entries) == ["http://notbad.com"]
+        assert list(redis.data) == ["streamer:linkchecker:verdict:http://notbad.com"]
+
+
+def test_executors_follow_enable_and_disable() -> None:
+    from unittest.mock import MagicMock, patch
+
+    from pajbot.modules.linkchecker import LinkCheckerModule
+
+    module = LinkCheckerModule(None)  # type: ignore[arg-type]
+    module.db_session = MagicMock()
+    bot = MagicMock()
+    with (
+        patch("pajbot.modules.linkchecker.HandlerManager"),
+        patch("pajbot.managers.handler.HandlerManager"),
+        patch("pajbot.modules.linkchecker.DBManager"),
+    ):
+        module.enable(bot)
+        analysis_executor = module.analysis_executor
+        assert analysis_executor is not None
+        assert module.sublink_executor is not None
+
+        module.disable(bot)
+        assert module.analysis_executor is None
+        assert module.sublink_executor is None
+        assert analysis_executor._shutdown
+
+        # Nothing is queued up while the module is disabled
+        module.queue_analysis("http://example.com", lambda: None)
+        assert module.pending_analyses == {}
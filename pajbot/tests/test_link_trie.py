@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+
+def links():
+    from pajbot.modules.linkchecker import BlacklistedLink
+
+    return [
+        BlacklistedLink("pajlada.se", "/", 0),
+        BlacklistedLink("www.forsen.tv", "/a", 1),
+        BlacklistedLink("test.example.com", "/a/b/", 0),
+        BlacklistedLink("example.com", "/c", 1),
+        BlacklistedLink("example.com", "", 0),
+        BlacklistedLink("se", "/x", 1),
+    ]
+
+
+DOMAINS = [
+    "pajlada.se",
+    "www.pajlada.se",
+    "pajlada.com",
+    "forsen.tv",
+    "a.forsen.tv",
+    "example.com",
+    "test.example.com",
+    "xtest.example.com",
+    "foo.se",
+]
+PATHS = ["/", "/a", "/a/", "/ab", "/a/b", "/a/b/c", "/c", "/c/d", "/x", "/xy"]
+
+
+@pytest.mark.parametrize("domain,path", itertools.product(DOMAINS, PATHS))
+def test_link_trie_same_as_linear(domain: str, path: str) -> None:
+    from pajbot.modules.linkchecker import BlacklistedLink, LinkTrie
+
+    all_links = links()
+    trie: LinkTrie[BlacklistedLink] = LinkTrie()
+    for link in all_links:
+        trie.add(link)
+
+    expected = {id(link) for link in all_links if link.is_subdomain(domain) and link.is_subpath(path)}
+    assert {id(link) for link in trie.matches(domain, path)} == expected
+
+
+def test_link_trie_remove() -> None:
+    from pajbot.modules.linkchecker import BlacklistedLink, LinkTrie
+
+    all_links = links()
+    trie: LinkTrie[BlacklistedLink] = LinkTrie()
+    for link in all_links:
+        trie.add(link)
+    assert len(trie) == len(all_links)
+
+    trie.remove(all_links[0])
+    assert list(trie.matches("pajlada.se", "/")) == []
+    assert len(trie) == len(all_links) - 1
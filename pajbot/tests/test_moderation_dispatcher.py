@@ -0,0 +1,82 @@
+import threading
+from unittest.mock import Mock
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.calls: list[tuple] = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.twitch_helix_api = Mock()
+        self.twitch_helix_api.get_user_id.return_value = "1234"
+
+    def _ban(self, user_id, reason=None):
+        self.release.wait(5)
+        self.calls.append(("ban", user_id, reason))
+
+    def _timeout(self, user_id, duration, reason=None):
+        self.started.set()
+        self.release.wait(5)
+        self.calls.append(("timeout", user_id, duration, reason))
+
+    def _unban(self, user_id):
+        self.calls.append(("unban", user_id))
+
+    def _untimeout(self, user_id):
+        self.calls.append(("untimeout", user_id))
+
+
+def make_dispatcher(bot, **options):
+    from pajbot.managers.moderation_dispatcher import ModerationDispatcher
+
+    config = {"main": {"moderation_workers": "2", **options}}
+    return ModerationDispatcher(bot, config)
+
+
+def test_merge_moderation_actions() -> None:
+    from pajbot.models.moderation_action import Ban, Timeout, Unban, Untimeout, merge_moderation_actions
+
+    assert merge_moderation_actions(Timeout(10, "a"), Timeout(20, "b")) == Timeout(20, "a + b")
+    assert merge_moderation_actions(Timeout(10, "a"), Ban("b")) == Ban("b")
+    assert merge_moderation_actions(Ban("a"), Timeout(10, "b")) == Ban("a")
+    assert merge_moderation_actions(Untimeout(), Unban()) == Unban()
+    assert merge_moderation_actions(Ban("a"), Unban()) is None
+    assert merge_moderation_actions(Unban(), Timeout(10, None)) is None
+
+
+def test_dispatcher_merges_and_keeps_order() -> None:
+    from pajbot.models.moderation_action import Ban, Timeout, Unban
+
+    bot = FakeBot()
+    dispatcher = make_dispatcher(bot)
+
+    # Keep the worker busy with the first timeout so the others are queued behind it
+    dispatcher.submit("pajlada", Timeout(10, None), "1")
+    assert bot.started.wait(5)
+    dispatcher.submit("pajlada", Timeout(30, "spam"), "1")
+    dispatcher.submit("pajlada", Ban("bad"), "1")
+    dispatcher.submit("pajlada", Unban(), "1")
+    assert dispatcher.pending["pajlada"].actions == [Ban("bad"), Unban()]
+    bot.release.set()
+    dispatcher.stop()
+
+    assert bot.calls == [("timeout", "1", 10, None), ("ban", "1", "bad"), ("unban", "1")]
+    assert dispatcher.stats()["executed"] == 3
+
+
+def test_dispatcher_deduplicates() -> None:
+    from pajbot.models.moderation_action import Ban, Timeout
+
+    bot = FakeBot()
+    bot.release.set()
+    dispatcher = make_dispatcher(bot, moderation_dedupe_window="60")
+
+    dispatcher.submit("pajlada", Ban(None))
+    dispatcher.stop()
+    dispatcher = make_dispatcher(bot, moderation_dedupe_window="60")
+    dispatcher.recent["pajlada"] = (Ban(None), 0.0)
+
+    assert dispatcher._is_duplicate("pajlada", Timeout(600, None), 30.0)
+    assert dispatcher._is_duplicate("pajlada", Ban("again"), 30.0)
+    assert not dispatcher._is_duplicate("pajlada", Ban(None), 61.0)
+    assert bot.calls == [("ban", "1234", None)]
@@ -0,0 +1,161 @@
+import pytest
+
+
+class FakeSession:
+    """Executes the ledger statements against a dict of user ID -> points"""
+
+    def __init__(self, points):
+        self.points = points
+        self.statements = []
+        self.identity_map = {}
+        self.info = {}
+        self.listeners = []
+
+    def commit(self):
+        self._end("after_commit")
+
+    def rollback(self):
+        self._end("after_rollback")
+
+    def _end(self, identifier):
+        listeners = [listener for listener in self.listeners if listener[0] == identifier]
+        self.listeners = [listener for listener in self.listeners if listener[0] != identifier]
+        for _, fn in listeners:
+            fn(self)
+
+    def execute(self, statement, params):
+        self.statements.append((str(statement), params))
+        rows = []
+        for user_id, delta in zip(params["user_ids"], params["deltas"]):
+            if user_id in self.points:
+                self.points[user_id] += delta
+                rows.append((user_id, self.points[user_id], delta))
+        return rows
+
+
+class FakeUserCache:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, user_ids=None):
+        self.invalidated.extend(user_ids)
+
+
+@pytest.fixture(autouse=True)
+def fake_session_events(monkeypatch):
+    from sqlalchemy import event
+
+    listen = event.listen
+
+    def fake_listen(target, identifier, fn, *args, **kwargs):
+        if not isinstance(target, FakeSession):
+            return listen(target, identifier, fn, *args, **kwargs)
+
+        target.listeners.append((identifier, fn))
+
+    monkeypatch.setattr(event, "listen", fake_listen)
+
+
+def test_apply_is_a_single_statement():
+    from pajbot.managers.points_ledger import PointsLedger
+
+    user_cache = FakeUserCache()
+    ledger = PointsLedger(user_cache)
+    db_session = FakeSession({str(i): 100 for i in range(200)})
+
+    balances = ledger.credit(db_session, [str(i) for i in range(200)] + ["missing"], 50, "multiraffle")
+    assert len(db_session.statements) == 1
+    assert "unnest" in db_session.statements[0][0]
+    assert "user_points_ledger" not in db_session.statements[0][0]
+    assert balances == {str(i): 150 for i in range(200)}
+    db_session.commit()
+    assert len(user_cache.invalidated) == 200
+
+    # Deltas for the same user are summed up, and users whose points don't change are skipped
+    assert ledger.apply(db_session, [("1", -150), ("2", 10), ("1", 100), ("3", 0)], "givepoints") == {
+        "1": 100,
+        "2": 160,
+    }
+    assert db_session.statements[1][1]["user_ids"] == ["1", "2"]
+    assert db_session.statements[1][1]["deltas"] == [-50, 10]
+
+    assert ledger.apply(db_session, {"1": 0}, "nothing") == {}
+    assert len(db_session.statements) == 2
+
+
+def test_audit():
+    from pajbot.managers.points_ledger import PointsLedger
+
+    db_session = FakeSession({"1": 100})
+    PointsLedger(audit=True).apply(db_session, {"1": -60}, "bet")
+    assert "INSERT INTO user_points_ledger" in db_session.statements[0][0]
+    assert db_session.statements[0][1]["reason"] == "bet"
+
+
+def test_users_in_session_are_updated():
+    from pajbot.managers.points_ledger import PointsLedger
+    from pajbot.models.user import User
+
+    from sqlalchemy import inspect
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    winner = User()
+    set_committed_value(winner, "id", "1")
+    set_committed_value(winner, "points", 100)
+    loser = User()
+    set_committed_value(loser, "id", "2")
+    set_committed_value(loser, "points", 100)
+    # Not written yet, has to be kept
+    loser.points -= 30
+
+    db_session = FakeSession({"1": 100, "2": 100})
+    db_session.identity_map = {"1": winner, "2": loser}
+    PointsLedger().apply(db_session, {"1": 50, "2": -50}, "duel")
+
+    assert winner.points == 150
+    assert not inspect(winner).attrs.points.history.has_changes()
+    assert loser.points == 20
+    assert inspect(loser).attrs.points.history.deleted == [50]
+
+
+def test_caches_are_updated_after_commit():
+    from pajbot.managers.points_ledger import PointsLedger
+    from pajbot.models.user import User
+
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    class FakeLeaderboards:
+        def __init__(self):
+            self.balances = []
+
+        def update_points(self, balances):
+            self.balances.append(balances)
+
+    user_cache = FakeUserCache()
+    leaderboards = FakeLeaderboards()
+    ledger = PointsLedger(user_cache, leaderboards=leaderboards)  # type: ignore[arg-type]
+
+    db_session = FakeSession({"1": 100, "2": 100})
+    ledger.apply(db_session, {"1": 10}, "raffle")
+    ledger.apply(db_session, {"1": 10, "2": 5}, "raffle")
+    # Other sessions can still read the old balances until the changes are committed
+    assert user_cache.invalidated == []
+    assert leaderboards.balances == []
+
+    db_session.commit()
+    assert sorted(user_cache.invalidated) == ["1", "2"]
+    assert leaderboards.balances == [{"1": 120, "2": 105}]
+
+    # Rolled back changes are forgotten
+    ledger.apply(db_session, {"1": 10}, "raffle")
+    db_session.rollback()
+    db_session.commit()
+    assert len(user_cache.invalidated) == 2
+    assert len(leaderboards.balances) == 1
+
+    # Users from other sessions are updated too, if they are passed
+    source = User()
+    set_committed_value(source, "id", "2")
+    set_committed_value(source, "points", 105)
+    ledger.apply(db_session, {"2": -5}, "givepoints", users=[source])
+    assert source.points == 100
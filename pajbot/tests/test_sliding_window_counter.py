@@ -0,0 +1,40 @@
+from pajbot.utils import SlidingWindowCounter
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_counts_expire_after_window() -> None:
+    clock = FakeClock()
+    counter = SlidingWindowCounter(60, clock=clock)
+
+    assert counter.get("Kappa") is None
+    assert counter.add("Kappa", 2) == 2
+    clock.now += 30
+    assert counter.add("Kappa", 3) == 5
+    assert counter.add("Kappa") == 6
+
+    clock.now += 30
+    # The first 2 were counted exactly 60 seconds ago
+    assert counter.get("Kappa") == 4
+
+    clock.now += 29.5
+    assert counter.get("Kappa") == 4
+    clock.now += 0.5
+    assert counter.get("Kappa") == 0
+
+
+def test_long_gap_resets_counter() -> None:
+    clock = FakeClock()
+    counter = SlidingWindowCounter(60, clock=clock)
+
+    counter.add("Kappa", 10)
+    clock.now += 1000
+    assert counter.get("Kappa") == 0
+    assert counter.add("Kappa") == 1
+    assert counter.get("PogChamp") is None
@@ -0,0 +1,57 @@
+from pajbot.utils import SlidingWindowRateLimit
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def send_as_fast_as_allowed(rate_limit: SlidingWindowRateLimit, clock: FakeClock, num_messages: int) -> list[float]:
+    sent = []
+    for _ in range(num_messages):
+        clock.now += rate_limit.time_until_available()
+        assert rate_limit.try_acquire()
+        sent.append(clock.now)
+    return sent
+
+
+def test_never_more_than_limit_per_period() -> None:
+    from pajbot.tmi import TMIRateLimits
+
+    clock = FakeClock()
+    limit = TMIRateLimits.BASE.privmsg_per_30
+    rate_limit = SlidingWindowRateLimit(limit, 30, clock=clock)
+
+    sent = send_as_fast_as_allowed(rate_limit, clock, limit // 2)
+    # After a quiet period, only the full limit is allowed, not a burst on top of it
+    clock.now += 600
+    sent += send_as_fast_as_allowed(rate_limit, clock, limit * 3)
+    clock.now += 10
+    sent += send_as_fast_as_allowed(rate_limit, clock, limit)
+
+    for start in sent:
+        assert len([at for at in sent if start <= at < start + 30]) <= limit
+
+    # The limit is still reached, it's not enforced by slowing down every message
+    assert len([at for at in sent if sent[-1] - 30 < at <= sent[-1]]) == limit
+
+
+def test_time_until_available() -> None:
+    clock = FakeClock()
+    rate_limit = SlidingWindowRateLimit(2, 30, clock=clock)
+
+    assert rate_limit.try_acquire()
+    clock.now += 10
+    assert rate_limit.try_acquire()
+    assert not rate_limit.try_acquire()
+    assert rate_limit.time_until_available() == 20
+
+    clock.now += 20
+    assert rate_limit.time_until_available() == 0
+    assert rate_limit.try_acquire()
+    assert not rate_limit.try_acquire()
+    assert rate_limit.time_until_available() == 10
+    assert not rate_limit.acquire(timeout=0)
@@ -0,0 +1,138 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, None)
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+
+class Server:
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                server.release.wait(5)
+                if self.path == "/missing":
+                    body = b"<html>404</html>"
+                    self.send_response(404)
+                    self.send_header("Content-Type", "text/html")
+                else:
+                    body = f"  hello from\n{self.path}  ".encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def test_fetch_coalesces_and_caches():
+    from pajbot.managers.urlfetch import URLFetcher
+
+    server = Server()
+    redis = FakeRedis()
+    fetcher = URLFetcher(redis, "streamer", "pajbot-test", cache_ttl=60)  # type: ignore[arg-type]
+    try:
+        futures = [fetcher.fetch(server.url("/a")) for _ in range(10)]
+        server.release.set()
+        assert [future.result(5) for future in futures] == ["hello from/a"] * 10
+        assert server.requests == ["/a"]
+        assert redis.data == {f"streamer:urlfetch:{server.url('/a')}": "hello from/a"}
+
+        # Served from the cache
+        assert fetcher.fetch(server.url("/a")).result(5) == "hello from/a"
+        assert server.requests == ["/a"]
+
+        # Errors are not cached
+        assert fetcher.fetch(server.url("/missing")).result(5) == "urlfetch error 404"
+        assert len(redis.data) == 1
+    finally:
+        fetcher.stop()
+        server.close()
+
+
+def test_fetch_all():
+    from pajbot.managers.urlfetch import URLFetcher
+
+    server = Server()
+    fetcher = URLFetcher(FakeRedis(), "streamer", "pajbot-test")  # type: ignore[arg-type]
+    results = []
+    done = threading.Event()
+
+    def callback(values):
+        results.append(values)
+        done.set()
+
+    try:
+        fetcher.fetch_all([server.url("/a"), server.url("/b"), server.url("/a")], callback)
+        # Both requests are made before either of them is answered
+        deadline = time.monotonic() + 5
+        while len(server.requests) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not done.is_set()
+        server.release.set()
+        assert done.wait(5)
+        assert sorted(server.requests) == ["/a", "/b"]
+        assert results == [{server.url("/a"): "hello from/a", server.url("/b"): "hello from/b"}]
+    finally:
+        fetcher.stop()
+        server.close()
+
+
+def test_urlfetch_msg_keeps_chat_priority():
+    from pajbot.managers.chat_queue import chat_priority_scope
+    from pajbot.models.action import urlfetch_msg
+    from pajbot.tmi import ChatPriority
+
+    class FakeURLFetcher:
+        def fetch_all(self, urls, callback):
+            # Called back from another thread, like the URLFetcher pool
+            thread = threading.Thread(target=callback, args=({url: "fetched" for url in urls},))
+            thread.start()
+            thread.join()
+
+    class FakeBot:
+        def __init__(self):
+            self.thread_locals = threading.local()
+            self.urlfetcher = FakeURLFetcher()
+            self.sent = []
+
+        def get_chat_priority(self):
+            priority = getattr(self.thread_locals, "chat_priority", None)
+            return ChatPriority.COMMAND if priority is None else priority
+
+        def say(self, message):
+            self.sent.append((message, self.get_chat_priority()))
+
+    # e.g. a timer
+    bot = FakeBot()
+    with chat_priority_scope(bot, ChatPriority.ANNOUNCEMENT):  # type: ignore[arg-type]
+        priority = bot.get_chat_priority()
+
+    urlfetch_msg(bot.say, "value: $(urlfetch http://example.com)", 1, bot, priority=priority)
+    assert bot.sent == [("value: fetched", ChatPriority.ANNOUNCEMENT)]
@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+
+import pytest
+
+
+class FakeSession:
+    def __init__(self, fail=None):
+        self.statements = []
+        self.fail = fail
+
+    def execute(self, statement, params):
+        if self.fail is not None:
+            self.fail()
+            raise RuntimeError("connection lost")
+        self.statements.append((str(statement), params))
+
+
+def make_user(user_id, points=100, num_lines=10, name=None):
+    """A user as it was loaded from the database, and is now detached from its session"""
+    from pajbot.models.user import User
+
+    from sqlalchemy.orm import make_transient_to_detached
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    user = User()
+    set_committed_value(user, "id", user_id)
+    set_committed_value(user, "_login", f"user{user_id}")
+    set_committed_value(user, "name", name or f"User{user_id}")
+    set_committed_value(user, "points", points)
+    set_committed_value(user, "num_lines", num_lines)
+    set_committed_value(user, "tokens", 0)
+    make_transient_to_detached(user)
+    return user
+
+
+@pytest.fixture
+def user_cache(monkeypatch):
+    from pajbot.managers.user_cache import UserCache
+    from pajbot.models.user import User
+
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    cache = UserCache({"main": {"user_cache_size": "2"}})
+    sessions = []
+
+    @contextmanager
+    def create_session_scope(**options):
+        yield sessions[-1]
+
+    monkeypatch.setattr("pajbot.managers.user_cache.DBManager.create_session_scope", create_session_scope)
+    yield cache, sessions
+    event.remove(Session, "after_flush", cache._on_after_flush)
+    event.remove(Session, "before_flush", cache._on_before_flush)
+    event.remove(Session, "after_flush_postexec", cache._on_after_flush_postexec)
+    event.remove(User, "load", cache._on_load)
+    event.remove(User, "refresh", cache._on_refresh)
+
+
+def attach(cache, monkeypatch, user):
+    from pajbot.models.user import UserBasics
+
+    def from_basics(db_session, basics):
+        # Like SQLAlchemy does when it loads the user from the database
+        cache._on_load(user, None)
+        return user
+
+    monkeypatch.setattr("pajbot.managers.user_cache.User.from_basics", from_basics)
+    return cache._attach(None, UserBasics(user.id, user.login, user.name))
+
+
+def test_counters_are_flushed_as_deltas(user_cache, monkeypatch) -> None:
+    from sqlalchemy import inspect
+
+    cache, sessions = user_cache
+    user = attach(cache, monkeypatch, make_user("1"))
+    user.points += 25
+    user.num_lines += 1
+    user.points -= 5
+    user.name = "NewName"
+
+    sessions.append(FakeSession())
+    cache.commit()
+
+    [(statement, params)] = sessions[-1].statements
+    assert '"user".points + ' in statement
+    assert '"user".num_lines + ' in statement
+    assert '"user".name + ' not in statement
+    assert params == [{"b_id": "1", "b_name": "NewName", "b_num_lines": 1, "b_points": 20}]
+    assert not inspect(user).attrs.points.history.has_changes()
+    assert user.points == 120
+    assert cache.pending == {}
+
+    # Nothing left to write
+    cache.commit()
+    assert len(sessions[-1].statements) == 1
+
+
+def test_stale_reload_keeps_pending_changes(user_cache, monkeypatch) -> None:
+    cache, sessions = user_cache
+    user = attach(cache, monkeypatch, make_user("1"))
+    user.points += 50
+    user.name = "NewName"
+
+    # Someone else changed the points in the database, the reloaded row does not have our changes yet
+    cache.invalidate(["1"])
+    reloaded = attach(cache, monkeypatch, make_user("1", points=1000))
+
+    assert reloaded is not user
+    assert reloaded.points == 1050
+    assert reloaded.name == "NewName"
+    assert cache.reloads == 1
+    assert cache.pending == {"1": {"points": 50, "name": "NewName"}}
+
+
+def test_evicted_users_are_stashed(user_cache, monkeypatch) -> None:
+    cache, sessions = user_cache
+    first = attach(cache, monkeypatch, make_user("1"))
+    first.points += 10
+    attach(cache, monkeypatch, make_user("2"))
+    first.num_lines += 1
+
+    # The cache only holds 2 users
+    attach(cache, monkeypatch, make_user("3"))
+    assert "1" not in cache.entries
+    assert cache.evictions == 1
+    assert cache.pending == {"1": {"points": 10, "num_lines": 1}}
+
+
+def test_failed_commit_is_merged_back(user_cache, monkeypatch) -> None:
+    cache, sessions = user_cache
+    user = attach(cache, monkeypatch, make_user("1"))
+    user.points += 10
+    user.name = "OldName"
+
+    def stash_in_the_meantime():
+        cache.pending["1"] = {"points": 5, "name": "NewerName"}
+
+    sessions.append(FakeSession(fail=stash_in_the_meantime))
+    cache.commit()
+
+    assert cache.flushes == 0
+    assert cache.pending == {"1": {"points": 15, "name": "NewerName"}}
+
+    sessions.append(FakeSession())
+    cache.commit()
+    assert sessions[-1].statements[0][1] == [{"b_id": "1", "b_name": "NewerName", "b_points": 15}]
+    assert cache.pending == {}
+
+
+def test_uncached_loads_get_pending_changes(user_cache, monkeypatch) -> None:
+    from sqlalchemy.orm.attributes import set_committed_value
+
+    cache, sessions = user_cache
+    cached = attach(cache, monkeypatch, make_user("1"))
+    cached.points -= 100
+    cache._stash(cached)
+
+    # e.g. the target of a duel, which is looked up with User.find_by_user_input
+    target = make_user("1")
+    cache._on_load(target, None)
+    assert target.points == 0
+
+    # The cached copy is in use by another session, so a second copy is loaded
+    set_committed_value(cached, "points", cached.points)
+    monkeypatch.setattr("pajbot.managers.user_cache.inspect", lambda user: FakeState(user is cached))
+    other = attach(cache, monkeypatch, make_user("1"))
+    assert other is not cached
+    assert other.points == 0
+    assert cache.entries["1"].user is cached
+
+
+class FakeState:
+    def __init__(self, in_session):
+        self.session_id = 1 if in_session else None
+
+
+def test_counters_are_written_as_deltas(user_cache) -> None:
+    from types import SimpleNamespace
+
+    from sqlalchemy import inspect
+
+    cache, sessions = user_cache
+    cache.pending["1"] = {"points": -100}
+    user = make_user("1")
+    cache._on_load(user, None)
+    assert user.points == 0
+    # e.g. an admin setting the points
+    user.points = 50
+    user.num_lines += 5
+    user.name = "NewName"
+
+    session = SimpleNamespace(dirty=[user], info={})
+    cache._on_before_flush(session, None, None)
+    assert str(inspect(user).attrs.points.history.added[0]) == '"user".points + :points_1'
+    assert str(inspect(user).attrs.num_lines.history.added[0]) == '"user".num_lines + :num_lines_1'
+    assert inspect(user).attrs.name.history.added == ["NewName"]
+
+    cache._on_after_flush_postexec(session, None)
+    assert (user.points, user.num_lines) == (50, 15)
+    assert not inspect(user).attrs.points.history.has_changes()
+    # The database has 50 once the pending change is written too
+    assert cache.pending == {"1": {"points": -100}}
@@ -0,0 +1,38 @@
+class FakeClock:
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeSession:
+    def __init__(self, counts):
+        self.counts = counts
+        self.statements = []
+
+    def scalar(self, statement):
+        self.statements.append(str(statement))
+        return self.counts.pop(0)
+
+
+def test_rank_is_counted_and_cached_by_value():
+    from pajbot.managers.user_rank import UserRankService
+    from pajbot.models.user import User
+
+    clock = FakeClock()
+    service = UserRankService(ttl=30, clock=clock)
+    db_session = FakeSession([41, 0, 9000, 45])
+
+    assert service.get_rank(db_session, User.points, 500) == 42
+    assert db_session.statements[0] == 'SELECT count(*) AS count_1 \nFROM "user" \nWHERE "user".points > :points_1'
+
+    # Same amount of points, same rank
+    assert service.get_rank(db_session, User.points, 500) == 42
+    assert service.get_rank(db_session, User.points, 100000) == 1
+    assert service.get_rank(db_session, User.num_lines, 500) == 9001
+    assert len(db_session.statements) == 3
+
+    clock.time += 31
+    assert service.get_rank(db_session, User.points, 500) == 46
+    assert (service.hits, service.misses) == (1, 4)
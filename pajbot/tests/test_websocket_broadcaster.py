@@ -0,0 +1,101 @@
+import json
+
+
+class FakeReactor:
+    def __init__(self):
+        self.calls = []
+
+    def callFromThread(self, fn, *args):
+        fn(*args)
+
+    def callLater(self, delay, fn):
+        self.calls.append(fn)
+
+    def run_pending(self):
+        calls, self.calls = self.calls, []
+        for fn in calls:
+            fn()
+
+
+class FakeClient:
+    def __init__(self):
+        self.messages = []
+
+    def sendMessage(self, payload, isBinary):
+        self.messages.append(payload)
+
+
+def emotes(*codes):
+    return {"emotes": [{"code": code} for code in codes], "opacity": 100, "persistence_time": 5000, "scale": 100}
+
+
+def test_coalesce_events():
+    from pajbot.managers.websocket import coalesce_events
+
+    assert coalesce_events(
+        [
+            ("new_emotes", emotes("Kappa")),
+            ("emote_combo", {"emote": "Kappa", "count": 3}),
+            ("notification", {"message": "hi"}),
+            ("new_emotes", emotes("Kappa", "PogChamp")),
+            ("emote_combo", {"emote": "Kappa", "count": 4}),
+            ("new_emotes", {**emotes("forsenE"), "scale": 200}),
+        ]
+    ) == [
+        ("new_emotes", emotes("Kappa", "Kappa", "PogChamp")),
+        ("notification", {"message": "hi"}),
+        ("emote_combo", {"emote": "Kappa", "count": 4}),
+        ("new_emotes", {**emotes("forsenE"), "scale": 200}),
+    ]
+
+
+def test_events_are_batched_into_one_frame():
+    from pajbot.managers.websocket import WebSocketBroadcaster
+
+    reactor = FakeReactor()
+    clients = [FakeClient(), FakeClient()]
+    broadcaster = WebSocketBroadcaster(reactor, clients)
+
+    for count in range(2, 6):
+        broadcaster.emit("new_emotes", emotes("Kappa"))
+        broadcaster.emit("emote_combo", {"emote": "Kappa", "count": count})
+    assert len(reactor.calls) == 1
+
+    reactor.run_pending()
+    assert len(clients[0].messages) == 1
+    # Serialized once for everyone
+    assert clients[0].messages[0] is clients[1].messages[0]
+    assert json.loads(clients[0].messages[0]) == [
+        {"event": "new_emotes", "data": emotes("Kappa", "Kappa", "Kappa", "Kappa")},
+        {"event": "emote_combo", "data": {"emote": "Kappa", "count": 5}},
+    ]
+
+    # A single event is sent as is
+    broadcaster.emit("refresh", {})
+    reactor.run_pending()
+    assert json.loads(clients[0].messages[1]) == {"event": "refresh", "data": {}}
+    assert (broadcaster.num_events, broadcaster.num_frames) == (9, 2)
+
+
+def test_paused_clients_are_caught_up():
+    from pajbot.managers.websocket import MAX_CLIENT_BACKLOG, WebSocketBroadcaster
+
+    reactor = FakeReactor()
+    fast, slow = FakeClient(), FakeClient()
+    broadcaster = WebSocketBroadcaster(reactor, [fast, slow])
+
+    broadcaster.pause(slow)
+    for i in range(MAX_CLIENT_BACKLOG + 10):
+        broadcaster.emit("notification", {"message": str(i)})
+        reactor.run_pending()
+
+    assert len(fast.messages) == MAX_CLIENT_BACKLOG + 10
+    assert slow.messages == []
+    assert broadcaster.num_dropped == 10
+
+    broadcaster.resume(slow)
+    assert slow.messages == fast.messages[10:]
+
+    broadcaster.emit("refresh", {})
+    reactor.run_pending()
+    assert slow.messages[-1] == fast.messages[-1]
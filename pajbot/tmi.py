@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class ChatOutputMode(Enum):
@@ -17,6 +17,14 @@ class ChatOutputMode(Enum):
             )
 
 
+class ChatPriority(IntEnum):
+    """Lanes of the outgoing chat queue. Lower values are sent first"""
+
+    MODERATION = 0
+    COMMAND = 1
+    ANNOUNCEMENT = 2
+
+
 class WhisperOutputMode(Enum):
     DISABLED = 0
     NORMAL = 1
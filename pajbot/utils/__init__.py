@@ -1,7 +1,9 @@
+from .aho_corasick import AhoCorasick
 from .benchmark import benchmark
 from .clean_up_message import clean_up_message
 from .datetime_from_utc_milliseconds import datetime_from_utc_milliseconds
 from .dump_threads import dump_threads
+from .emoji_matcher import EmojiMatcher
 from .extend_version_with_git_data import extend_version_if_possible, extend_version_with_git_data
 from .find import find
 from .get_class_that_defined_method import get_class_that_defined_method
@@ -16,17 +18,23 @@ from .parse_number_from_string import parse_number_from_string
 from .parse_points_amount import parse_points_amount
 from .print_traceback import print_traceback
 from .remove_none_values import remove_none_values
+from .single_flight import SingleFlight
+from .sliding_window_counter import SlidingWindowCounter
+from .sliding_window_rate_limit import SlidingWindowRateLimit
 from .split_into_chunks_with_prefix import split_into_chunks_with_prefix
 from .time_ago import time_ago
 from .time_limit import time_limit
 from .time_method import time_method
 from .time_since import time_since
+from .token_bucket import TokenBucket
 from .wait_for_redis_data_loaded import wait_for_redis_data_loaded
 
 __all__ = [
+    "AhoCorasick",
     "clean_up_message",
     "datetime_from_utc_milliseconds",
     "dump_threads",
+    "EmojiMatcher",
     "benchmark",
     "extend_version_if_possible",
     "extend_version_with_git_data",
@@ -43,10 +51,14 @@ __all__ = [
     "parse_points_amount",
     "print_traceback",
     "remove_none_values",
+    "SingleFlight",
+    "SlidingWindowCounter",
+    "SlidingWindowRateLimit",
     "split_into_chunks_with_prefix",
     "time_ago",
     "time_limit",
     "time_method",
     "time_since",
+    "TokenBucket",
     "wait_for_redis_data_loaded",
 ]
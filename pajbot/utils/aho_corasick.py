@@ -0,0 +1,89 @@
+from typing import Generic, Iterator, TypeVar
+
+from collections import deque
+
+T = TypeVar("T")
+
+
+class AhoCorasick(Generic[T]):
+    """
+    Finds all occurrences of many words in a text in a single pass over the text.
+    Each added word carries a value that is returned alongside its matches.
+
+    matcher = AhoCorasick()
+    matcher.add("he", 1)
+    matcher.add("she", 2)
+    list(matcher.iter_matches("ushe")) == [(1, 4, 2), (2, 4, 1)]
+    """
+
+    def __init__(self) -> None:
+        # goto[node] maps the next character to the child node
+        self.goto: list[dict[str, int]] = [{}]
+        # fail[node] is the node for the longest proper suffix of node's path that is also in the trie
+        self.fail: list[int] = [0]
+        # own[node] is the list of (word length, value) for every word ending exactly at node
+        self.own: list[list[tuple[int, T]]] = [[]]
+        # out[node] is own[node] plus the words ending at node's failure nodes, i.e. all words that match there
+        self.out: list[list[tuple[int, T]]] = [[]]
+        self.built = True
+
+    def add(self, word: str, value: T) -> None:
+        if not word:
+            raise ValueError("Cannot add an empty word")
+
+        node = 0
+        for ch in word:
+            next_node = self.goto[node].get(ch, None)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.own.append([])
+                self.out.append([])
+                self.goto[node][ch] = next_node
+            node = next_node
+
+        self.own[node].append((len(word), value))
+        self.built = False
+
+    def build(self) -> None:
+        # Breadth-first walk, so the failure node of every node is computed before its children
+        queue: deque[int] = deque()
+        for child in self.goto[0].values():
+            self.fail[child] = 0
+            self.out[child] = self.own[child]
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(ch, 0)
+                if fail == child:
+                    fail = 0
+                self.fail[child] = fail
+                self.out[child] = self.own[child] + self.out[fail]
+                queue.append(child)
+
+        self.built = True
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int, T]]:
+        """Yields (start, end, value) for every occurrence of every word in text, ordered by end index"""
+        if not self.built:
+            self.build()
+
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                end = i + 1
+                for length, value in out[node]:
+                    yield end - length, end, value
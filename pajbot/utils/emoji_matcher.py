@@ -0,0 +1,86 @@
+from typing import Iterable, Iterator
+
+import re
+
+# Marks the end of an emoji in the trie
+_END = ""
+
+
+def _char_ranges(chars: Iterable[str]) -> Iterator[str]:
+    """Turns the characters into the parts of a regex character class, merging consecutive code points into ranges.
+    The re module looks through a class range by range, so this is a lot faster than listing each character"""
+    code_points = sorted(ord(ch) for ch in chars)
+    i = 0
+    while i < len(code_points):
+        j = i
+        while j + 1 < len(code_points) and code_points[j + 1] == code_points[j] + 1:
+            j += 1
+
+        if i == j:
+            yield re.escape(chr(code_points[i]))
+        else:
+            yield f"{re.escape(chr(code_points[i]))}-{re.escape(chr(code_points[j]))}"
+        i = j + 1
+
+
+class EmojiMatcher:
+    """
+    Finds emoji in messages in a single pass.
+
+    Candidate positions are found with a compiled character class of all characters an emoji can start with,
+    so messages without any such character (i.e. most of them) never leave the regex engine.
+    At each candidate the longest emoji starting there is looked up in a trie.
+    """
+
+    def __init__(self, all_emoji: Iterable[str]) -> None:
+        self.trie: dict[str, dict] = {}
+        for emoji in all_emoji:
+            if not emoji:
+                continue
+
+            node = self.trie
+            for ch in emoji:
+                node = node.setdefault(ch, {})
+            node[_END] = {}
+
+        self.first_chars = re.compile("[" + "".join(_char_ranges(self.trie)) + "]")
+
+    def _match_at(self, message: str, start: int) -> int:
+        """Returns the end index of the longest emoji starting at start, or -1 if there is none"""
+        node = self.trie
+        end = -1
+        for i in range(start, len(message)):
+            next_node = node.get(message[i], None)
+            if next_node is None:
+                break
+            node = next_node
+            if _END in node:
+                end = i + 1
+
+        return end
+
+    def iter_spans(self, message: str) -> Iterator[tuple[int, int]]:
+        """Yields (start, end) of all emoji in the message, left to right. Overlapping emoji are matched longest first"""
+        pos = 0
+        search = self.first_chars.search
+        while True:
+            candidate = search(message, pos)
+            if candidate is None:
+                return
+
+            start = candidate.start()
+            end = self._match_at(message, start)
+            if end == -1:
+                pos = start + 1
+            else:
+                yield start, end
+                pos = end
+
+    def spans(self, message: str) -> list[tuple[int, int]]:
+        return list(self.iter_spans(message))
+
+    def contains(self, message: str) -> bool:
+        return next(self.iter_spans(message), None) is not None
+
+    def count(self, message: str) -> int:
+        return sum(1 for _ in self.iter_spans(message))
@@ -0,0 +1,66 @@
+from typing import Callable, Optional
+
+import time
+
+
+class _Window:
+    __slots__ = ("buckets", "total", "last_second")
+
+    def __init__(self, num_buckets: int, now: int) -> None:
+        self.buckets = [0] * num_buckets
+        self.total = 0
+        self.last_second = now
+
+
+class SlidingWindowCounter:
+    """
+    Counts events per key over the last `window` seconds, using a ring buffer of one-second buckets per key.
+    Adding to and reading a count is O(1) (amortized), and counts expire without any scheduled jobs.
+
+    Not thread-safe.
+    """
+
+    def __init__(self, window: int = 60, clock: Callable[[], float] = time.monotonic) -> None:
+        self.window = window
+        self.clock = clock
+        self.windows: dict[str, _Window] = {}
+
+    def _advance(self, counter: _Window, now: int) -> None:
+        """Clear the buckets of the seconds that have passed since the counter was last touched"""
+        elapsed = now - counter.last_second
+        if elapsed <= 0:
+            return
+
+        if elapsed >= self.window:
+            counter.buckets = [0] * self.window
+            counter.total = 0
+        else:
+            buckets = counter.buckets
+            for second in range(counter.last_second + 1, now + 1):
+                index = second % self.window
+                counter.total -= buckets[index]
+                buckets[index] = 0
+
+        counter.last_second = now
+
+    def add(self, key: str, amount: int = 1) -> int:
+        """Adds amount to the count of the given key, and returns the count in the current window"""
+        now = int(self.clock())
+        counter = self.windows.get(key, None)
+        if counter is None:
+            counter = self.windows[key] = _Window(self.window, now)
+        else:
+            self._advance(counter, now)
+
+        counter.buckets[now % self.window] += amount
+        counter.total += amount
+        return counter.total
+
+    def get(self, key: str) -> Optional[int]:
+        """Returns the count of the given key in the current window, or None if the key has never been counted"""
+        counter = self.windows.get(key, None)
+        if counter is None:
+            return None
+
+        self._advance(counter, int(self.clock()))
+        return counter.total
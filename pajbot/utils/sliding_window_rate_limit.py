@@ -0,0 +1,61 @@
+from typing import Callable, Optional
+
+import threading
+import time
+from collections import deque
+
+
+class SlidingWindowRateLimit:
+    """
+    Thread-safe rate limiter that allows at most `limit` acquisitions within any `period` seconds.
+    The times of the last `limit` acquisitions are kept, so unlike a token bucket,
+    a quiet period does not allow a burst on top of the acquisitions that are still within the window.
+    """
+
+    def __init__(self, limit: int, period: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.limit = limit
+        self.period = period
+        self.clock = clock
+        self.acquired_at: deque[float] = deque()
+        self.lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        while self.acquired_at and self.acquired_at[0] <= now - self.period:
+            self.acquired_at.popleft()
+
+    def try_acquire(self) -> bool:
+        """Acquire if that is allowed right now"""
+        with self.lock:
+            now = self.clock()
+            self._expire(now)
+            if len(self.acquired_at) >= self.limit:
+                return False
+
+            self.acquired_at.append(now)
+            return True
+
+    def time_until_available(self) -> float:
+        """Seconds until acquiring is allowed, 0 if it is allowed right now"""
+        with self.lock:
+            now = self.clock()
+            self._expire(now)
+            if len(self.acquired_at) < self.limit:
+                return 0.0
+
+            return self.acquired_at[0] + self.period - now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Block until acquiring is allowed. Returns False if that did not happen within `timeout` seconds"""
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            if self.try_acquire():
+                return True
+
+            wait = self.time_until_available()
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            time.sleep(wait)
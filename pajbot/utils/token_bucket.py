@@ -0,0 +1,71 @@
+from typing import Optional
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    The bucket holds up to `capacity` tokens and is refilled at a rate of `capacity` tokens every `period` seconds.
+    """
+
+    def __init__(self, capacity: float, period: float) -> None:
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take `amount` tokens if they are available right now"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+
+            return False
+
+    def time_until_available(self, amount: float = 1) -> float:
+        """Seconds until `amount` tokens are available, 0 if they are available right now"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                return 0.0
+
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1, timeout: Optional[float] = None) -> bool:
+        """Block until `amount` tokens could be taken. Returns False if that did not happen within `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(amount):
+                return True
+
+            wait = self.time_until_available(amount)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            time.sleep(wait)
+
+    def update(self, remaining: float, reset_in: float) -> None:
+        """
+        Synchronize the bucket with a rate limit reported by a server,
+        e.g. through the Ratelimit-Remaining and Ratelimit-Reset headers of the Twitch API.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining < self.tokens:
+                self.tokens = remaining
+                if remaining <= 0 and reset_in > 0:
+                    # Nothing is refilled before the reset
+                    self.last_refill = now + reset_in
@@ -63,6 +63,7 @@ def init(app):
             MenuItem("/admin/modules", "admin_modules", "Modules"),
             MenuItem("/admin/playsounds", "admin_playsounds", "Playsounds"),
             MenuItem("/admin/streamer", "admin_streamer", "Streamer Info"),
+            MenuItem("/admin/handlers", "admin_handlers", "Event Handlers"),
         ]
 
         data = {
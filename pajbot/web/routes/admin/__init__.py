@@ -1,5 +1,6 @@
 import pajbot.web.routes.admin.banphrases
 import pajbot.web.routes.admin.commands
+import pajbot.web.routes.admin.handlers
 import pajbot.web.routes.admin.home
 import pajbot.web.routes.admin.links
 import pajbot.web.routes.admin.moderators
@@ -16,6 +17,7 @@ def init(app) -> None:
 
     pajbot.web.routes.admin.banphrases.init(page)
     pajbot.web.routes.admin.commands.init(page)
+    pajbot.web.routes.admin.handlers.init(page)
     pajbot.web.routes.admin.home.init(page)
     pajbot.web.routes.admin.links.init(page)
     pajbot.web.routes.admin.moderators.init(page)
@@ -0,0 +1,15 @@
+from pajbot.managers.handler import HandlerManager
+from pajbot.managers.redis import RedisManager
+from pajbot.streamhelper import StreamHelper
+from pajbot.web.utils import requires_level
+
+from flask import render_template
+from flask.typing import ResponseReturnValue
+
+
+def init(page) -> None:
+    @page.route("/handlers")
+    @requires_level(500)
+    def admin_handlers(**options) -> ResponseReturnValue:
+        handler_stats = HandlerManager.load_saved_stats(RedisManager.get(), StreamHelper.get_streamer())
+        return render_template("admin/handlers.html", handler_stats=handler_stats)
@@ -53,11 +53,11 @@ CommandUpdateSchema = marshmallow_dataclass.class_schema(CommandUpdate)
 def init(bp: Blueprint) -> None:
     @bp.route("/commands")
     def commands() -> ResponseReturnValue:
-        commands = pajbot.web.utils.get_cached_commands()
+        snapshot = pajbot.web.utils.get_cached_command_snapshot()
 
-        commands = list(filter(lambda c: c["id"] is not None, commands))
+        commands = list(filter(lambda c: c["id"] is not None, snapshot.commands))
 
-        return {"commands": commands}, 200
+        return pajbot.web.utils.make_conditional_response(({"commands": commands}, 200), snapshot.version)
 
     @bp.route("/commands/<raw_command_id>")
     def command_get(raw_command_id) -> ResponseReturnValue:
@@ -69,15 +69,17 @@ def init(bp: Blueprint) -> None:
         except (ValueError, TypeError):
             pass
 
+        snapshot = pajbot.web.utils.get_cached_command_snapshot()
+
         if command_id:
-            command = find(lambda c: c["id"] == command_id, pajbot.web.utils.get_cached_commands())
+            command = find(lambda c: c["id"] == command_id, snapshot.commands)
         else:
-            command = find(lambda c: c["resolve_string"] == command_string, pajbot.web.utils.get_cached_commands())
+            command = find(lambda c: c["resolve_string"] == command_string, snapshot.commands)
 
         if not command:
             return {"message": "A command with the given ID was not found."}, 404
 
-        return {"command": command}, 200
+        return pajbot.web.utils.make_conditional_response(({"command": command}, 200), snapshot.version)
 
     @bp.route("/commands/remove/<int:command_id>", methods=["POST"])
     @pajbot.web.utils.requires_level(500)
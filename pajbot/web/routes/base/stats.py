@@ -1,7 +1,5 @@
 import pajbot.web.utils
-from pajbot.managers.db import DBManager
-from pajbot.models.duel import UserDuelStats
-from pajbot.models.user import User
+from pajbot.managers.leaderboard import LeaderboardManager
 
 from flask import render_template
 
@@ -11,36 +9,34 @@ def init(app):
     def stats():
         bot_commands_list = pajbot.web.utils.get_cached_commands()
         top_100_emotes = pajbot.web.utils.get_top_emotes()
+        top_stream_emotes = pajbot.web.utils.get_top_stream_emotes()
         top_5_commands = sorted(
             bot_commands_list, key=lambda c: c["data"]["num_uses"] if c["data"] is not None else -1, reverse=True
         )[:5]
 
         # TODO: Make this hideable through some magic setting (NOT config.ini @_@)
-        with DBManager.create_session_scope() as db_session:
-            top_5_line_farmers = db_session.query(User).order_by(User.num_lines.desc()).limit(5).all()
-            return render_template(
-                "stats.html",
-                top_5_commands=top_5_commands,
-                top_5_line_farmers=top_5_line_farmers,
-                top_100_emotes=top_100_emotes,
-            )
+        top_5_line_farmers = [user for user, _ in LeaderboardManager().get("num_lines", 5)]
+        return render_template(
+            "stats.html",
+            top_5_commands=top_5_commands,
+            top_5_line_farmers=top_5_line_farmers,
+            top_100_emotes=top_100_emotes,
+            top_stream_emotes=top_stream_emotes,
+        )
 
     @app.route("/stats/duels")
     def stats_duels():
-        with DBManager.create_session_scope() as db_session:
-            data = {
-                "top_5_winners": db_session.query(UserDuelStats).order_by(UserDuelStats.duels_won.desc())[:5],
-                "top_5_points_won": db_session.query(UserDuelStats).order_by(UserDuelStats.profit.desc())[:5],
-                "top_5_points_lost": db_session.query(UserDuelStats).order_by(UserDuelStats.profit.asc())[:5],
-                "top_5_losers": db_session.query(UserDuelStats).order_by(UserDuelStats.duels_lost.desc())[:5],
-                "top_5_winrate": db_session.query(UserDuelStats)
-                .filter(UserDuelStats.duels_won >= 5)
-                .order_by(UserDuelStats.winrate.desc())
-                .order_by(UserDuelStats.duels_won.desc())[:5],
-                "bottom_5_winrate": db_session.query(UserDuelStats)
-                .filter(UserDuelStats.duels_lost >= 5)
-                .order_by(UserDuelStats.winrate.asc())
-                .order_by(UserDuelStats.duels_won.asc())[:5],
-            }
+        leaderboards = LeaderboardManager()
+        data = {
+            key: [stats for stats, _ in leaderboards.get(name, 5)]
+            for key, name in [
+                ("top_5_winners", "duel_won"),
+                ("top_5_points_won", "duel_points_won"),
+                ("top_5_points_lost", "duel_points_lost"),
+                ("top_5_losers", "duel_lost"),
+                ("top_5_winrate", "duel_winrate"),
+                ("bottom_5_winrate", "duel_winrate_bottom"),
+            ]
+        }
 
-            return render_template("stats_duels.html", **data)
+        return render_template("stats_duels.html", **data)
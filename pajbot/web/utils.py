@@ -1,24 +1,27 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Optional
 
 import datetime
 import json
 import logging
+import time
 from functools import update_wrapper, wraps
 
-import pajbot.exc
-import pajbot.managers
 from pajbot import utils
 from pajbot.apiwrappers.base import BaseAPI
+from pajbot.managers.command_snapshot import CommandSnapshot, get_command_snapshot, get_command_snapshot_version
 from pajbot.managers.db import DBManager
+from pajbot.managers.emote import EcountManager
 from pajbot.managers.redis import RedisManager
 from pajbot.models.module import ModuleManager
+from pajbot.models.stream import Stream
 from pajbot.models.user import User
 from pajbot.streamhelper import StreamHelper
 from pajbot.utils import time_method
 
-from flask import abort, make_response, session
+from flask import abort, make_response, request, session
+from flask.typing import ResponseReturnValue
 
 if TYPE_CHECKING:
     from pajbot.apiwrappers.twitch.helix import TwitchHelixAPI
@@ -114,50 +117,82 @@ def download_sub_badge(twitch_helix_api: TwitchHelixAPI, streamer: UserBasics, s
         subscriber_badge_file.write(subscriber_badge_bytes)
 
 
+# Top emotes are cached for this many seconds
+TOP_EMOTES_CACHE_TIME = 10
+# redis key -> (when the cached entry expires, top emotes)
+_top_emotes_cache: dict[str, tuple[float, list[dict[str, str]]]] = {}
+# (when the cached entry expires, ID of the current or last stream)
+_last_stream_id: Optional[tuple[float, Optional[int]]] = None
+
+
+def _get_top_emotes(redis_key: str, num_emotes: int) -> list[dict[str, str]]:
+    now = time.monotonic()
+    cached = _top_emotes_cache.get(redis_key, None)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    top_emotes_list = [
+        {"emote_name": emote, "emote_count": str(int(emote_count))}
+        for emote, emote_count in RedisManager.get().zrevrange(redis_key, 0, num_emotes - 1, withscores=True)
+    ]
+
+    for key in [key for key, (expires_at, _) in _top_emotes_cache.items() if expires_at <= now]:
+        _top_emotes_cache.pop(key, None)
+    _top_emotes_cache[redis_key] = (now + TOP_EMOTES_CACHE_TIME, top_emotes_list)
+
+    return top_emotes_list
+
+
 def get_top_emotes() -> list[dict[str, str]]:
+    return _get_top_emotes(EcountManager.get_count_key(StreamHelper.get_streamer()), 100)
+
+
+def get_top_stream_emotes() -> list[dict[str, str]]:
+    """The top emotes of the current (or last) stream, if the bot counts emotes per stream"""
+    global _last_stream_id
+
+    now = time.monotonic()
+    if _last_stream_id is None or _last_stream_id[0] <= now:
+        with DBManager.create_session_scope() as db_session:
+            stream_id = db_session.query(Stream.id).order_by(Stream.id.desc()).limit(1).scalar()
+        _last_stream_id = (now + TOP_EMOTES_CACHE_TIME, stream_id)
+
+    stream_id = _last_stream_id[1]
+    if stream_id is None:
+        return []
+
+    return _get_top_emotes(EcountManager.get_stream_count_key(StreamHelper.get_streamer(), stream_id), 100)
+
+
+# The last command snapshot this web worker read from redis, reused until a new one is published
+_command_snapshot: Optional[CommandSnapshot] = None
+
+
+def get_cached_command_snapshot() -> CommandSnapshot:
+    global _command_snapshot
+
     redis = RedisManager.get()
     streamer = StreamHelper.get_streamer()
 
-    top_emotes_list: list[dict[str, str]] = []
-    top_emotes = {  # noqa: C416
-        emote: emote_count
-        for emote, emote_count in sorted(
-            redis.zscan_iter(f"{streamer}:emotes:count"), key=lambda e_ecount_pair: e_ecount_pair[1], reverse=True
-        )[:100]
-    }
-
-    if top_emotes:
-        top_emotes_list.extend(
-            {"emote_name": emote, "emote_count": str(int(emote_count))} for emote, emote_count in top_emotes.items()
-        )
+    snapshot = _command_snapshot
+    if snapshot is not None and get_command_snapshot_version(redis, streamer) == snapshot.version:
+        return snapshot
 
-    return top_emotes_list
+    snapshot = get_command_snapshot(redis, streamer)
+    _command_snapshot = snapshot
+    return snapshot
 
 
 @time_method
 def get_cached_commands() -> list[dict[str, Any]]:
-    CACHE_TIME = 30  # seconds
+    return get_cached_command_snapshot().commands
 
-    redis = RedisManager.get()
-    commands_key = f"{StreamHelper.get_streamer()}:cache:commands"
-    commands = redis.get(commands_key)
-    if commands is not None:
-        cached_bot_command_list = json.loads(commands)
-        if not isinstance(cached_bot_command_list, list):
-            return []
-        return cached_bot_command_list
-
-    log.debug("Updating commands...")
-    bot_commands = pajbot.managers.command.CommandManager(
-        socket_manager=None, module_manager=ModuleManager(None).load(), bot=None
-    ).load(load_examples=True)
-    bot_commands_list = bot_commands.parse_for_web()
-
-    bot_commands_list.sort(key=lambda x: (x.id or -1, x.main_alias))
-    jsonified_bot_commands_list = [c.jsonify() for c in bot_commands_list]
-    redis.setex(commands_key, value=json.dumps(jsonified_bot_commands_list, separators=(",", ":")), time=CACHE_TIME)
-
-    return jsonified_bot_commands_list
+
+def make_conditional_response(rv: ResponseReturnValue, etag: str) -> ResponseReturnValue:
+    """Tag the response with the given ETag, and turn it into a 304 if the client already has that version"""
+    response = make_response(rv)
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
 @time_method
@@ -388,7 +388,12 @@ function connect_to_ws() {
 
         let json_data = JSON.parse(e.data);
         console.log('Received data:', json_data);
-        handleWebsocketData(json_data);
+        // Events that were emitted close together are sent as one array
+        if (Array.isArray(json_data)) {
+            json_data.forEach(handleWebsocketData);
+        } else {
+            handleWebsocketData(json_data);
+        }
     };
     socket.onclose = function(e) {
         console.log(
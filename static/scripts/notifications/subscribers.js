@@ -33,26 +33,30 @@ function connect_to_ws() {
     socket.onmessage = function(e) {
         if (typeof e.data == 'string') {
             var json_data = JSON.parse(e.data);
-            if (json_data['event'] !== undefined) {
-                switch (json_data['event']) {
-                    case 'new_sub':
-                        var message =
-                            '<strong>' +
-                            json_data.data.username +
-                            '</strong> - new';
-                        add_subs_notification(message);
-                        break;
-                    case 'resub':
-                        var message =
-                            '<strong>' +
-                            json_data.data.username +
-                            '</strong> - <strong>' +
-                            json_data.data.num_months +
-                            '</strong> months';
-                        add_subs_notification(message);
-                        break;
+            // Events that were emitted close together are sent as one array
+            var events = Array.isArray(json_data) ? json_data : [json_data];
+            events.forEach(function(json_data) {
+                if (json_data['event'] !== undefined) {
+                    switch (json_data['event']) {
+                        case 'new_sub':
+                            var message =
+                                '<strong>' +
+                                json_data.data.username +
+                                '</strong> - new';
+                            add_subs_notification(message);
+                            break;
+                        case 'resub':
+                            var message =
+                                '<strong>' +
+                                json_data.data.username +
+                                '</strong> - <strong>' +
+                                json_data.data.num_months +
+                                '</strong> months';
+                            add_subs_notification(message);
+                            break;
+                    }
                 }
-            }
+            });
         }
     };
 